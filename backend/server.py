@@ -1,27 +1,47 @@
 from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Query
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Awaitable, AsyncIterator
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import io
+import tempfile
+import glob
+import hashlib
+import gzip
+import bisect
+import zlib
+import heapq
+import math
+from collections import Counter
+import re
+import zipfile
 import PyPDF2
 import httpx
 import json
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import psutil
 import subprocess
+import shutil
 import sys
 import pkg_resources
 from typing import Union
 import asyncio
 import time
 import threading
+import signal
+import contextvars
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -159,7 +179,138 @@ client = AsyncIOMotorClient(MONGO_URL)
 db = client[DB_NAME]
 
 # OpenRouter API configuration
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")
+
+# One pooled HTTP client for all outbound provider and health traffic, so calls reuse warm connections
+HTTP_CLIENT_HTTP2 = os.environ.get('HTTP_CLIENT_HTTP2', 'true').lower() in ('1', 'true', 'yes')  # Needs the h2 package
+HTTP_CLIENT_MAX_CONNECTIONS = int(os.environ.get('HTTP_CLIENT_MAX_CONNECTIONS', '100'))
+HTTP_CLIENT_MAX_KEEPALIVE = int(os.environ.get('HTTP_CLIENT_MAX_KEEPALIVE', '20'))
+HTTP_CLIENT_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_CLIENT_KEEPALIVE_EXPIRY', '60'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '120'))  # Long enough for a full completion
+HTTP_POOL_TIMEOUT = float(os.environ.get('HTTP_POOL_TIMEOUT', '10'))  # Waiting for a free connection
+
+http_client: Optional[httpx.AsyncClient] = None
+
+# PDF extraction runs in a process pool so parsing never blocks the event loop
+PDF_EXTRACTION_WORKERS = int(os.environ.get('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1))
+PDF_EXTRACTION_QUEUE_SIZE = int(os.environ.get('PDF_EXTRACTION_QUEUE_SIZE', '16'))  # Jobs allowed to wait for a worker
+PDF_EXTRACTION_TIMEOUT = float(os.environ.get('PDF_EXTRACTION_TIMEOUT', '120'))  # Seconds per extraction job
+# 'processing' documents not updated for this long are treated as abandoned (crash or kill mid-ingest)
+PDF_INGEST_STALE_SECONDS = float(os.environ.get('PDF_INGEST_STALE_SECONDS', str(max(900.0, PDF_EXTRACTION_TIMEOUT * 2))))
+
+# Uploads are streamed to disk in fixed-size chunks instead of being held in memory
+MAX_PDF_UPLOAD_SIZE_MB = int(os.environ.get('MAX_PDF_UPLOAD_SIZE_MB', '100'))
+PDF_UPLOAD_CHUNK_SIZE = int(os.environ.get('PDF_UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+PDF_UPLOAD_SPOOL_DIR = os.environ.get('PDF_UPLOAD_SPOOL_DIR') or tempfile.gettempdir()
+
+# Extraction backends in preference order: pypdf2, pypdf, pdfminer, pdftotext.
+# Backends that aren't installed are skipped; the next one is used if a backend fails on a file.
+PDF_EXTRACTION_BACKENDS = [b.strip().lower() for b in os.environ.get('PDF_EXTRACTION_BACKENDS', 'pypdf2').split(',') if b.strip()]
+
+# Large PDFs are split into page ranges that are extracted on several workers at once
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.environ.get('PDF_PARALLEL_PAGE_THRESHOLD', '50'))
+PDF_MIN_PAGES_PER_TASK = int(os.environ.get('PDF_MIN_PAGES_PER_TASK', '20'))
+
+# Extracted pages are cached on disk by file hash and extractor version, shared across workers and restarts
+PDF_EXTRACTION_CACHE_DIR = os.environ.get('PDF_EXTRACTION_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'chatpdf-extraction-cache')
+PDF_EXTRACTION_CACHE_MAX_MB = int(os.environ.get('PDF_EXTRACTION_CACHE_MAX_MB', '512'))  # 0 disables the cache
+
+# Ingestion commits a short first range so chat can start on the opening pages
+PDF_PROGRESSIVE_FIRST_PAGES = int(os.environ.get('PDF_PROGRESSIVE_FIRST_PAGES', '5'))
+
+# Extracted text is stored per page and per chunk so features can load only the slices they need
+PDF_TEXT_NORMALIZATION = os.environ.get('PDF_TEXT_NORMALIZATION', 'true').lower() in ('true', '1', 'yes')
+PDF_CHUNK_SIZE_TOKENS = int(os.environ.get('PDF_CHUNK_SIZE_TOKENS', '500'))
+TOKENIZER_ENCODING = os.environ.get('TOKENIZER_ENCODING', 'cl100k_base')
+
+# Retrieval: chat turns pull the BM25 top-k chunks for the question instead of the opening of the document
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', '8'))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Local vector index: hashed word and character n-gram embeddings, one float16 .npy matrix per document,
+# memory-mapped for search. Needs numpy; without it retrieval uses BM25 only.
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR') or os.path.join(tempfile.gettempdir(), 'chatpdf-vector-index')
+VECTOR_DIMENSIONS = int(os.environ.get('VECTOR_DIMENSIONS', '512'))
+VECTOR_SEARCH_BATCH_ROWS = int(os.environ.get('VECTOR_SEARCH_BATCH_ROWS', '4096'))
+VECTOR_INDEX_TEMP_MAX_AGE = 3600  # Seconds; younger temp files may still be being written by another worker
+RRF_K = 60  # Reciprocal rank fusion constant for combining BM25 and vector rankings
+
+# Prompt packing: document context is filled from stored chunk token counts up to a per-model budget
+PDF_CONTEXT_MAX_TOKENS = int(os.environ.get('PDF_CONTEXT_MAX_TOKENS', '3000'))
+AI_RESPONSE_MAX_TOKENS = 2000
+DEFAULT_MODEL_CONTEXT_TOKENS = 8192  # Conservative window for models not listed below
+MODEL_CONTEXT_TOKENS = {
+    "claude-3-opus-20240229": 200000,
+    "claude-3-sonnet-20240229": 200000,
+    "claude-3-haiku-20240307": 200000,
+    "gemini-2.5-flash-preview-04-17": 1048576,
+    "gemini-2.5-pro-preview-05-06": 1048576,
+    "gemini-2.0-flash": 1048576,
+    "gemini-2.0-flash-lite": 1048576,
+    "gemini-1.5-flash": 1048576,
+    "gemini-1.5-flash-8b": 1048576,
+    "gemini-1.5-pro": 2097152
+}
+
+# Guards against malformed or image-heavy PDFs: each worker gets an address-space cap, each document a page limit,
+# and every pool call is interrupted inside the worker once the job's deadline passes
+PDF_WORKER_MAX_MEMORY_MB = int(os.environ.get('PDF_WORKER_MAX_MEMORY_MB', '1536'))  # On top of the worker's size at start; 0 disables the cap
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '2000'))  # 0 disables the limit
+
+pdf_job_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('pdf_job_deadline', default=None)
+
+pdf_extraction_pool: Optional[ProcessPoolExecutor] = None
+pdf_extraction_slots: Optional[asyncio.Semaphore] = None
+
+# Batch uploads: many PDFs (or a zip of PDFs) in one request, processed concurrently
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES', '100'))
+BATCH_UPLOAD_MAX_ZIP_EXTRACTED_MB = int(os.environ.get('BATCH_UPLOAD_MAX_ZIP_EXTRACTED_MB', '1024'))  # Decompressed PDFs per zip
+BATCH_UPLOAD_CONCURRENCY = int(os.environ.get('BATCH_UPLOAD_CONCURRENCY', str(max(1, PDF_EXTRACTION_WORKERS))))
+
+# Background ingestion: uploads with ?async=true return 202 and are processed by these workers
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '2'))
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', '100'))
+
+ingest_queue: Optional[asyncio.Queue] = None
+ingest_worker_tasks: List[asyncio.Task] = []
+
+# Map-reduce research: the document is split into segments analysed concurrently, then merged into one report
+RESEARCH_MAP_SEGMENT_TOKENS = int(os.environ.get('RESEARCH_MAP_SEGMENT_TOKENS', '3000'))
+RESEARCH_MAX_MAP_SEGMENTS = int(os.environ.get('RESEARCH_MAX_MAP_SEGMENTS', '48'))  # Larger documents get larger segments
+RESEARCH_JOB_STALE_SECONDS = float(os.environ.get('RESEARCH_JOB_STALE_SECONDS', '1800'))  # Unfinished jobs idle this long are failed at startup
+
+
+# Fan-out AI calls (research segments, translation chunks) share these limits
+background_ai_tasks: set = set()  # Research runs and translation saves, kept referenced until they finish
+# Concurrent calls per API key; RESEARCH_CALLS_PER_KEY is the name it had when only research fanned out
+AI_CALLS_PER_KEY = int(os.environ.get('AI_CALLS_PER_KEY', os.environ.get('RESEARCH_CALLS_PER_KEY', '2')))
+AI_CALL_MAX_RETRIES = int(os.environ.get('AI_CALL_MAX_RETRIES', '3'))  # Retries per call after every key has failed
+AI_CALL_RETRY_BACKOFF_SECONDS = float(os.environ.get('AI_CALL_RETRY_BACKOFF_SECONDS', '1.0'))  # Doubled on each retry
+
+# Full-document translation: paragraphs are packed into chunks that fit the response limit once translated
+TRANSLATION_CHUNK_TOKENS = int(os.environ.get('TRANSLATION_CHUNK_TOKENS', '800'))
+TRANSLATION_MAX_FAILED_RATIO = float(os.environ.get('TRANSLATION_MAX_FAILED_RATIO', '0.25'))  # More failed chunks fail the translation
+
+# Conversation memory: recent turns are replayed verbatim within a token budget, older ones live in a rolling summary
+CONVERSATION_HISTORY_MAX_TOKENS = int(os.environ.get('CONVERSATION_HISTORY_MAX_TOKENS', '1500'))
+CONVERSATION_SUMMARY_MAX_WORDS = int(os.environ.get('CONVERSATION_SUMMARY_MAX_WORDS', '250'))
+CONVERSATION_SUMMARY_MODEL = os.environ.get('CONVERSATION_SUMMARY_MODEL')  # Defaults to the model of the chat turn
+
+# Document summaries: generated once per file in the background after ingestion and reused by features
+DOCUMENT_SUMMARY_ENABLED = os.environ.get('DOCUMENT_SUMMARY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DOCUMENT_SUMMARY_MODEL = os.environ.get('DOCUMENT_SUMMARY_MODEL')  # Default: Claude 3 Haiku, or Gemini 1.5 Flash without OpenRouter keys
+DOCUMENT_SUMMARY_MAX_WORDS = int(os.environ.get('DOCUMENT_SUMMARY_MAX_WORDS', '400'))
+DOCUMENT_SUMMARY_STALE_SECONDS = float(os.environ.get('DOCUMENT_SUMMARY_STALE_SECONDS', '900'))  # A generation idle this long is taken over
+DOCUMENT_SUMMARY_RETRY_SECONDS = float(os.environ.get('DOCUMENT_SUMMARY_RETRY_SECONDS', '300'))  # First retry after a failure, doubled per failure
+DOCUMENT_SUMMARY_MAX_RETRY_SECONDS = float(os.environ.get('DOCUMENT_SUMMARY_MAX_RETRY_SECONDS', '86400'))
+
+# Multi-document sessions: uploads with ?append=true attach another PDF instead of replacing the current one
+SESSION_MAX_DOCUMENTS = int(os.environ.get('SESSION_MAX_DOCUMENTS', '20'))
+
+# Quizzes and questions sample the whole document: one concurrent generation per section, merged at the end
+COVERAGE_MAX_SECTIONS = int(os.environ.get('COVERAGE_MAX_SECTIONS', '6'))
 
 # Create the main app
 app = FastAPI(title="Baloch AI chat PdF & GPT API", version="2.0.0")
@@ -180,6 +331,25 @@ def is_gemini_model(model: str) -> bool:
     ]
     return model in gemini_models
 
+def create_http_client() -> httpx.AsyncClient:
+    """A pooled client with keep-alive, HTTP/2 when available and explicit timeouts"""
+    return httpx.AsyncClient(
+        http2=HTTP_CLIENT_HTTP2 and _module_available("h2"),
+        limits=httpx.Limits(
+            max_connections=HTTP_CLIENT_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_CLIENT_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_CLIENT_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+    )
+
+def get_http_client() -> httpx.AsyncClient:
+    """The application-wide client; created on first use outside the server (scripts, benchmarks)"""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
 async def get_ai_response_gemini(messages: List[Dict], model: str) -> str:
     """Handle Gemini API requests using emergentintegrations with load balancing and fallback"""
     if not GEMINI_API_KEYS:
@@ -244,27 +414,26 @@ async def get_ai_response_openrouter(messages: List[Dict], model: str) -> str:
         api_key = get_next_openrouter_key()
         
         try:
-            # Use OpenRouter API
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{OPENROUTER_BASE_URL}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {api_key}",
-                        "HTTP-Referer": "https://github.com/baloch/chatpdf",
-                        "X-Title": "ChatPDF App"
-                    },
-                    json={
-                        "model": model,
-                        "messages": chat_messages,
-                        "system": system_message,
-                        "max_tokens": 2000,
-                        "temperature": 0.7
-                    }
-                )
-                response.raise_for_status()
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-                
+            # Use OpenRouter API over the shared connection pool
+            response = await get_http_client().post(
+                f"{OPENROUTER_BASE_URL}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "HTTP-Referer": "https://github.com/baloch/chatpdf",
+                    "X-Title": "ChatPDF App"
+                },
+                json={
+                    "model": model,
+                    "messages": chat_messages,
+                    "system": system_message,
+                    "max_tokens": AI_RESPONSE_MAX_TOKENS,
+                    "temperature": 0.7
+                }
+            )
+            response.raise_for_status()
+            result = response.json()
+            return result["choices"][0]["message"]["content"]
+            
         except Exception as e:
             last_error = e
             logger.warning(f"OpenRouter API key {api_key[-10:]}... failed (attempt {attempt + 1}/{len(OPENROUTER_API_KEYS)}): {str(e)}")
@@ -297,6 +466,94 @@ async def get_ai_response(messages: List[Dict], model: str = "claude-3-opus-2024
         else:
             raise e
 
+async def stream_ai_response_openrouter(messages: List[Dict], model: str) -> AsyncIterator[str]:
+    """Relay an OpenRouter completion as text deltas (stream: true). Keys are rotated like get_ai_response_openrouter
+    until one starts streaming; a failure after the first delta is raised, since the client already has part of the answer."""
+    if not OPENROUTER_API_KEYS:
+        raise HTTPException(status_code=500, detail="No OpenRouter API keys configured")
+    
+    system_message = next((msg["content"] for msg in messages if msg["role"] == "system"), None)
+    chat_messages = [{"role": msg["role"], "content": msg["content"]} for msg in messages if msg["role"] != "system"]
+    last_error = None
+    
+    for attempt in range(len(OPENROUTER_API_KEYS)):
+        api_key = get_next_openrouter_key()
+        started = False
+        try:
+            async with get_http_client().stream(
+                "POST",
+                f"{OPENROUTER_BASE_URL}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {api_key}",
+                    "HTTP-Referer": "https://github.com/baloch/chatpdf",
+                    "X-Title": "ChatPDF App"
+                },
+                json={
+                    "model": model,
+                    "messages": chat_messages,
+                    "system": system_message,
+                    "max_tokens": AI_RESPONSE_MAX_TOKENS,
+                    "temperature": 0.7,
+                    "stream": True
+                }
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    # SSE data lines; OpenRouter also sends ": keep-alive" comments
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+                    chunk = json.loads(data)
+                    if chunk.get("error"):
+                        raise RuntimeError(chunk["error"].get("message", "stream error"))
+                    delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                    if delta:
+                        started = True
+                        yield delta
+            return
+        except Exception as e:
+            if started:
+                raise
+            last_error = e
+            logger.warning(f"OpenRouter API key {api_key[-10:]}... failed to stream (attempt {attempt + 1}/{len(OPENROUTER_API_KEYS)}): {str(e)}")
+    
+    raise HTTPException(status_code=500, detail=f"All OpenRouter API keys failed. Last error: {str(last_error)}")
+
+async def stream_ai_response(messages: List[Dict], model: str = "claude-3-opus-20240229") -> AsyncIterator[str]:
+    """Text deltas of a response. OpenRouter models stream token by token; Gemini (emergentintegrations has no
+    streaming API) and provider fallbacks arrive as a single delta."""
+    if not is_gemini_model(model) and OPENROUTER_API_KEYS:
+        started = False
+        try:
+            async for delta in stream_ai_response_openrouter(messages, model):
+                started = True
+                yield delta
+            return
+        except Exception as e:
+            if started:
+                raise
+            logger.warning(f"Streaming from {model} failed, falling back to a full response: {str(e)}")
+    yield await get_ai_response(messages, model)
+
+def ai_call_concurrency(model: str) -> int:
+    """Concurrent calls for fan-out work: a few per API key of the provider serving this model"""
+    keys = GEMINI_API_KEYS if is_gemini_model(model) else OPENROUTER_API_KEYS
+    return max(1, len(keys) * max(1, AI_CALLS_PER_KEY))
+
+async def get_ai_response_with_retries(messages: List[Dict], model: str) -> str:
+    """get_ai_response with exponential backoff, for calls that are one part of a larger job"""
+    for attempt in range(AI_CALL_MAX_RETRIES + 1):
+        try:
+            return await get_ai_response(messages, model)
+        except Exception as e:
+            if attempt == AI_CALL_MAX_RETRIES:
+                raise
+            delay = AI_CALL_RETRY_BACKOFF_SECONDS * 2 ** attempt
+            logger.warning(f"AI call failed (attempt {attempt + 1}/{AI_CALL_MAX_RETRIES + 1}), retrying in {delay:.1f}s: {str(e)}")
+            await asyncio.sleep(delay)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -304,6 +561,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def ensure_database_indexes():
+    """Create the indexes the upload and document lookups rely on"""
+    try:
+        # Sparse so documents stored before hashing was introduced don't collide on a missing hash
+        await db.pdf_documents.create_index("content_hash", unique=True, sparse=True)
+        await db.pdf_documents.create_index("id", unique=True)
+        await db.pdf_pages.create_index([("document_id", 1), ("page_number", 1)], unique=True)
+        await db.pdf_chunks.create_index([("document_id", 1), ("chunk_index", 1)], unique=True)
+        await db.pdf_chunks.create_index([("document_id", 1), ("start_offset", 1)])
+        await db.pdf_postings.create_index([("document_id", 1), ("term", 1)], unique=True)
+        await db.pdf_outline.create_index([("document_id", 1), ("heading_index", 1)], unique=True)
+        await db.pdf_outline.create_index([("document_id", 1), ("title_key", 1)])
+        await db.pdf_outline.create_index([("document_id", 1), ("start_offset", 1)])
+        await db.ingest_jobs.create_index("id", unique=True)
+        await db.research_jobs.create_index("id", unique=True)
+        await db.chat_messages.create_index([("session_id", 1), ("timestamp", -1)])
+        await db.pdf_summaries.create_index([("summary_key", 1), ("version", 1)], unique=True)
+        logger.info("🗂️  Database indexes ready")
+    except Exception as e:
+        logger.warning(f"Could not create database indexes: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("🚀 Baloch AI chat PdF & GPT Backend starting up...")
@@ -317,13 +595,40 @@ async def startup_event():
     if GEMINI_API_KEYS:
         for i, key in enumerate(GEMINI_API_KEYS, 1):
             logger.info(f"   Gemini Key {i}: ...{key[-10:]}")
+    await ensure_database_indexes()
+    await fail_interrupted_ingestions()
+    await fail_interrupted_research_jobs()
+    await prune_vector_indexes()
+    start_pdf_extraction_pool()
+    logger.info(f"📄 PDF extraction pool: {PDF_EXTRACTION_WORKERS} workers, queue size {PDF_EXTRACTION_QUEUE_SIZE}, timeout {PDF_EXTRACTION_TIMEOUT:.0f}s")
+    usable_backends = available_pdf_extraction_backends()
+    if usable_backends:
+        logger.info(f"📄 PDF extraction backends: {', '.join(usable_backends)}")
+    else:
+        logger.warning(f"⚠️ None of the configured PDF extraction backends are available: {', '.join(PDF_EXTRACTION_BACKENDS)}")
+    # Probing backend versions can run a subprocess (pdftotext -v), so it happens once here, off the event loop
+    await asyncio.to_thread(pdf_extractor_version)
+    start_ingest_workers()
+    await recover_ingest_jobs()
+    logger.info(f"📥 Ingestion workers: {INGEST_WORKERS}, queue size {INGEST_QUEUE_SIZE}")
+    get_http_client()
+    http_version = "HTTP/2" if HTTP_CLIENT_HTTP2 and _module_available("h2") else "HTTP/1.1"
+    logger.info(f"🌐 HTTP client: {http_version}, {HTTP_CLIENT_MAX_CONNECTIONS} connections ({HTTP_CLIENT_MAX_KEEPALIVE} kept alive), read timeout {HTTP_READ_TIMEOUT:.0f}s")
     logger.info("✅ Baloch AI chat PdF & GPT Backend ready!")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     logger.info("🛑 Shutting down Baloch AI chat PdF & GPT Backend...")
+    for task in ingest_worker_tasks + list(background_ai_tasks):
+        task.cancel()
     client.close()
     logger.info("✅ Database connection closed")
+    if http_client:
+        await http_client.aclose()
+        logger.info("✅ HTTP client closed")
+    if pdf_extraction_pool:
+        pdf_extraction_pool.shutdown(wait=False, cancel_futures=True)
+        logger.info("✅ PDF extraction pool stopped")
 
 # Health check models
 class HealthMetrics(BaseModel):
@@ -620,7 +925,15 @@ class ChatMessage(BaseModel):
     content: str
     role: str  # 'user' or 'assistant'
     timestamp: datetime = Field(default_factory=datetime.utcnow)
-    feature_type: str = "chat"  # 'chat', 'qa_generation', 'general_ai', 'research'
+    feature_type: str = "chat"  # 'chat', 'qa_generation', 'general_ai', 'research', 'compare'
+    token_count: Optional[int] = None  # Counted once when stored, for packing conversation history
+
+class SessionDocument(BaseModel):
+    document_id: str
+    filename: str
+    page_count: Optional[int] = None
+    ingested_pages: Optional[int] = None
+    added_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ChatSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -628,7 +941,10 @@ class ChatSession(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     pdf_filename: Optional[str] = None
-    pdf_content: Optional[str] = None
+    pdf_document_id: Optional[str] = None  # Text lives in pdf_documents, loaded only when a feature needs it
+    pdf_page_count: Optional[int] = None
+    ingested_pages: Optional[int] = None  # Pages of the PDF already available to chat and features
+    documents: List[SessionDocument] = Field(default_factory=list)  # Every attached PDF; the pdf_* fields describe the latest
 
 class PDFDocument(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -636,6 +952,47 @@ class PDFDocument(BaseModel):
     content: str
     upload_date: datetime = Field(default_factory=datetime.utcnow)
     file_size: int
+    content_hash: Optional[str] = None  # SHA-256 of the uploaded file, used to deduplicate uploads
+    status: str = "ready"  # 'processing', 'ready', 'failed'
+    error: Optional[str] = None
+    content_length: Optional[int] = None
+    page_count: Optional[int] = None
+    ingested_pages: Optional[int] = None  # Pages committed so far while status is 'processing'
+    normalization_bytes_saved: Optional[int] = None  # Removed by header/footer, hyphenation and whitespace cleanup
+    normalization_tokens_saved: Optional[int] = None
+    chunk_count: Optional[int] = None  # Page/chunk records live in pdf_pages and pdf_chunks
+    token_count: Optional[int] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow)  # Moved forward on every commit while processing
+
+class IngestJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: str
+    filename: str
+    file_size: int
+    status: str = "queued"  # 'queued', 'processing', 'completed', 'failed'
+    pages_done: int = 0
+    pages_total: Optional[int] = None
+    document_id: Optional[str] = None
+    error: Optional[str] = None
+    # Enough of the queued task to re-enqueue it after a restart
+    spool_path: Optional[str] = None
+    content_hash: Optional[str] = None
+    append: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ResearchJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: str
+    research_type: str
+    mode: str  # 'single', 'map_reduce'
+    status: str = "queued"  # 'queued', 'mapping', 'reducing', 'completed', 'failed'
+    segments_done: int = 0
+    segments_total: Optional[int] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class SendMessageRequest(BaseModel):
     session_id: str
@@ -647,6 +1004,7 @@ class ResearchRequest(BaseModel):
     session_id: str
     research_type: str = "summary"  # 'summary', 'detailed_research'
     model: str = "claude-3-opus-20240229"
+    mode: str = "auto"  # 'auto', 'single', 'map_reduce' - auto maps detailed research over documents too large for one prompt
 
 class CreateSessionRequest(BaseModel):
     title: str = "New Chat"
@@ -668,7 +1026,7 @@ class GenerateQuizRequest(BaseModel):
 class TranslateRequest(BaseModel):
     session_id: str
     target_language: str
-    content_type: str = "full"  # 'full', 'summary'
+    content_type: str = "full"  # 'full', 'summary', 'document' (the whole document, translated chunk by chunk)
     model: str = "claude-3-opus-20240229"
 
 class SearchRequest(BaseModel):
@@ -753,16 +1111,15 @@ async def check_api_keys_health() -> tuple[bool, str, dict]:
     if OPENROUTER_API_KEYS:
         for i, api_key in enumerate(OPENROUTER_API_KEYS, 1):
             try:
-                async with httpx.AsyncClient() as client_http:
-                    response = await client_http.get(
-                        f"{OPENROUTER_BASE_URL}/models",
-                        headers={"Authorization": f"Bearer {api_key}"},
-                        timeout=10.0
-                    )
-                    if response.status_code == 200:
-                        api_status["openrouter"]["valid"].append(f"Key {i}")
-                    else:
-                        api_status["openrouter"]["errors"].append(f"Key {i}: HTTP {response.status_code}")
+                response = await get_http_client().get(
+                    f"{OPENROUTER_BASE_URL}/models",
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    timeout=10.0
+                )
+                if response.status_code == 200:
+                    api_status["openrouter"]["valid"].append(f"Key {i}")
+                else:
+                    api_status["openrouter"]["errors"].append(f"Key {i}: HTTP {response.status_code}")
             except Exception as e:
                 api_status["openrouter"]["errors"].append(f"Key {i}: {str(e)}")
     else:
@@ -1113,16 +1470,15 @@ async def check_api_keys_health() -> tuple[bool, str, dict]:
     # Check OpenRouter API
     if OPENROUTER_API_KEY:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{OPENROUTER_BASE_URL}/models",
-                    headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"},
-                    timeout=10.0
-                )
-                if response.status_code == 200:
-                    api_status["openrouter"]["valid"] = True
-                else:
-                    api_status["openrouter"]["error"] = f"HTTP {response.status_code}"
+            response = await get_http_client().get(
+                f"{OPENROUTER_BASE_URL}/models",
+                headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"},
+                timeout=10.0
+            )
+            if response.status_code == 200:
+                api_status["openrouter"]["valid"] = True
+            else:
+                api_status["openrouter"]["error"] = f"HTTP {response.status_code}"
         except Exception as e:
             api_status["openrouter"]["error"] = str(e)
     else:
@@ -1351,112 +1707,2188 @@ async def perform_comprehensive_health_check() -> SystemHealthStatus:
     )
 
 # PDF Processing Functions
-async def extract_text_from_pdf(file_content: bytes) -> str:
+def start_pdf_extraction_pool():
+    """Create (or recreate) the process pool and the bounded job queue used for PDF extraction"""
+    global pdf_extraction_pool, pdf_extraction_slots
+    if pdf_extraction_pool:
+        pdf_extraction_pool.shutdown(wait=False, cancel_futures=True)
+    pdf_extraction_pool = ProcessPoolExecutor(
+        max_workers=max(1, PDF_EXTRACTION_WORKERS),
+        initializer=_init_pdf_worker,
+        initargs=(PDF_WORKER_MAX_MEMORY_MB,)
+    )
+    if pdf_extraction_slots is None:
+        pdf_extraction_slots = asyncio.Semaphore(max(1, PDF_EXTRACTION_WORKERS) + max(0, PDF_EXTRACTION_QUEUE_SIZE))
+
+def _init_pdf_worker(max_memory_mb: int):
+    """Cap the worker's address space so a runaway PDF raises MemoryError in the worker instead of
+    growing until the host kills it. A forked worker inherits the server's whole address space (libraries,
+    thread stacks, mapped files), so the cap is what extraction may add on top of the worker's current size."""
+    if max_memory_mb <= 0:
+        return
+    try:
+        import resource
+        limit = psutil.Process().memory_info().vms + max_memory_mb * 1024 * 1024
+        soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    except (ImportError, ValueError, OSError, psutil.Error) as e:
+        logger.warning(f"⚠️ Could not cap PDF worker memory: {str(e)}")
+
+def _run_with_deadline(time_limit: Optional[float], func, *args):
+    """Run func in a pool worker, raising TimeoutError inside it once time_limit seconds pass"""
+    if not time_limit:
+        return func(*args)
+    
+    def on_deadline(signum, frame):
+        raise TimeoutError("PDF extraction deadline exceeded")
+    
+    previous_handler = signal.signal(signal.SIGALRM, on_deadline)
+    signal.setitimer(signal.ITIMER_REAL, max(0.01, time_limit))
     try:
-        pdf_file = io.BytesIO(file_content)
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+# PDF extraction backends. Each one counts pages and extracts a page range; optional libraries are imported
+# lazily inside the worker so a deployment only needs the backends it actually configures.
+def _pypdf2_count_pages(pdf_path: str) -> int:
+    with open(pdf_path, "rb") as pdf_file:
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+def _pypdf2_extract_range(pdf_path: str, start_page: int, end_page: int) -> List[str]:
+    # Hand PyPDF2 an open file rather than a path so objects are read on demand from disk
+    with open(pdf_path, "rb") as pdf_file:
         pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing PDF: {str(e)}")
+        end_page = min(end_page, len(pdf_reader.pages))
+        return [(pdf_reader.pages[i].extract_text() or "") for i in range(start_page, end_page)]
 
-# API Routes
-@api_router.post("/sessions", response_model=ChatSession)
-async def create_session(request: CreateSessionRequest):
-    session = ChatSession(
-        title=request.title
+def _pypdf_count_pages(pdf_path: str) -> int:
+    import pypdf
+    with open(pdf_path, "rb") as pdf_file:
+        return len(pypdf.PdfReader(pdf_file).pages)
+
+def _pypdf_extract_range(pdf_path: str, start_page: int, end_page: int) -> List[str]:
+    import pypdf
+    with open(pdf_path, "rb") as pdf_file:
+        pdf_reader = pypdf.PdfReader(pdf_file)
+        end_page = min(end_page, len(pdf_reader.pages))
+        return [(pdf_reader.pages[i].extract_text() or "") for i in range(start_page, end_page)]
+
+def _pdfminer_count_pages(pdf_path: str) -> int:
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdfdocument import PDFDocument as PDFMinerDocument
+    from pdfminer.pdftypes import resolve1
+    with open(pdf_path, "rb") as pdf_file:
+        document = PDFMinerDocument(PDFParser(pdf_file))
+        return int(resolve1(document.catalog["Pages"])["Count"])
+
+def _pdfminer_extract_range(pdf_path: str, start_page: int, end_page: int) -> List[str]:
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    
+    resource_manager = PDFResourceManager()
+    output = io.StringIO()
+    converter = TextConverter(resource_manager, output, laparams=LAParams())
+    interpreter = PDFPageInterpreter(resource_manager, converter)
+    pages = []
+    try:
+        with open(pdf_path, "rb") as pdf_file:
+            for page in PDFPage.get_pages(pdf_file, pagenos=set(range(start_page, end_page))):
+                interpreter.process_page(page)
+                pages.append(output.getvalue().rstrip("\f"))
+                output.seek(0)
+                output.truncate(0)
+    finally:
+        converter.close()
+    return pages
+
+def _pdftotext_count_pages(pdf_path: str) -> int:
+    result = subprocess.run(["pdfinfo", pdf_path], capture_output=True, text=True, check=True,
+                            timeout=PDF_EXTRACTION_TIMEOUT)
+    for line in result.stdout.splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split(":", 1)[1])
+    raise ValueError("pdfinfo did not report a page count")
+
+def _pdftotext_extract_range(pdf_path: str, start_page: int, end_page: int) -> List[str]:
+    if end_page <= start_page:
+        return []
+    result = subprocess.run(
+        ["pdftotext", "-f", str(start_page + 1), "-l", str(end_page), "-enc", "UTF-8", pdf_path, "-"],
+        capture_output=True, check=True, timeout=PDF_EXTRACTION_TIMEOUT
     )
-    await db.chat_sessions.insert_one(session.dict())
-    return session
+    # pdftotext ends every page with a form feed
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    return pages[:-1] if pages and pages[-1] == "" else pages
 
-@api_router.get("/sessions", response_model=List[ChatSession])
-async def get_sessions():
-    sessions = await db.chat_sessions.find().sort("updated_at", -1).to_list(100)
-    return [ChatSession(**session) for session in sessions]
+def _module_available(module_name: str) -> bool:
+    import importlib.util
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
 
-@api_router.post("/sessions/{session_id}/upload-pdf")
-async def upload_pdf(session_id: str, file: UploadFile = File(...)):
-    # Verify session exists
-    session = await db.chat_sessions.find_one({"id": session_id})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    # Validate file type
-    if not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
-    
-    # Read and process PDF
-    file_content = await file.read()
-    pdf_text = await extract_text_from_pdf(file_content)
+def _package_version(distribution: str) -> str:
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version(distribution)
+    except PackageNotFoundError:
+        return "unknown"
+
+def _pdftotext_version() -> str:
+    try:
+        result = subprocess.run(["pdftotext", "-v"], capture_output=True, text=True, timeout=10)
+        output = (result.stderr or result.stdout).strip()
+        return output.splitlines()[0].split()[-1] if output else "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+PDF_EXTRACTION_BACKEND_REGISTRY = {
+    "pypdf2": {
+        "count_pages": _pypdf2_count_pages,
+        "extract_range": _pypdf2_extract_range,
+        "available": lambda: True,
+        "version": lambda: _package_version("PyPDF2")
+    },
+    "pypdf": {
+        "count_pages": _pypdf_count_pages,
+        "extract_range": _pypdf_extract_range,
+        "available": lambda: _module_available("pypdf"),
+        "version": lambda: _package_version("pypdf")
+    },
+    "pdfminer": {
+        "count_pages": _pdfminer_count_pages,
+        "extract_range": _pdfminer_extract_range,
+        "available": lambda: _module_available("pdfminer"),
+        "version": lambda: _package_version("pdfminer.six")
+    },
+    "pdftotext": {
+        "count_pages": _pdftotext_count_pages,
+        "extract_range": _pdftotext_extract_range,
+        "available": lambda: shutil.which("pdftotext") is not None and shutil.which("pdfinfo") is not None,
+        "version": _pdftotext_version
+    }
+}
+
+def available_pdf_extraction_backends(names: Optional[List[str]] = None) -> List[str]:
+    """Configured backends (in preference order) that can run on this machine"""
+    names = names if names is not None else PDF_EXTRACTION_BACKENDS
+    return [name for name in names if name in PDF_EXTRACTION_BACKEND_REGISTRY and PDF_EXTRACTION_BACKEND_REGISTRY[name]["available"]()]
+
+def _run_with_backend_fallback(operation: str, pdf_path: str, *args, backends: Optional[List[str]] = None):
+    """Run a backend operation with the first configured backend, falling back to the next one if it fails on this file"""
+    last_error: Optional[Exception] = None
+    for name in available_pdf_extraction_backends(backends):
+        try:
+            return PDF_EXTRACTION_BACKEND_REGISTRY[name][operation](pdf_path, *args)
+        except Exception as e:
+            logger.warning(f"⚠️ PDF backend {name} failed to {operation.replace('_', ' ')} for {os.path.basename(pdf_path)}: {str(e)}")
+            last_error = e
+    if last_error:
+        raise last_error
+    raise RuntimeError(f"No PDF extraction backend available (configured: {', '.join(backends or PDF_EXTRACTION_BACKENDS)})")
+
+def _count_pdf_pages(pdf_path: str, backends: Optional[List[str]] = None) -> int:
+    """Count pages of a spooled PDF. Runs inside a pool worker process."""
+    return _run_with_backend_fallback("count_pages", pdf_path, backends=backends)
+
+def _extract_pdf_page_range(pdf_path: str, start_page: int, end_page: int, backends: Optional[List[str]] = None) -> List[str]:
+    """Extract text for pages [start_page, end_page) of a spooled PDF. Runs inside a pool worker process."""
+    return _run_with_backend_fallback("extract_range", pdf_path, start_page, end_page, backends=backends)
+
+def split_page_ranges(page_count: int, workers: int, min_pages_per_task: int) -> List[tuple[int, int]]:
+    """Split pages into at most `workers` contiguous, evenly sized ranges"""
+    if page_count <= 0:
+        return []
+    task_count = max(1, min(workers, page_count // max(1, min_pages_per_task)))
+    base, extra = divmod(page_count, task_count)
+    ranges = []
+    start = 0
+    for i in range(task_count):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+async def run_in_pdf_pool(func, *args):
+    """Submit a blocking function to the extraction pool, replacing the pool if a worker died"""
+    if pdf_extraction_pool is None:
+        start_pdf_extraction_pool()
+    # Within an extraction job the worker stops itself at the job's deadline rather than running on unobserved
+    deadline = pdf_job_deadline.get()
+    time_limit = max(0.01, deadline - time.monotonic()) if deadline else None
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pdf_extraction_pool, _run_with_deadline, time_limit, func, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory) - replace the pool so later uploads still work
+        logger.error("PDF extraction worker crashed, restarting extraction pool")
+        start_pdf_extraction_pool()
+        raise HTTPException(status_code=500, detail="PDF processing worker crashed while reading this file")
+    except MemoryError:
+        raise HTTPException(status_code=413, detail=f"PDF needs more than {PDF_WORKER_MAX_MEMORY_MB} MB of memory to extract")
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail=f"PDF processing timed out after {PDF_EXTRACTION_TIMEOUT:.0f} seconds")
+
+async def run_pdf_extraction_job(job, reject_when_full: bool = True):
+    """Run an extraction coroutine under the bounded job queue and the per-job timeout"""
+    if pdf_extraction_slots is None:
+        start_pdf_extraction_pool()
+    
+    # Reject instead of piling up work once every worker and queue slot is taken.
+    # Background ingestion workers wait for a slot instead, since nobody is blocked on them.
+    if reject_when_full and pdf_extraction_slots.locked():
+        job.close()
+        raise HTTPException(status_code=503, detail="PDF processing queue is full, please retry shortly")
+    
+    async with pdf_extraction_slots:
+        # wait_for runs the job in a task that copies this context, so pool calls see the deadline
+        deadline_token = pdf_job_deadline.set(time.monotonic() + PDF_EXTRACTION_TIMEOUT)
+        try:
+            return await asyncio.wait_for(job, timeout=PDF_EXTRACTION_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"PDF extraction job exceeded {PDF_EXTRACTION_TIMEOUT:.0f}s timeout")
+            raise HTTPException(status_code=504, detail=f"PDF processing timed out after {PDF_EXTRACTION_TIMEOUT:.0f} seconds")
+        finally:
+            pdf_job_deadline.reset(deadline_token)
+
+async def _extract_pages_in_pool(pdf_path: str) -> List[str]:
+    """Extract all pages, splitting large PDFs into page ranges that run on separate workers"""
+    page_count = await run_in_pdf_pool(_count_pdf_pages, pdf_path)
+    if page_count < PDF_PARALLEL_PAGE_THRESHOLD:
+        ranges = [(0, page_count)]
+    else:
+        ranges = split_page_ranges(page_count, PDF_EXTRACTION_WORKERS, PDF_MIN_PAGES_PER_TASK)
     
-    # Save PDF document
-    pdf_doc = PDFDocument(
-        filename=file.filename,
-        content=pdf_text,
-        file_size=len(file_content)
-    )
-    await db.pdf_documents.insert_one(pdf_doc.dict())
+    range_results = await asyncio.gather(*[
+        run_in_pdf_pool(_extract_pdf_page_range, pdf_path, start, end) for start, end in ranges
+    ])
+    # gather keeps submission order, so pages come back in document order
+    return [page_text for range_pages in range_results for page_text in range_pages]
+
+async def spool_upload_to_disk(file: UploadFile) -> tuple[str, int, str]:
+    """Stream an upload into a temp file chunk by chunk, enforcing the size cap and hashing as it arrives"""
+    max_bytes = MAX_PDF_UPLOAD_SIZE_MB * 1024 * 1024
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"PDF exceeds the {MAX_PDF_UPLOAD_SIZE_MB} MB upload limit")
+    
+    fd, spool_path = tempfile.mkstemp(prefix="chatpdf-upload-", suffix=".pdf", dir=PDF_UPLOAD_SPOOL_DIR)
+    total_size = 0
+    sha256 = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as spool_file:
+            while True:
+                chunk = await file.read(PDF_UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total_size += len(chunk)
+                if total_size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"PDF exceeds the {MAX_PDF_UPLOAD_SIZE_MB} MB upload limit")
+                sha256.update(chunk)
+                spool_file.write(chunk)
+    except BaseException:
+        remove_spooled_upload(spool_path)
+        raise
+    
+    return spool_path, total_size, sha256.hexdigest()
+
+def remove_spooled_upload(spool_path: str):
+    """Delete a spooled upload, ignoring files that are already gone"""
+    try:
+        os.unlink(spool_path)
+    except FileNotFoundError:
+        pass
+
+def _spool_zip_members(zip_path: str, max_files: int) -> List[tuple[str, str, int, str]]:
+    """Copy the PDFs inside a spooled zip to their own spool files. Returns (filename, path, size, sha256) per PDF."""
+    max_bytes = MAX_PDF_UPLOAD_SIZE_MB * 1024 * 1024
+    max_archive_bytes = BATCH_UPLOAD_MAX_ZIP_EXTRACTED_MB * 1024 * 1024
+    archive_too_large = HTTPException(status_code=413, detail=f"Zip expands past the {BATCH_UPLOAD_MAX_ZIP_EXTRACTED_MB} MB extraction limit")
+    spooled = []
+    archive_size = 0
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            members = [
+                info for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(".pdf") and not info.filename.startswith("__MACOSX/")
+            ]
+            if len(members) > max_files:
+                raise HTTPException(status_code=413, detail=f"Zip contains {len(members)} PDFs; the limit is {max_files}")
+            if sum(info.file_size for info in members) > max_archive_bytes:
+                raise archive_too_large
+            
+            for info in members:
+                filename = os.path.basename(info.filename)
+                if info.file_size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{filename} exceeds the {MAX_PDF_UPLOAD_SIZE_MB} MB upload limit")
+                fd, spool_path = tempfile.mkstemp(prefix="chatpdf-upload-", suffix=".pdf", dir=PDF_UPLOAD_SPOOL_DIR)
+                spooled.append((filename, spool_path, 0, ""))
+                total_size = 0
+                sha256 = hashlib.sha256()
+                with os.fdopen(fd, "wb") as spool_file, archive.open(info) as member:
+                    while True:
+                        chunk = member.read(PDF_UPLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        total_size += len(chunk)
+                        archive_size += len(chunk)
+                        # The header sizes can lie, so both caps are enforced on the decompressed bytes too
+                        if total_size > max_bytes:
+                            raise HTTPException(status_code=413, detail=f"{filename} exceeds the {MAX_PDF_UPLOAD_SIZE_MB} MB upload limit")
+                        if archive_size > max_archive_bytes:
+                            raise archive_too_large
+                        sha256.update(chunk)
+                        spool_file.write(chunk)
+                spooled[-1] = (filename, spool_path, total_size, sha256.hexdigest())
+    except zipfile.BadZipFile:
+        for _, spool_path, _, _ in spooled:
+            remove_spooled_upload(spool_path)
+        raise HTTPException(status_code=400, detail="Uploaded zip file is invalid")
+    except BaseException:
+        for _, spool_path, _, _ in spooled:
+            remove_spooled_upload(spool_path)
+        raise
+    return spooled
+
+async def extract_pages_from_pdf(pdf_path: str) -> List[str]:
+    """Extract per-page text from a spooled PDF using the extraction pool"""
+    try:
+        return await run_pdf_extraction_job(_extract_pages_in_pool(pdf_path))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error processing PDF: {str(e)}")
+
+# Extraction cache: extracted pages on local disk, shared by every worker process on the host
+_extractor_version: Optional[str] = None
+
+def pdf_extractor_version() -> str:
+    """Version string of the configured backend chain - cached pages are only reused when it matches"""
+    global _extractor_version
+    if _extractor_version is None:
+        backends = available_pdf_extraction_backends()
+        _extractor_version = ",".join(
+            f"{name}-{PDF_EXTRACTION_BACKEND_REGISTRY[name]['version']()}" for name in backends
+        ) or "none"
+    return _extractor_version
+
+def _extraction_cache_path(content_hash: str) -> str:
+    # Cached pages are stored normalized, so the normalizer version is part of the key too
+    normalizer = f"normalizer-{TEXT_NORMALIZER_VERSION}" if PDF_TEXT_NORMALIZATION else "raw"
+    key = hashlib.sha256(f"{content_hash}:{pdf_extractor_version()}:{normalizer}".encode("utf-8")).hexdigest()
+    return os.path.join(PDF_EXTRACTION_CACHE_DIR, f"{key}.json.gz")
+
+def _read_extraction_cache(cache_path: str) -> Optional[dict]:
+    try:
+        with gzip.open(cache_path, "rt", encoding="utf-8") as cache_file:
+            entry = json.load(cache_file)
+        if not isinstance(entry, dict) or "pages" not in entry:
+            raise ValueError("entry has no pages")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Discarding unreadable extraction cache entry {os.path.basename(cache_path)}: {str(e)}")
+        remove_spooled_upload(cache_path)
+        return None
+    # Reading bumps the mtime, which is what eviction orders by
+    try:
+        os.utime(cache_path)
+    except FileNotFoundError:
+        pass
+    return entry
+
+def _write_extraction_cache(cache_path: str, entry: dict):
+    os.makedirs(PDF_EXTRACTION_CACHE_DIR, exist_ok=True)
+    # Write to a temp file in the same directory and rename, so readers never see a partial entry
+    fd, tmp_path = tempfile.mkstemp(dir=PDF_EXTRACTION_CACHE_DIR, prefix=".tmp-", suffix=".json.gz")
+    try:
+        with os.fdopen(fd, "wb") as raw_file, gzip.GzipFile(fileobj=raw_file, mode="wb", compresslevel=1) as cache_file:
+            cache_file.write(json.dumps(entry).encode("utf-8"))
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        remove_spooled_upload(tmp_path)
+        raise
+    _evict_extraction_cache()
+
+def _evict_extraction_cache():
+    """Drop least recently used entries until the cache fits in PDF_EXTRACTION_CACHE_MAX_MB"""
+    entries = []
+    with os.scandir(PDF_EXTRACTION_CACHE_DIR) as scan:
+        for entry in scan:
+            if not entry.name.endswith(".json.gz") or entry.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another worker
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    total_size = sum(size for _, size, _ in entries)
+    limit = PDF_EXTRACTION_CACHE_MAX_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if total_size <= limit:
+            break
+        remove_spooled_upload(path)
+        total_size -= size
+
+async def load_cached_extraction(content_hash: str) -> Optional[dict]:
+    """Return the cached entry ({"pages": [...], "normalization": {...}}) for a file hash, or None on a miss"""
+    if PDF_EXTRACTION_CACHE_MAX_MB <= 0 or not content_hash:
+        return None
+    return await asyncio.to_thread(lambda: _read_extraction_cache(_extraction_cache_path(content_hash)))
+
+async def store_cached_extraction(content_hash: str, pages: List[str], normalization: dict):
+    """Save per-page text for a file hash. Failures are logged, never raised - the cache is best effort."""
+    if PDF_EXTRACTION_CACHE_MAX_MB <= 0 or not content_hash:
+        return
+    entry = {"pages": pages, "normalization": normalization}
+    try:
+        await asyncio.to_thread(lambda: _write_extraction_cache(_extraction_cache_path(content_hash), entry))
+    except Exception as e:
+        logger.warning(f"⚠️ Could not write extraction cache entry: {str(e)}")
+
+# Document layout: page and chunk records with character offsets into the stored text
+_token_encoder = None
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken, falling back to a ~4 chars/token estimate if it can't load"""
+    if not text:
+        return 0
+    encoder = _get_token_encoder()
+    if encoder is False:
+        return max(1, len(text) // 4)
+    return len(encoder.encode_ordinary(text))
+
+def _get_token_encoder():
+    global _token_encoder
+    if _token_encoder is None:
+        try:
+            import tiktoken
+            _token_encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable ({e}), estimating token counts from length")
+            _token_encoder = False
+    return _token_encoder
+
+def _token_offsets(content: str) -> List[int]:
+    """Character offset where each token of the text starts"""
+    encoder = _get_token_encoder()
+    if encoder is False:
+        return list(range(0, len(content), 4))
+    _, offsets = encoder.decode_with_offsets(encoder.encode_ordinary(content))
+    return offsets
+
+# Retrieval terms: lowercased words, without English stopwords
+RETRIEVAL_TERM_PATTERN = re.compile(r'\w{2,}')
+RETRIEVAL_STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no nor not now of off on once only or other
+our ours ourselves out over own same she should so some such than that the their theirs them themselves then there
+these they this those through to too under until up very was we were what when where which while who whom why will
+with would you your yours yourself yourselves
+""".split())
+
+def retrieval_terms(text: str) -> List[str]:
+    return [term for term in RETRIEVAL_TERM_PATTERN.findall(text.lower()) if term not in RETRIEVAL_STOPWORDS]
+
+def _hashed_word_features(word: str, dimensions: int) -> List[tuple[int, float]]:
+    """Signed hashed features for a word and its character trigrams, so related word forms share dimensions.
+    crc32 rather than hash() keeps features identical across processes."""
+    features = []
+    bounded = f"<{word}>"
+    grams = [f"w:{word}"] + [f"c:{bounded[i:i + 3]}" for i in range(len(bounded) - 2)]
+    for gram in grams:
+        code = zlib.crc32(gram.encode("utf-8"))
+        weight = 1.0 if gram.startswith("w:") else 0.5
+        features.append((code % dimensions, weight if (code >> 31) & 1 else -weight))
+    return features
+
+def embed_texts(texts: List[str], dimensions: int):
+    """L2-normalized float32 embeddings (len(texts) x dimensions) from hashed n-gram features"""
+    import numpy as np
+    rows, columns, values = [], [], []
+    feature_cache: Dict[str, List[tuple[int, float]]] = {}
+    for row, text in enumerate(texts):
+        for word, count in Counter(retrieval_terms(text)).items():
+            features = feature_cache.get(word)
+            if features is None:
+                features = feature_cache[word] = _hashed_word_features(word, dimensions)
+            weight = 1.0 + math.log(count)
+            for column, value in features:
+                rows.append(row)
+                columns.append(column)
+                values.append(weight * value)
+    
+    matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)), np.array(values, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+def _split_into_chunks(content: str, chunk_tokens: int) -> List[tuple[int, int, int]]:
+    """Split text into (start, end, token_count) spans of about chunk_tokens tokens, breaking on line boundaries.
+    The text is tokenized once; chunk boundaries are found from the token offsets."""
+    offsets = _token_offsets(content)
+    chunk_tokens = max(1, chunk_tokens)
+    spans = []
+    start = 0
+    token_index = 0
+    while start < len(content):
+        target = token_index + chunk_tokens
+        if target >= len(offsets):
+            end = len(content)
+        else:
+            end = offsets[target]
+            # Prefer to end on a newline in the second half of the chunk
+            newline = content.rfind("\n", start + (end - start) // 2, end)
+            if newline != -1:
+                end = newline + 1
+            end = max(end, start + 1)
+        next_token_index = bisect.bisect_left(offsets, end, lo=token_index)
+        spans.append((start, end, next_token_index - token_index))
+        start = end
+        token_index = next_token_index
+    return spans
+
+# Heading detection: chapter/part/section labels, numbered headings ("2.3 Results") and short all-caps lines
+CHAPTER_HEADING_PATTERN = re.compile(r'^(chapter|part)\s+([0-9]+|[ivxlcdm]+|[a-z]+)\b', re.IGNORECASE)
+SECTION_HEADING_PATTERN = re.compile(r'^section\s+[0-9][0-9.]*\b', re.IGNORECASE)
+NUMBERED_HEADING_PATTERN = re.compile(r'^(\d{1,3}(?:\.\d{1,3}){0,3})\.?\s+[A-Z][^.!?]*$')
+MAX_HEADING_LENGTH = 100
+
+def normalize_heading(title: str) -> str:
+    return " ".join(title.lower().split())
+
+def _heading_level(line: str) -> Optional[int]:
+    if not line or len(line) > MAX_HEADING_LENGTH:
+        return None
+    if CHAPTER_HEADING_PATTERN.match(line):
+        return 1
+    if SECTION_HEADING_PATTERN.match(line):
+        return 2
+    numbered = NUMBERED_HEADING_PATTERN.match(line)
+    if numbered:
+        return numbered.group(1).count(".") + 1
+    words = line.split()
+    if 1 < len(words) <= 8 and line.isupper() and sum(c.isalpha() for c in line) >= 4:
+        return 1
+    return None
+
+def detect_headings(page_text: str, page_number: int, page_offset: int) -> List[dict]:
+    """Find heading lines on a page, with their offsets into the document text"""
+    headings = []
+    line_offset = page_offset
+    for raw_line in page_text.split("\n"):
+        line = raw_line.strip()
+        level = _heading_level(line)
+        if level is not None:
+            headings.append({
+                "title": line,
+                "title_key": normalize_heading(line),
+                "level": level,
+                "page_number": page_number,
+                "start_offset": line_offset + raw_line.find(line)
+            })
+        line_offset += len(raw_line) + 1
+    return headings
+
+# Text normalization: repeated page headers/footers, hyphenated line breaks and whitespace runs
+TEXT_NORMALIZER_VERSION = 2
+BOILERPLATE_EDGE_LINES = 2  # Lines at the top and bottom of each page checked for running headers/footers
+BOILERPLATE_SAMPLE_PAGES = 16  # Pages spread across a multi-range document that decide its boilerplate up front
+HYPHENATED_LINE_BREAK = re.compile(r'([A-Za-z]+(?:-[A-Za-z]+)*)-\n[ \t]*([a-z]+)')
+HYPHENATED_WORD = re.compile(r'[A-Za-z]+(?:-[A-Za-z]+)*')
+# Whole words that usually start a real compound ("well-known", "self-evident") rather than a split word
+COMPOUND_PREFIXES = frozenset({"well", "self", "non", "half", "cross", "semi", "multi", "anti", "ill", "long", "high", "low", "full"})
+HORIZONTAL_WHITESPACE = re.compile(r'[ \t\f\v\u00a0]+')
+EXTRA_BLANK_LINES = re.compile(r'\n{3,}')
+DIGIT_RUN = re.compile(r'\d+')
+
+def _boilerplate_key(line: str) -> str:
+    words = line.lower().split()
+    # Short lines are matched with digits masked, so "Page 3 of 10" and "Page 4 of 10" share a key
+    if len(words) <= 4:
+        return DIGIT_RUN.sub("#", " ".join(words))
+    return " ".join(words)
+
+def _edge_line_indexes(lines: List[str]) -> List[int]:
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    return sorted(set(non_empty[:BOILERPLATE_EDGE_LINES] + non_empty[-BOILERPLATE_EDGE_LINES:]))
+
+def detect_boilerplate_keys(pages: List[str]) -> set:
+    """Keys of lines at the page edge that recur on at least half the pages (and at least 3)"""
+    if len(pages) < 3:
+        return set()
+    edge_counts = Counter()
+    for page in pages:
+        lines = page.split("\n")
+        edge_counts.update({_boilerplate_key(lines[i]) for i in _edge_line_indexes(lines)})
+    threshold = max(3, (len(pages) + 1) // 2)
+    return {key for key, count in edge_counts.items() if key and count >= threshold}
+
+def _sample_boilerplate_keys(pdf_path: str, page_count: int) -> set:
+    """Boilerplate keys from pages spread across the whole PDF, so every page range strips the same lines.
+    Runs inside a pool worker process."""
+    sample_size = min(page_count, BOILERPLATE_SAMPLE_PAGES)
+    sample = sorted({page_count * i // sample_size for i in range(sample_size)})
+    return detect_boilerplate_keys([page for i in sample for page in _extract_pdf_page_range(pdf_path, i, i + 1)])
+
+def _rejoin_hyphenated(text: str) -> str:
+    """Rejoin words hyphenated across a line break, keeping the hyphen of real compounds. The rest of the
+    text decides: a form written elsewhere wins, and a whole-word prefix like "well" keeps its hyphen."""
+    if "-\n" not in text:
+        return text
+    vocabulary = Counter(word.lower() for word in HYPHENATED_WORD.findall(text))
+    
+    def rejoin(match) -> str:
+        prefix, suffix = match.group(1), match.group(2)
+        compound = vocabulary[f"{prefix}-{suffix}".lower()]
+        joined = vocabulary[f"{prefix}{suffix}".lower()]
+        if compound > joined or (not joined and prefix.rsplit("-", 1)[-1].lower() in COMPOUND_PREFIXES):
+            return f"{prefix}-{suffix}"
+        return prefix + suffix
+    return HYPHENATED_LINE_BREAK.sub(rejoin, text)
+
+def normalize_page_texts(pages: List[str], boilerplate: Optional[set] = None) -> List[str]:
+    """Strip headers/footers repeated on most pages, rejoin words hyphenated across lines and collapse whitespace.
+    boilerplate, when given, is the document-wide set of header/footer keys; otherwise it is detected from pages."""
+    if boilerplate is None:
+        boilerplate = detect_boilerplate_keys(pages)
+    
+    normalized = []
+    for page in pages:
+        lines = page.split("\n")
+        if boilerplate:
+            edges = set(_edge_line_indexes(lines))
+            lines = [line for i, line in enumerate(lines) if i not in edges or _boilerplate_key(line) not in boilerplate]
+        text = _rejoin_hyphenated("\n".join(lines))
+        text = "\n".join(HORIZONTAL_WHITESPACE.sub(" ", line).strip() for line in text.split("\n"))
+        normalized.append(EXTRA_BLANK_LINES.sub("\n\n", text).strip("\n"))
+    return normalized
+
+def build_document_layout(pages: List[str], chunk_tokens: int, normalize: bool = True,
+                          boilerplate: Optional[set] = None) -> dict:
+    """Assemble page texts into the document text plus page and chunk records with offsets.
+    Runs inside a pool worker process, since token counting a large document is CPU heavy."""
+    normalization = {"bytes_saved": 0, "tokens_saved": 0}
+    if normalize and PDF_TEXT_NORMALIZATION:
+        raw_content = "\n".join(pages)
+        pages = normalize_page_texts(pages, boilerplate)
+        raw_bytes, raw_tokens = len(raw_content.encode("utf-8")), count_tokens(raw_content)
+    content = "\n".join(pages)
+    
+    page_records = []
+    page_starts = []
+    headings = []
+    offset = 0
+    for page_number, page_text in enumerate(pages, start=1):
+        page_starts.append(offset)
+        for heading in detect_headings(page_text, page_number, offset):
+            # Running heads repeat the same title on every page - keep only the first occurrence
+            if not headings or headings[-1]["title_key"] != heading["title_key"]:
+                headings.append(heading)
+        page_records.append({
+            "page_number": page_number,
+            "start_offset": offset,
+            "end_offset": offset + len(page_text),
+            "content": page_text,
+            "token_count": count_tokens(page_text)
+        })
+        offset += len(page_text) + 1  # Pages are joined with a newline
+    
+    chunk_records = []
+    postings: Dict[str, List[List[int]]] = {}  # term -> [chunk_index, term frequency, chunk length in terms]
+    for chunk_index, (start, end, token_count) in enumerate(_split_into_chunks(content, chunk_tokens)):
+        term_counts = Counter(retrieval_terms(content[start:end]))
+        term_count = sum(term_counts.values())
+        for term, frequency in term_counts.items():
+            postings.setdefault(term, []).append([chunk_index, frequency, term_count])
+        chunk_records.append({
+            "chunk_index": chunk_index,
+            "page_start": bisect.bisect_right(page_starts, start),
+            "page_end": bisect.bisect_right(page_starts, max(start, end - 1)),
+            "start_offset": start,
+            "end_offset": end,
+            "content": content[start:end],
+            "token_count": token_count,
+            "term_count": term_count
+        })
     
-    # Update session with PDF info
-    await db.chat_sessions.update_one(
-        {"id": session_id},
-        {
-            "$set": {
-                "pdf_filename": file.filename,
-                "pdf_content": pdf_text,
-                "updated_at": datetime.utcnow()
-            }
+    token_count = sum(page["token_count"] for page in page_records)
+    if normalize and PDF_TEXT_NORMALIZATION:
+        normalization = {
+            "bytes_saved": raw_bytes - len(content.encode("utf-8")),
+            "tokens_saved": raw_tokens - token_count
         }
-    )
     
     return {
-        "message": "PDF uploaded successfully",
-        "filename": file.filename,
-        "content_length": len(pdf_text)
+        "content": content,
+        "pages": page_records,
+        "chunks": chunk_records,
+        "headings": [{**heading, "heading_index": i} for i, heading in enumerate(headings)],
+        "token_count": token_count,
+        "postings": postings,
+        "term_count": sum(chunk["term_count"] for chunk in chunk_records),
+        "normalization": normalization
     }
 
-@api_router.post("/sessions/{session_id}/messages")
-async def send_message(session_id: str, request: SendMessageRequest):
-    # Verify session exists
-    session = await db.chat_sessions.find_one({"id": session_id})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+def _extract_pdf_page_range_layout(pdf_path: str, start_page: int, end_page: int, chunk_tokens: int,
+                                   boilerplate: Optional[set] = None) -> dict:
+    """Extract a page range and build its layout in one worker call. Offsets, page numbers and
+    chunk indexes are relative to the range and get shifted when the range is committed."""
+    return build_document_layout(_extract_pdf_page_range(pdf_path, start_page, end_page), chunk_tokens, boilerplate=boilerplate)
+
+def progressive_page_ranges(page_count: int) -> List[tuple[int, int]]:
+    """Page ranges for ingestion: a short first range so the opening pages are usable quickly,
+    then ranges of about PDF_MIN_PAGES_PER_TASK pages committed as they complete"""
+    if page_count < PDF_PARALLEL_PAGE_THRESHOLD:
+        return [(0, page_count)] if page_count else []
+    first = min(page_count, max(1, PDF_PROGRESSIVE_FIRST_PAGES))
+    rest = page_count - first
+    rest_ranges = split_page_ranges(rest, rest // max(1, PDF_MIN_PAGES_PER_TASK), PDF_MIN_PAGES_PER_TASK)
+    return [(0, first)] + [(first + start, first + end) for start, end in rest_ranges]
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+async def _ingest_pages_in_pool(document_id: str, filename: str, pdf_path: str, session_id: Optional[str],
+                                progress: Optional[ProgressCallback], cached_pages: Optional[List[str]] = None,
+                                append: bool = False) -> List[str]:
+    """Extract page ranges in parallel and commit them to pdf_pages/pdf_chunks in page order as soon as
+    every earlier range is in, so the opening pages are queryable while the rest is still parsing.
+    With cached_pages the PDF isn't parsed at all, only laid out and committed. Unless append is set,
+    the first committed range replaces the session's other documents."""
+    if cached_pages is not None:
+        page_count = len(cached_pages)
+    else:
+        page_count = await run_in_pdf_pool(_count_pdf_pages, pdf_path)
+    if PDF_MAX_PAGES > 0 and page_count > PDF_MAX_PAGES:
+        raise HTTPException(status_code=413, detail=f"PDF has {page_count} pages; the limit is {PDF_MAX_PAGES}")
+    await db.pdf_documents.update_one({"id": document_id}, {"$set": {"page_count": page_count}})
+    if progress:
+        await progress(0, page_count)
+    
+    ranges = progressive_page_ranges(page_count) if cached_pages is None else [(0, page_count)]
+    boilerplate = None
+    if cached_pages is None and len(ranges) > 1 and PDF_TEXT_NORMALIZATION:
+        # Decided once for the document, so a running header isn't stripped in some ranges and kept in others
+        boilerplate = await run_in_pdf_pool(_sample_boilerplate_keys, pdf_path, page_count)
+    completed_layouts: Dict[int, dict] = {}
+    committed = {"ranges": 0, "pages": 0, "chunks": 0, "headings": 0, "offset": 0, "tokens": 0, "terms": 0,
+                 "bytes_saved": 0, "tokens_saved": 0}
+    page_texts: List[str] = []
+    commit_lock = asyncio.Lock()
+    
+    async def commit_ready_ranges():
+        async with commit_lock:
+            while committed["ranges"] in completed_layouts:
+                layout = completed_layouts.pop(committed["ranges"])
+                first_page, base_offset, first_chunk = committed["pages"], committed["offset"], committed["chunks"]
+                
+                if layout["pages"]:
+                    await db.pdf_pages.insert_many([{
+                        **page,
+                        "document_id": document_id,
+                        "page_number": page["page_number"] + first_page,
+                        "start_offset": page["start_offset"] + base_offset,
+                        "end_offset": page["end_offset"] + base_offset
+                    } for page in layout["pages"]], ordered=False)
+                if layout["chunks"]:
+                    await db.pdf_chunks.insert_many([{
+                        **chunk,
+                        "document_id": document_id,
+                        "chunk_index": chunk["chunk_index"] + first_chunk,
+                        "page_start": chunk["page_start"] + first_page,
+                        "page_end": chunk["page_end"] + first_page,
+                        "start_offset": chunk["start_offset"] + base_offset,
+                        "end_offset": chunk["end_offset"] + base_offset
+                    } for chunk in layout["chunks"]], ordered=False)
+                if layout["postings"]:
+                    # Postings for a term accumulate across ranges, so each range appends to the term's record
+                    await db.pdf_postings.bulk_write([
+                        UpdateOne(
+                            {"document_id": document_id, "term": term},
+                            {
+                                "$inc": {"df": len(term_postings)},
+                                "$push": {"postings": {"$each": [
+                                    [chunk_index + first_chunk, frequency, length] for chunk_index, frequency, length in term_postings
+                                ]}}
+                            },
+                            upsert=True
+                        ) for term, term_postings in layout["postings"].items()
+                    ], ordered=False)
+                if layout["headings"]:
+                    await db.pdf_outline.insert_many([{
+                        **heading,
+                        "document_id": document_id,
+                        "heading_index": heading["heading_index"] + committed["headings"],
+                        "page_number": heading["page_number"] + first_page,
+                        "start_offset": heading["start_offset"] + base_offset,
+                        "end_offset": None
+                    } for heading in layout["headings"]], ordered=False)
+                
+                page_texts.extend(page["content"] for page in layout["pages"])
+                committed["ranges"] += 1
+                committed["pages"] += len(layout["pages"])
+                committed["chunks"] += len(layout["chunks"])
+                committed["headings"] += len(layout["headings"])
+                committed["offset"] += len(layout["content"]) + 1  # Ranges are joined with a newline
+                committed["tokens"] += layout["token_count"]
+                committed["bytes_saved"] += layout["normalization"]["bytes_saved"]
+                committed["tokens_saved"] += layout["normalization"]["tokens_saved"]
+                committed["terms"] += layout["term_count"]
+                
+                # Move the watermark forward for the document and every session reading it
+                await db.pdf_documents.update_one({"id": document_id}, {"$set": {
+                    "updated_at": datetime.utcnow(),
+                    "ingested_pages": committed["pages"],
+                    "chunk_count": committed["chunks"],
+                    "token_count": committed["tokens"],
+                    "retrieval_term_count": committed["terms"],
+                    "normalization_bytes_saved": committed["bytes_saved"],
+                    "normalization_tokens_saved": committed["tokens_saved"]
+                }})
+                if session_id and committed["ranges"] == 1:
+                    await link_session_to_document(session_id, filename, {
+                        "id": document_id, "page_count": page_count, "ingested_pages": committed["pages"]
+                    }, replace=not append)
+                await db.chat_sessions.update_many(
+                    {"pdf_document_id": document_id},
+                    {"$set": {"ingested_pages": committed["pages"]}}
+                )
+                await db.chat_sessions.update_many(
+                    {"documents.document_id": document_id},
+                    {"$set": {"documents.$[entry].ingested_pages": committed["pages"]}},
+                    array_filters=[{"entry.document_id": document_id}]
+                )
+                if progress:
+                    await progress(committed["pages"], page_count)
+    
+    async def extract_range(range_index: int, start: int, end: int):
+        if cached_pages is not None:
+            # Cached pages are already normalized
+            completed_layouts[range_index] = await run_in_pdf_pool(
+                build_document_layout, cached_pages[start:end], PDF_CHUNK_SIZE_TOKENS, False
+            )
+        else:
+            completed_layouts[range_index] = await run_in_pdf_pool(
+                _extract_pdf_page_range_layout, pdf_path, start, end, PDF_CHUNK_SIZE_TOKENS, boilerplate
+            )
+        await commit_ready_ranges()
     
-    # Save user message
-    user_message = ChatMessage(
-        session_id=session_id,
-        content=request.content,
-        role="user",
-        feature_type=request.feature_type
+    range_tasks = [asyncio.ensure_future(extract_range(i, start, end)) for i, (start, end) in enumerate(ranges)]
+    try:
+        await asyncio.gather(*range_tasks)
+    except BaseException:
+        # Stop committing once any range fails, so the partial page count stays accurate
+        for task in range_tasks:
+            task.cancel()
+        raise
+    return page_texts
+
+async def release_stale_document(pdf_doc: Optional[dict]) -> Optional[dict]:
+    """Return pdf_doc unless it is a 'processing' placeholder abandoned mid-ingest. Abandoned ones are marked
+    failed and their hash is released, so the file is ingested again instead of linked to a document that never finishes."""
+    if not pdf_doc or pdf_doc.get("status") != "processing":
+        return pdf_doc
+    last_update = pdf_doc.get("updated_at") or pdf_doc.get("upload_date")
+    if last_update and (datetime.utcnow() - last_update).total_seconds() < PDF_INGEST_STALE_SECONDS:
+        return pdf_doc
+    await db.pdf_documents.update_one(
+        {"id": pdf_doc["id"], "status": "processing"},
+        {"$set": {"status": "failed", "error": "Ingestion was interrupted"}, "$unset": {"content_hash": ""}}
+    )
+    logger.warning(f"⚠️ Released abandoned ingestion of {pdf_doc.get('filename')} (document {pdf_doc['id']})")
+    return None
+
+async def find_document_by_hash(content_hash: str) -> Optional[dict]:
+    """The stored document for a file hash, finished or still being ingested, skipping abandoned ones"""
+    return await release_stale_document(await db.pdf_documents.find_one({"content_hash": content_hash}, {"content": 0}))
+
+async def fail_interrupted_ingestions():
+    """Release documents a crashed worker left 'processing'. Other API workers may be ingesting right now and move
+    updated_at forward on every committed range, so only documents idle past PDF_INGEST_STALE_SECONDS are touched,
+    the same rule release_stale_document applies on upload."""
+    stale_before = datetime.utcnow() - timedelta(seconds=PDF_INGEST_STALE_SECONDS)
+    result = await db.pdf_documents.update_many(
+        {"status": "processing", "$or": [
+            {"updated_at": {"$lt": stale_before}},
+            {"updated_at": {"$exists": False}, "upload_date": {"$lt": stale_before}}
+        ]},
+        {"$set": {"status": "failed", "error": "Ingestion was interrupted"}, "$unset": {"content_hash": ""}}
+    )
+    if result.modified_count:
+        logger.warning(f"⚠️ Marked {result.modified_count} abandoned PDF ingestions as failed")
+
+async def ingest_pdf_document(pdf_path: str, filename: str, file_size: int, content_hash: str,
+                              session_id: Optional[str] = None, progress: Optional[ProgressCallback] = None,
+                              reject_when_full: bool = True, append: bool = False) -> tuple[dict, bool]:
+    """Store a spooled PDF as a document with page and chunk records.
+    Returns (document without content, deduplicated). When session_id is given the session is linked
+    as soon as the first pages are committed, so chat can start before ingestion finishes."""
+    # Identical files are only parsed once - later uploads link to the stored document
+    existing = await find_document_by_hash(content_hash)
+    if existing:
+        return existing, True
+    
+    pdf_doc = PDFDocument(
+        filename=filename,
+        content="",
+        file_size=file_size,
+        content_hash=content_hash,
+        status="processing",
+        ingested_pages=0
     )
-    await db.chat_messages.insert_one(user_message.dict())
+    try:
+        await db.pdf_documents.insert_one(pdf_doc.dict())
+    except DuplicateKeyError:
+        # A concurrent upload of the same file won the insert
+        return await db.pdf_documents.find_one({"content_hash": content_hash}, {"content": 0}), True
     
-    # Get chat history
-    messages_cursor = db.chat_messages.find({"session_id": session_id}).sort("timestamp", 1)
-    chat_history = await messages_cursor.to_list(100)
+    return await process_pdf_document(pdf_doc, pdf_path, session_id, progress, reject_when_full, append), False
+
+async def process_pdf_document(pdf_doc: PDFDocument, pdf_path: str, session_id: Optional[str] = None,
+                               progress: Optional[ProgressCallback] = None, reject_when_full: bool = True,
+                               append: bool = False) -> dict:
+    """Extract and commit the pages of a document already stored with status 'processing'"""
+    filename, content_hash = pdf_doc.filename, pdf_doc.content_hash
+    
+    # Files parsed before (even by another worker or before a restart) skip extraction entirely
+    cached = await load_cached_extraction(content_hash)
+    cached_pages = cached["pages"] if cached else None
+    if cached:
+        logger.info(f"📦 Extraction cache hit for {filename} ({len(cached_pages)} pages)")
     
-    # Prepare messages for AI based on feature type
-    ai_messages = []
+    try:
+        page_texts = await run_pdf_extraction_job(
+            _ingest_pages_in_pool(pdf_doc.id, filename, pdf_path, session_id, progress, cached_pages, append), reject_when_full
+        )
+    except Exception as e:
+        status_code = e.status_code if isinstance(e, HTTPException) else 400
+        detail = e.detail if isinstance(e, HTTPException) else f"Error processing PDF: {str(e)}"
+        # Committed pages stay readable; the hash is released so the file can be uploaded again
+        failed_doc = await db.pdf_documents.find_one({"id": pdf_doc.id}, {"ingested_pages": 1, "page_count": 1})
+        ingested_pages = (failed_doc or {}).get("ingested_pages") or 0
+        if ingested_pages:
+            detail += f" ({ingested_pages} of {failed_doc.get('page_count')} pages were extracted and remain available)"
+        await db.pdf_documents.update_one(
+            {"id": pdf_doc.id},
+            {"$set": {"status": "failed", "error": detail}, "$unset": {"content_hash": ""}}
+        )
+        logger.warning(f"⚠️ Ingestion of {filename} failed: {detail}")
+        raise HTTPException(status_code=status_code, detail=detail)
     
-    if request.feature_type == "general_ai":
-        # General AI chat - no PDF context
-        ai_messages.append({
-            "role": "system", 
-            "content": "You are a helpful AI assistant. Answer any questions the user has with accurate and helpful information."
-        })
+    if cached:
+        normalization = cached.get("normalization") or {"bytes_saved": 0, "tokens_saved": 0}
     else:
-        # PDF-based features
-        if session.get("pdf_content"):
-            pdf_content = session["pdf_content"]
-            if request.feature_type == "chat":
+        stats = await db.pdf_documents.find_one(
+            {"id": pdf_doc.id}, {"normalization_bytes_saved": 1, "normalization_tokens_saved": 1}
+        )
+        normalization = {
+            "bytes_saved": stats.get("normalization_bytes_saved") or 0,
+            "tokens_saved": stats.get("normalization_tokens_saved") or 0
+        }
+        await store_cached_extraction(content_hash, page_texts, normalization)
+    
+    try:
+        await build_document_vectors(pdf_doc.id)
+    except Exception as e:
+        # Search rebuilds a missing index on first use, so a failure here doesn't fail the upload
+        logger.warning(f"⚠️ Could not build vector index for {filename}: {str(e)}")
+    
+    # The text itself lives only in pdf_pages and pdf_chunks; load_session_pdf_content reassembles it
+    content_length = sum(len(page_text) for page_text in page_texts) + max(0, len(page_texts) - 1)
+    await finalize_document_outline(pdf_doc.id, content_length)
+    await db.pdf_documents.update_one({"id": pdf_doc.id}, {"$set": {
+        "content_length": content_length,
+        "normalization_bytes_saved": normalization["bytes_saved"],
+        "normalization_tokens_saved": normalization["tokens_saved"],
+        "status": "ready"
+    }})
+    if normalization["bytes_saved"]:
+        logger.info(f"🧹 Normalized {filename}: {normalization['bytes_saved']} bytes and {normalization['tokens_saved']} tokens saved")
+    schedule_document_summary(pdf_doc.id)
+    return await db.pdf_documents.find_one({"id": pdf_doc.id}, {"content": 0})
+
+async def get_document_text_range(document_id: str, start_offset: int, end_offset: int) -> str:
+    """Return document text between two offsets using an indexed range query over chunks"""
+    chunks = await db.pdf_chunks.find(
+        {"document_id": document_id, "start_offset": {"$lt": end_offset}, "end_offset": {"$gt": start_offset}},
+        {"content": 1, "start_offset": 1}
+    ).sort("start_offset", 1).to_list(None)
+    if not chunks:
+        return ""
+    parts = []
+    base = position = chunks[0]["start_offset"]
+    for chunk in chunks:
+        if chunk["start_offset"] > position:
+            # Page ranges are joined with a newline that no chunk holds
+            parts.append("\n" * (chunk["start_offset"] - position))
+        parts.append(chunk["content"])
+        position = chunk["start_offset"] + len(chunk["content"])
+    text = "".join(parts)
+    return text[max(0, start_offset - base):end_offset - base]
+
+async def get_document_text_within_tokens(document_id: str, start_offset: int, end_offset: Optional[int], max_tokens: int) -> str:
+    """Document text from start_offset towards end_offset (None for the end of the document), cut to about max_tokens
+    using the token counts stored on the chunks, so a long section is never loaded whole"""
+    chunk_filter = {"document_id": document_id, "end_offset": {"$gt": start_offset}}
+    if end_offset is not None:
+        chunk_filter["start_offset"] = {"$lt": end_offset}
+    cursor = db.pdf_chunks.find(chunk_filter, {"start_offset": 1, "end_offset": 1, "token_count": 1}).sort("start_offset", 1)
+    
+    bound = start_offset
+    used_tokens = 0
+    async for chunk in cursor:
+        # Only the part of the first chunk from start_offset on counts towards the budget
+        span_start = max(chunk["start_offset"], start_offset)
+        span = chunk["end_offset"] - span_start
+        tokens = chunk["token_count"] * span // max(1, chunk["end_offset"] - chunk["start_offset"])
+        remaining = max_tokens - used_tokens
+        if tokens >= remaining:
+            bound = span_start + span * remaining // max(1, tokens)
+            break
+        used_tokens += tokens
+        bound = chunk["end_offset"]
+    if end_offset is not None:
+        bound = min(bound, end_offset)
+    if bound <= start_offset:
+        return ""
+    return await get_document_text_range(document_id, start_offset, bound)
+
+async def finalize_document_outline(document_id: str, content_length: int):
+    """Give every heading the end offset of its section: the start of the next heading at the same or a higher level"""
+    headings = await db.pdf_outline.find(
+        {"document_id": document_id}, {"_id": 1, "level": 1, "start_offset": 1}
+    ).sort("start_offset", 1).to_list(None)
+    
+    updates = []
+    open_headings = []  # Headings whose section hasn't ended yet, outermost first
+    for heading in headings:
+        while open_headings and open_headings[-1]["level"] >= heading["level"]:
+            updates.append(UpdateOne({"_id": open_headings.pop()["_id"]}, {"$set": {"end_offset": heading["start_offset"]}}))
+        open_headings.append(heading)
+    updates.extend(UpdateOne({"_id": h["_id"]}, {"$set": {"end_offset": content_length}}) for h in open_headings)
+    
+    if updates:
+        await db.pdf_outline.bulk_write(updates, ordered=False)
+
+async def find_document_section(document_id: str, title: str) -> Optional[dict]:
+    """Look up a heading by title through the outline index - exact title first, then a partial match"""
+    title_key = normalize_heading(title)
+    projection = {"_id": 0, "title": 1, "level": 1, "page_number": 1, "start_offset": 1, "end_offset": 1}
+    heading = await db.pdf_outline.find_one({"document_id": document_id, "title_key": title_key}, projection)
+    if not heading:
+        heading = await db.pdf_outline.find_one(
+            {"document_id": document_id, "title_key": {"$regex": re.escape(title_key)}},
+            projection,
+            sort=[("start_offset", 1)]
+        )
+    if heading and heading.get("end_offset") is None:
+        # Still ingesting: the section ends at the next committed heading of the same or a higher level
+        next_heading = await db.pdf_outline.find_one(
+            {"document_id": document_id, "start_offset": {"$gt": heading["start_offset"]}, "level": {"$lte": heading["level"]}},
+            {"start_offset": 1},
+            sort=[("start_offset", 1)]
+        )
+        heading["end_offset"] = next_heading["start_offset"] if next_heading else None
+    return heading
+
+def context_token_budget(model: str, reserved_tokens: int = 0) -> int:
+    """Tokens of document text that fit in a prompt for this model, after the response and other prompt parts"""
+    window = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_MODEL_CONTEXT_TOKENS)
+    return max(0, min(PDF_CONTEXT_MAX_TOKENS, window - AI_RESPONSE_MAX_TOKENS - reserved_tokens))
+
+def _truncate_to_tokens(text: str, token_count: int, max_tokens: int) -> str:
+    """Cut text with a known token count down to about max_tokens, without re-tokenizing it"""
+    if token_count <= max_tokens:
+        return text
+    return text[:len(text) * max_tokens // max(1, token_count)]
+
+def _vector_index_path(document_id: str) -> str:
+    return os.path.join(VECTOR_INDEX_DIR, f"{document_id}.npy")
+
+def _write_vector_index(index_path: str, texts: List[str], dimensions: int) -> int:
+    """Embed chunk texts and save them as a float16 matrix. Runs inside a pool worker process."""
+    import numpy as np
+    matrix = embed_texts(texts, dimensions).astype(np.float16)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    # Save to a temp file and rename, so searches never map a partially written matrix
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), prefix=".tmp-", suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as index_file:
+            np.save(index_file, matrix)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        remove_spooled_upload(tmp_path)
+        raise
+    return matrix.shape[0]
+
+_vector_matrices: Dict[str, tuple[float, Any]] = {}  # index path -> (mtime, memory-mapped matrix)
+_vector_matrices_lock = threading.Lock()  # Searches load matrices from several to_thread workers at once
+
+def _load_vector_index(index_path: str):
+    mtime = os.path.getmtime(index_path)
+    with _vector_matrices_lock:
+        cached = _vector_matrices.get(index_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    import numpy as np
+    matrix = np.load(index_path, mmap_mode="r")
+    with _vector_matrices_lock:
+        _vector_matrices.pop(index_path, None)
+        while len(_vector_matrices) >= 64:
+            _vector_matrices.pop(next(iter(_vector_matrices)))
+        _vector_matrices[index_path] = (mtime, matrix)
+    return matrix
+
+def _remove_vector_index_files(keep_document_ids: set) -> int:
+    """Delete index files of documents not in keep_document_ids, and temp files left by interrupted writes. Returns how many went."""
+    removed = 0
+    for index_path in glob.glob(os.path.join(VECTOR_INDEX_DIR, "*.npy")) + glob.glob(os.path.join(VECTOR_INDEX_DIR, ".tmp-*.npy")):
+        name = os.path.basename(index_path)
+        if name.startswith(".tmp-"):
+            try:
+                if time.time() - os.path.getmtime(index_path) < VECTOR_INDEX_TEMP_MAX_AGE:
+                    continue
+            except OSError:
+                continue  # Already renamed into place or removed
+        elif name[:-len(".npy")] in keep_document_ids:
+            continue
+        with _vector_matrices_lock:
+            _vector_matrices.pop(index_path, None)
+        remove_spooled_upload(index_path)
+        removed += 1
+    return removed
+
+async def prune_vector_indexes():
+    """Index files outlive their documents (deleted, or failed before any chunk) since they sit outside Mongo"""
+    if not os.path.isdir(VECTOR_INDEX_DIR):
+        return
+    file_ids = [name[:-len(".npy")] for name in os.listdir(VECTOR_INDEX_DIR) if name.endswith(".npy") and not name.startswith(".")]
+    keep = set()
+    for start in range(0, len(file_ids), 1000):
+        async for doc in db.pdf_documents.find({"id": {"$in": file_ids[start:start + 1000]}, "chunk_count": {"$gt": 0}}, {"id": 1}):
+            keep.add(doc["id"])
+    removed = await asyncio.to_thread(_remove_vector_index_files, keep)
+    if removed:
+        logger.info(f"🧹 Removed {removed} orphaned vector index files")
+
+def _search_vector_index(index_path: str, queries: List[str], top_k: int) -> List[List[tuple[int, float]]]:
+    """Cosine top-k for several queries at once, scanning the mapped matrix in row batches"""
+    import numpy as np
+    matrix = _load_vector_index(index_path)
+    query_matrix = embed_texts(queries, matrix.shape[1])
+    candidate_scores, candidate_rows = [], []
+    for start in range(0, matrix.shape[0], max(1, VECTOR_SEARCH_BATCH_ROWS)):
+        # Rows are unit length, so a dot product is the cosine similarity
+        scores = query_matrix @ np.asarray(matrix[start:start + VECTOR_SEARCH_BATCH_ROWS], dtype=np.float32).T
+        k = min(top_k, scores.shape[1])
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        candidate_scores.append(np.take_along_axis(scores, best, axis=1))
+        candidate_rows.append(best + start)
+    if not candidate_scores:
+        return [[] for _ in queries]
+    
+    scores = np.concatenate(candidate_scores, axis=1)
+    rows = np.concatenate(candidate_rows, axis=1)
+    results = []
+    for query_scores, query_rows in zip(scores, rows):
+        order = np.argsort(-query_scores)[:top_k]
+        results.append([(int(query_rows[i]), float(query_scores[i])) for i in order if query_scores[i] > 0])
+    return results
+
+async def build_document_vectors(document_id: str) -> bool:
+    """(Re)build the vector index of a document from its stored chunks"""
+    if not _module_available("numpy"):
+        return False
+    chunks = await db.pdf_chunks.find({"document_id": document_id}, {"_id": 0, "content": 1}).sort("chunk_index", 1).to_list(None)
+    if not chunks:
+        return False
+    await run_in_pdf_pool(_write_vector_index, _vector_index_path(document_id), [c["content"] for c in chunks], VECTOR_DIMENSIONS)
+    return True
+
+async def search_document_vectors(document_id: str, queries: List[str], top_k: int) -> List[List[tuple[int, float]]]:
+    """Top-k (chunk_index, cosine) per query. Indexes missing on this host, or built before the document
+    finished ingesting, are rebuilt from the stored chunks."""
+    if not _module_available("numpy"):
+        return [[] for _ in queries]
+    index_path = _vector_index_path(document_id)
+    try:
+        pdf_doc = await db.pdf_documents.find_one({"id": document_id}, {"chunk_count": 1, "status": 1})
+        if not pdf_doc or not pdf_doc.get("chunk_count"):
+            return [[] for _ in queries]
+        index_rows = await asyncio.to_thread(lambda: _load_vector_index(index_path).shape[0]) if os.path.exists(index_path) else 0
+        if index_rows != pdf_doc["chunk_count"]:
+            if pdf_doc.get("status") == "processing":
+                return [[] for _ in queries]  # Built once ingestion finishes
+            await build_document_vectors(document_id)
+        return await asyncio.to_thread(_search_vector_index, index_path, queries, top_k)
+    except Exception as e:
+        logger.warning(f"⚠️ Vector search failed for document {document_id}: {str(e)}")
+        return [[] for _ in queries]
+
+async def _bm25_scores(document_id: str, query: str) -> Dict[int, float]:
+    """BM25 score per chunk index for a query, from the postings stored at ingest"""
+    terms = list(set(retrieval_terms(query)))
+    pdf_doc = await db.pdf_documents.find_one({"id": document_id}, {"chunk_count": 1, "retrieval_term_count": 1})
+    if not terms or not pdf_doc or not pdf_doc.get("retrieval_term_count"):
+        return {}
+    
+    chunk_total = pdf_doc["chunk_count"]
+    average_length = pdf_doc["retrieval_term_count"] / max(1, chunk_total)
+    scores: Dict[int, float] = {}
+    async for record in db.pdf_postings.find({"document_id": document_id, "term": {"$in": terms}}, {"df": 1, "postings": 1}):
+        idf = math.log(1 + (chunk_total - record["df"] + 0.5) / (record["df"] + 0.5))
+        for chunk_index, frequency, length in record["postings"]:
+            norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / max(1e-9, average_length))
+            scores[chunk_index] = scores.get(chunk_index, 0.0) + idf * frequency * (BM25_K1 + 1) / norm
+    return scores
+
+async def retrieve_relevant_chunks(document_id: str, queries: List[str], top_k: int = RETRIEVAL_TOP_K) -> List[dict]:
+    """Top-k chunks for one or more queries: BM25 and vector rankings merged by reciprocal rank fusion"""
+    rankings = []
+    for query in queries:
+        bm25_scores = await _bm25_scores(document_id, query)
+        rankings.append(heapq.nlargest(top_k * 2, bm25_scores.items(), key=lambda item: item[1]))
+    # All queries are embedded and searched in one batched pass over the matrix
+    rankings.extend(await search_document_vectors(document_id, queries, top_k * 2))
+    
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_index, _) in enumerate(ranking):
+            scores[chunk_index] = scores.get(chunk_index, 0.0) + 1.0 / (RRF_K + rank + 1)
+    if not scores:
+        return []
+    
+    best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    chunks = await db.pdf_chunks.find(
+        {"document_id": document_id, "chunk_index": {"$in": [chunk_index for chunk_index, _ in best]}},
+        {"_id": 0, "chunk_index": 1, "page_start": 1, "page_end": 1, "content": 1, "token_count": 1}
+    ).to_list(None)
+    for chunk in chunks:
+        chunk["score"] = scores[chunk["chunk_index"]]
+    return sorted(chunks, key=lambda chunk: chunk["score"], reverse=True)
+
+def _page_label(page_start: int, page_end: int) -> str:
+    return f"Page {page_start}" if page_start == page_end else f"Pages {page_start}-{page_end}"
+
+def _format_retrieved_chunks(chunks: List[dict], max_tokens: int) -> str:
+    """Take the best chunks that fit the budget and lay them out in document order with page labels"""
+    selected = []
+    used_tokens = 0
+    for chunk in chunks:
+        if used_tokens + chunk["token_count"] > max_tokens:
+            continue
+        selected.append(chunk)
+        used_tokens += chunk["token_count"]
+    if not selected and chunks:
+        best = chunks[0]
+        selected = [{**best, "content": _truncate_to_tokens(best["content"], best["token_count"], max_tokens)}]
+    
+    sections = []
+    # Chunks retrieved across a session's documents carry their document's position and filename
+    for chunk in sorted(selected, key=lambda chunk: (chunk.get("document_position", 0), chunk["chunk_index"])):
+        label = _page_label(chunk['page_start'], chunk['page_end'])
+        if chunk.get("filename"):
+            label = f"{chunk['filename']}, {label}"
+        sections.append(f"[{label}]\n{chunk['content'].strip()}")
+    return "\n\n".join(sections)
+
+async def _pack_opening_chunks(document_id: str, max_tokens: int) -> str:
+    """The start of a document, cut to max_tokens"""
+    parts = []
+    used_tokens = 0
+    cursor = db.pdf_chunks.find(
+        {"document_id": document_id},
+        {"content": 1, "token_count": 1}
+    ).sort("chunk_index", 1)
+    async for chunk in cursor:
+        remaining = max_tokens - used_tokens
+        if remaining <= 0:
+            break
+        parts.append(_truncate_to_tokens(chunk["content"], chunk["token_count"], remaining))
+        used_tokens += min(chunk["token_count"], remaining)
+    return "".join(parts)
+
+async def retrieve_session_chunks(documents: List[dict], queries: List[str], top_k: int = RETRIEVAL_TOP_K) -> List[dict]:
+    """Top-k chunks across several documents. Raw BM25 and cosine scores from every document are ranked together
+    per query before reciprocal rank fusion, so a document only contributes chunks that score as well as the
+    others' - fusing per-document ranks would hand every document its turn, however unrelated."""
+    bm25_by_document, vectors_by_document = await asyncio.gather(
+        asyncio.gather(*[
+            asyncio.gather(*[_bm25_scores(doc["document_id"], query) for query in queries]) for doc in documents
+        ]),
+        asyncio.gather(*[search_document_vectors(doc["document_id"], queries, top_k * 2) for doc in documents])
+    )
+    
+    rankings = []
+    for query_index in range(len(queries)):
+        bm25_hits = [
+            ((position, chunk_index), score)
+            for position, query_scores in enumerate(bm25_by_document)
+            for chunk_index, score in query_scores[query_index].items()
+        ]
+        vector_hits = [
+            ((position, chunk_index), cosine)
+            for position, query_hits in enumerate(vectors_by_document)
+            for chunk_index, cosine in query_hits[query_index]
+        ]
+        rankings.append(heapq.nlargest(top_k * 2, bm25_hits, key=lambda item: item[1]))
+        rankings.append(heapq.nlargest(top_k * 2, vector_hits, key=lambda item: item[1]))
+    
+    scores: Dict[tuple[int, int], float] = {}
+    for ranking in rankings:
+        for rank, (key, _) in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    if not scores:
+        return []
+    
+    best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    indexes_by_position: Dict[int, List[int]] = {}
+    for (position, chunk_index), _ in best:
+        indexes_by_position.setdefault(position, []).append(chunk_index)
+    fetched = await asyncio.gather(*[
+        db.pdf_chunks.find(
+            {"document_id": documents[position]["document_id"], "chunk_index": {"$in": chunk_indexes}},
+            {"_id": 0, "chunk_index": 1, "page_start": 1, "page_end": 1, "content": 1, "token_count": 1}
+        ).to_list(None)
+        for position, chunk_indexes in indexes_by_position.items()
+    ])
+    merged = []
+    for position, chunks in zip(indexes_by_position, fetched):
+        for chunk in chunks:
+            merged.append({
+                **chunk,
+                "score": scores[(position, chunk["chunk_index"])],
+                "filename": documents[position]["filename"],
+                "document_position": position
+            })
+    return sorted(merged, key=lambda chunk: chunk["score"], reverse=True)
+
+async def pack_session_pdf_context(session: dict, max_tokens: int, queries: Optional[List[str]] = None) -> Optional[str]:
+    """Pack a session's PDF into max_tokens using the token counts stored at ingest.
+    With queries the most relevant chunks are used; otherwise (or without matches) the opening chunks.
+    Sessions with several documents share the budget across them."""
+    documents = session_documents(session)
+    if len(documents) > 1:
+        if queries:
+            relevant_chunks = await retrieve_session_chunks(documents, queries)
+            if relevant_chunks:
+                return _format_retrieved_chunks(relevant_chunks, max_tokens)
+        openings = await asyncio.gather(*[
+            _pack_opening_chunks(doc["document_id"], max_tokens // len(documents)) for doc in documents
+        ])
+        parts = [f"=== {doc['filename']} ===\n{opening}" for doc, opening in zip(documents, openings) if opening]
+        return "\n\n".join(parts) or None
+    
+    if session.get("pdf_document_id"):
+        pdf_doc = await db.pdf_documents.find_one({"id": session["pdf_document_id"]}, {"chunk_count": 1})
+        if pdf_doc and pdf_doc.get("chunk_count"):
+            if queries:
+                relevant_chunks = await retrieve_relevant_chunks(session["pdf_document_id"], queries)
+                if relevant_chunks:
+                    return _format_retrieved_chunks(relevant_chunks, max_tokens)
+            return await _pack_opening_chunks(session["pdf_document_id"], max_tokens)
+    
+    # Documents stored before page/chunk records existed are counted once here
+    pdf_content = await load_session_pdf_content(session)
+    if not pdf_content:
+        return None
+    return _truncate_to_tokens(pdf_content, count_tokens(pdf_content), max_tokens)
+
+async def pack_compare_context(documents: List[dict], query: str, max_tokens: int) -> Optional[str]:
+    """Excerpts relevant to the query from every document, each document getting an equal share of max_tokens.
+    Documents are searched in parallel; one without matches contributes its opening instead."""
+    share = max_tokens // max(1, len(documents))
+    rankings = await asyncio.gather(*[retrieve_relevant_chunks(doc["document_id"], [query]) for doc in documents])
+    
+    async def excerpt(doc: dict, chunks: List[dict]) -> str:
+        if chunks:
+            return _format_retrieved_chunks(chunks, share)
+        return await _pack_opening_chunks(doc["document_id"], share)
+    
+    excerpts = await asyncio.gather(*[excerpt(doc, chunks) for doc, chunks in zip(documents, rankings)])
+    parts = [
+        f"=== Document {position + 1}: {doc['filename']} ===\n{text}"
+        for position, (doc, text) in enumerate(zip(documents, excerpts)) if text
+    ]
+    return "\n\n".join(parts) or None
+
+def _partition_by_tokens(token_counts: List[int], parts: int) -> List[tuple[int, int]]:
+    """Split a sequence into at most `parts` contiguous (start, end) runs of roughly equal token totals"""
+    total = sum(token_counts)
+    runs = []
+    start = 0
+    cumulative = 0
+    for index, tokens in enumerate(token_counts):
+        cumulative += tokens
+        if cumulative >= total * (len(runs) + 1) / parts and index + 1 < len(token_counts):
+            runs.append((start, index + 1))
+            start = index + 1
+    runs.append((start, len(token_counts)))
+    return runs
+
+def _rank_chunks_by_centroid(index_path: str, sections: List[List[int]]) -> List[List[int]]:
+    """Order each section's chunk indexes by cosine similarity to the section's mean embedding"""
+    import numpy as np
+    matrix = _load_vector_index(index_path)
+    ranked = []
+    for chunk_indexes in sections:
+        vectors = np.asarray(matrix[chunk_indexes], dtype=np.float32)
+        scores = vectors @ vectors.mean(axis=0)
+        ranked.append([chunk_indexes[i] for i in np.argsort(-scores)])
+    return ranked
+
+def _spread_order(chunk_indexes: List[int]) -> List[int]:
+    """Order chunk indexes so any prefix is spread evenly over the section: middle first, then quarters, eighths, ..."""
+    order = []
+    seen = set()
+    step = len(chunk_indexes)
+    while step >= 1 and len(order) < len(chunk_indexes):
+        for position in range(step // 2, len(chunk_indexes), max(1, step)):
+            if position not in seen:
+                seen.add(position)
+                order.append(chunk_indexes[position])
+        step //= 2
+    order.extend(index for position, index in enumerate(chunk_indexes) if position not in seen)
+    return order
+
+async def sample_document_sections(document_id: str, max_sections: int, section_tokens: int) -> List[dict]:
+    """Pick representative chunks from across the whole document for coverage-aware generation.
+    The document is divided along its top-level outline headings (or into equal runs of chunks when it has no outline)
+    into at most max_sections sections; each section gets up to section_tokens of its most representative chunks.
+    Returns [{"title", "content", "token_count"}] in document order."""
+    chunks = await db.pdf_chunks.find(
+        {"document_id": document_id},
+        {"_id": 0, "chunk_index": 1, "start_offset": 1, "token_count": 1, "page_start": 1, "page_end": 1}
+    ).sort("chunk_index", 1).to_list(None)
+    if not chunks:
+        return []
+    total_tokens = sum(chunk["token_count"] for chunk in chunks)
+    section_count = max(1, min(max_sections, math.ceil(total_tokens / max(1, section_tokens))))
+    
+    headings = await db.pdf_outline.find(
+        {"document_id": document_id}, {"_id": 0, "title": 1, "level": 1, "start_offset": 1}
+    ).sort("start_offset", 1).to_list(None)
+    top_level = min((heading["level"] for heading in headings), default=None)
+    top_headings = [heading for heading in headings if heading["level"] == top_level]
+    
+    # Runs of chunks under each top-level heading; chunks before the first heading form their own run
+    runs: List[tuple[Optional[str], List[dict]]] = []
+    if len(top_headings) >= 2 and section_count > 1:
+        starts = [heading["start_offset"] for heading in top_headings]
+        current = None
+        for chunk in chunks:
+            heading_index = bisect.bisect_right(starts, chunk["start_offset"]) - 1
+            if heading_index != current:
+                runs.append((top_headings[heading_index]["title"] if heading_index >= 0 else None, []))
+                current = heading_index
+            runs[-1][1].append(chunk)
+    else:
+        runs = [(None, [chunk]) for chunk in chunks]
+    
+    sections = []
+    for start, end in _partition_by_tokens([sum(c["token_count"] for c in run) for _, run in runs], section_count):
+        titles = [title for title, _ in runs[start:end] if title]
+        section_chunks = [chunk for _, run in runs[start:end] for chunk in run]
+        pages = _page_label(section_chunks[0]["page_start"], section_chunks[-1]["page_end"])
+        if not titles:
+            title = pages
+        elif len(titles) == 1:
+            title = f"{titles[0]} ({pages})"
+        else:
+            title = f"{titles[0]} - {titles[-1]} ({pages})"
+        sections.append({"title": title, "chunks": section_chunks})
+    
+    # Most representative chunks first: closest to the section centroid, or evenly spread without a vector index
+    chunk_indexes = [[chunk["chunk_index"] for chunk in section["chunks"]] for section in sections]
+    ranked = None
+    if _module_available("numpy") and len(chunks) > len(sections):
+        index_path = _vector_index_path(document_id)
+        try:
+            if os.path.exists(index_path) and await asyncio.to_thread(lambda: _load_vector_index(index_path).shape[0]) == len(chunks):
+                ranked = await asyncio.to_thread(_rank_chunks_by_centroid, index_path, chunk_indexes)
+        except Exception as e:
+            logger.warning(f"⚠️ Centroid ranking failed for document {document_id}: {str(e)}")
+    if ranked is None:
+        ranked = [_spread_order(indexes) for indexes in chunk_indexes]
+    
+    tokens_by_index = {chunk["chunk_index"]: chunk["token_count"] for chunk in chunks}
+    selected_by_section = []
+    for order in ranked:
+        selected = []
+        used_tokens = 0
+        for chunk_index in order:
+            if selected and used_tokens + tokens_by_index[chunk_index] > section_tokens:
+                continue
+            selected.append(chunk_index)
+            used_tokens += tokens_by_index[chunk_index]
+        selected_by_section.append(selected)
+    
+    # One round trip for the text of every selected chunk
+    selected_chunks = await db.pdf_chunks.find(
+        {"document_id": document_id, "chunk_index": {"$in": [i for selected in selected_by_section for i in selected]}},
+        {"_id": 0, "chunk_index": 1, "page_start": 1, "page_end": 1, "content": 1, "token_count": 1}
+    ).to_list(None)
+    chunks_by_index = {chunk["chunk_index"]: chunk for chunk in selected_chunks}
+    results = []
+    for section, selected in zip(sections, selected_by_section):
+        section_chunks = [chunks_by_index[i] for i in selected if i in chunks_by_index]
+        results.append({
+            "title": section["title"],
+            "content": _format_retrieved_chunks(section_chunks, section_tokens),
+            "token_count": sum(chunk["token_count"] for chunk in section["chunks"])
+        })
+    return results
+
+# Background ingestion jobs
+async def link_session_to_document(session_id: str, filename: str, pdf_doc: dict, replace: bool = True):
+    """Point a session at a stored PDF document - the session only keeps a reference, not the text.
+    With replace the document becomes the session's only one; otherwise it is attached next to the others."""
+    ingested_pages = pdf_doc.get("ingested_pages", pdf_doc.get("page_count"))
+    latest = {
+        "pdf_filename": filename,
+        "pdf_document_id": pdf_doc["id"],
+        "pdf_page_count": pdf_doc.get("page_count"),
+        "ingested_pages": ingested_pages,
+        "updated_at": datetime.utcnow()
+    }
+    if replace:
+        entry = SessionDocument(document_id=pdf_doc["id"], filename=filename,
+                                page_count=pdf_doc.get("page_count"), ingested_pages=ingested_pages)
+        await db.chat_sessions.update_one(
+            {"id": session_id},
+            {"$set": {**latest, "documents": [entry.dict()]}, "$unset": {"pdf_content": ""}}
+        )
+        return
+    
+    # Sessions from before multi-document support list their single PDF first
+    await db.chat_sessions.update_one(
+        {"id": session_id, "documents": {"$exists": False}, "pdf_document_id": {"$ne": None}},
+        [{"$set": {"documents": [{
+            "document_id": "$pdf_document_id", "filename": "$pdf_filename", "page_count": "$pdf_page_count",
+            "ingested_pages": "$ingested_pages", "added_at": "$updated_at"
+        }]}}]
+    )
+    entry = SessionDocument(document_id=pdf_doc["id"], filename=filename,
+                            page_count=pdf_doc.get("page_count"), ingested_pages=ingested_pages)
+    await db.chat_sessions.update_one(
+        {"id": session_id, "documents.document_id": {"$ne": pdf_doc["id"]}},
+        {"$push": {"documents": entry.dict()}}
+    )
+    await db.chat_sessions.update_one(
+        {"id": session_id},
+        {
+            "$set": {
+                **latest,
+                "documents.$[entry].page_count": pdf_doc.get("page_count"),
+                "documents.$[entry].ingested_pages": ingested_pages
+            },
+            "$unset": {"pdf_content": ""}
+        },
+        array_filters=[{"entry.document_id": pdf_doc["id"]}]
+    )
+
+def session_documents(session: dict) -> List[dict]:
+    """The documents attached to a session, in the order they were added"""
+    if session.get("documents"):
+        return session["documents"]
+    if session.get("pdf_document_id"):
+        return [{"document_id": session["pdf_document_id"], "filename": session.get("pdf_filename") or "document.pdf"}]
+    return []
+
+def resolve_session_document(session: dict, document_id: Optional[str] = None) -> str:
+    """The requested document if it is attached to the session, otherwise the session's primary document"""
+    if document_id:
+        if not any(doc["document_id"] == document_id for doc in session_documents(session)):
+            raise HTTPException(status_code=404, detail="Document not attached to this session")
+        return document_id
+    if not session.get("pdf_document_id"):
+        raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
+    return session["pdf_document_id"]
+
+async def update_ingest_job(job_id: str, **fields):
+    fields["updated_at"] = datetime.utcnow()
+    await db.ingest_jobs.update_one({"id": job_id}, {"$set": fields})
+
+async def enqueue_ingest_job(session_id: str, filename: str, spool_path: str, file_size: int, content_hash: str,
+                             append: bool = False) -> IngestJob:
+    """Record an ingestion job and hand the spooled upload to the background workers"""
+    if ingest_queue is None or ingest_queue.full():
+        raise HTTPException(status_code=503, detail="Ingestion queue is full, please retry shortly")
+    
+    job = IngestJob(session_id=session_id, filename=filename, file_size=file_size,
+                    spool_path=spool_path, content_hash=content_hash, append=append)
+    await db.ingest_jobs.insert_one(job.dict())
+    ingest_queue.put_nowait(ingest_task_for_job(job.dict()))
+    return job
+
+def ingest_task_for_job(job: dict) -> dict:
+    return {
+        "job_id": job["id"],
+        "session_id": job["session_id"],
+        "filename": job["filename"],
+        "spool_path": job["spool_path"],
+        "file_size": job["file_size"],
+        "content_hash": job["content_hash"],
+        "append": job.get("append", False)
+    }
+
+async def process_ingest_job(task: dict):
+    """Extract, store and link one queued upload, recording progress on its job"""
+    job_id = task["job_id"]
+    
+    async def report_progress(pages_done: int, pages_total: int):
+        await update_ingest_job(job_id, pages_done=pages_done, pages_total=pages_total)
+    
+    # A job re-queued by a restarting worker can also still sit in the queue of the worker that took the upload,
+    # so whichever claims it first runs it
+    claimed = await db.ingest_jobs.find_one_and_update(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "processing", "updated_at": datetime.utcnow()}}
+    )
+    if not claimed:
+        logger.info(f"Ingestion job {job_id} was already claimed by another worker")
+        return
+    
+    try:
+        # Another upload may have stored the same file while this one was queued
+        pdf_doc, _ = await ingest_pdf_document(
+            task["spool_path"], task["filename"], task["file_size"], task["content_hash"],
+            session_id=task["session_id"], progress=report_progress, reject_when_full=False, append=task.get("append", False)
+        )
+        await link_session_to_document(task["session_id"], task["filename"], pdf_doc, replace=not task.get("append"))
+        await update_ingest_job(
+            job_id,
+            status="completed",
+            document_id=pdf_doc["id"],
+            pages_done=pdf_doc.get("page_count") or 0,
+            pages_total=pdf_doc.get("page_count") or 0
+        )
+        logger.info(f"Ingestion job {job_id} completed: {task['filename']} -> document {pdf_doc['id']}")
+    except HTTPException as e:
+        await update_ingest_job(job_id, status="failed", error=e.detail)
+    except Exception as e:
+        logger.error(f"Ingestion job {job_id} failed: {e}")
+        await update_ingest_job(job_id, status="failed", error=str(e))
+    finally:
+        remove_spooled_upload(task["spool_path"])
+
+async def ingest_worker(worker_number: int):
+    while True:
+        task = await ingest_queue.get()
+        try:
+            await process_ingest_job(task)
+        except Exception as e:
+            logger.error(f"Ingestion worker {worker_number} error: {e}")
+        finally:
+            ingest_queue.task_done()
+
+def start_ingest_workers():
+    global ingest_queue
+    ingest_queue = asyncio.Queue(maxsize=max(1, INGEST_QUEUE_SIZE))
+    for worker_number in range(max(1, INGEST_WORKERS)):
+        ingest_worker_tasks.append(asyncio.create_task(ingest_worker(worker_number)))
+
+async def recover_ingest_jobs():
+    """The queue lives in memory, so jobs a crashed worker held stay 'queued' or 'processing'. Jobs idle longer than
+    PDF_INGEST_STALE_SECONDS are re-enqueued while their spooled upload is still on disk and failed otherwise; jobs of
+    live sibling workers move their updated_at forward and are left alone. Spooled uploads that no unfinished job owns
+    and that haven't been written to for as long are deleted."""
+    stale_before = datetime.utcnow() - timedelta(seconds=PDF_INGEST_STALE_SECONDS)
+    owned_spool_paths = set()
+    requeued = failed = 0
+    async for job in db.ingest_jobs.find({"status": {"$in": ["queued", "processing"]}}, {"_id": 0}):
+        spool_path = job.get("spool_path")
+        if spool_path:
+            owned_spool_paths.add(spool_path)
+        if job["updated_at"] >= stale_before:
+            continue
+        # Conditional on the state read, so two workers restarting together don't both take the job
+        unchanged = {"id": job["id"], "status": job["status"], "updated_at": job["updated_at"]}
+        if spool_path and os.path.exists(spool_path) and job.get("content_hash") and not ingest_queue.full():
+            result = await db.ingest_jobs.update_one(
+                unchanged, {"$set": {"status": "queued", "pages_done": 0, "updated_at": datetime.utcnow()}}
+            )
+            if result.modified_count:
+                ingest_queue.put_nowait(ingest_task_for_job(job))
+                requeued += 1
+        else:
+            result = await db.ingest_jobs.update_one(unchanged, {"$set": {
+                "status": "failed", "error": "Ingestion was interrupted by a restart, please upload again",
+                "updated_at": datetime.utcnow()
+            }})
+            failed += result.modified_count
+    
+    orphaned = 0
+    for spool_path in glob.glob(os.path.join(PDF_UPLOAD_SPOOL_DIR, "chatpdf-upload-*.pdf")):
+        try:
+            idle = datetime.utcfromtimestamp(os.path.getmtime(spool_path)) < stale_before
+        except FileNotFoundError:
+            continue
+        # Recent files may be uploads other workers are still spooling or extracting
+        if idle and spool_path not in owned_spool_paths:
+            remove_spooled_upload(spool_path)
+            orphaned += 1
+    if requeued or failed or orphaned:
+        logger.info(f"📦 Ingestion recovery: {requeued} jobs re-queued, {failed} failed, {orphaned} orphaned uploads removed")
+
+# Sessions only reference their PDF; legacy rows may still carry inline text until migrated
+SESSION_PROJECTION = {"pdf_content": 0}
+
+async def load_session_pdf_content(session: dict) -> Optional[str]:
+    """Load a session's PDF text from pdf_documents, falling back to legacy inline session text"""
+    if session.get("pdf_document_id"):
+        pdf_doc = await db.pdf_documents.find_one({"id": session["pdf_document_id"]}, {"content": 1, "chunk_count": 1})
+        if pdf_doc and pdf_doc.get("content"):
+            return pdf_doc["content"]  # Stored before page/chunk records existed
+        if pdf_doc and pdf_doc.get("chunk_count"):
+            # Assembled from the chunks committed so far, which is all of them once ingestion is done
+            return await get_document_text_range(session["pdf_document_id"], 0, 2 ** 62)
+    
+    # Sessions uploaded before documents were referenced by id (see mongodb_setup/migrate_session_pdf_content.py)
+    if session.get("pdf_filename"):
+        legacy = await db.chat_sessions.find_one({"id": session["id"]}, {"pdf_content": 1})
+        if legacy and legacy.get("pdf_content"):
+            return legacy["pdf_content"]
+    return None
+
+async def store_chat_message(message: ChatMessage):
+    """Insert a chat message with its token count, so replaying history never re-tokenizes it"""
+    message.token_count = await asyncio.to_thread(count_tokens, message.content)
+    await db.chat_messages.insert_one(message.dict())
+
+def _message_tokens(message: dict) -> int:
+    """Stored token count of a message; messages stored before counts were kept are counted here"""
+    if message.get("token_count") is None:
+        message["token_count"] = count_tokens(message["content"])
+    return message["token_count"]
+
+def _history_query(session_id: str, feature_type: str, after: Optional[datetime] = None) -> dict:
+    """Messages replayed for a feature: chat sees every feature's messages, other features only their own"""
+    query = {"session_id": session_id}
+    if feature_type != "chat":
+        query["feature_type"] = feature_type
+    if after:
+        query["timestamp"] = {"$gt": after}
+    return query
+
+async def load_conversation_memory(session: dict, feature_type: str, max_tokens: int) -> tuple[Optional[str], List[dict]]:
+    """The rolling summary for this feature and the most recent messages after it that fit in max_tokens, oldest first.
+    The newest message (the turn being answered) is always included."""
+    memory = (session.get("conversation_summaries") or {}).get(feature_type) or {}
+    recent = await db.chat_messages.find(
+        _history_query(session["id"], feature_type, memory.get("summarized_until")),
+        {"_id": 0, "role": 1, "content": 1, "timestamp": 1, "token_count": 1}
+    ).sort("timestamp", -1).to_list(50)
+    
+    history = []
+    used_tokens = 0
+    for message in recent:
+        message_tokens = _message_tokens(message)
+        if history and used_tokens + message_tokens > max_tokens:
+            break
+        history.append(message)
+        used_tokens += message_tokens
+    history.reverse()
+    return memory.get("summary"), history
+
+async def update_conversation_summary(session_id: str, feature_type: str, keep_tokens: int, model: str):
+    """Fold messages that no longer fit in the recent-turn budget into the session's rolling summary.
+    Runs in the background after each exchange; a concurrent update that got there first wins."""
+    session = await db.chat_sessions.find_one({"id": session_id}, {"conversation_summaries": 1})
+    if not session:
+        return
+    memory = (session.get("conversation_summaries") or {}).get(feature_type) or {}
+    summarized_until = memory.get("summarized_until")
+    messages = await db.chat_messages.find(
+        _history_query(session_id, feature_type, summarized_until),
+        {"_id": 0, "role": 1, "content": 1, "timestamp": 1, "token_count": 1}
+    ).sort("timestamp", 1).to_list(None)
+    
+    # Keep the newest messages that fit the budget verbatim; everything older is summarized
+    kept_tokens = 0
+    split = len(messages)
+    while split > 0 and kept_tokens + _message_tokens(messages[split - 1]) <= keep_tokens:
+        split -= 1
+        kept_tokens += messages[split]["token_count"]
+    to_summarize = messages[:split]
+    if not to_summarize:
+        return
+    
+    transcript = "\n\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in to_summarize)
+    previous = memory.get("summary") or "(none)"
+    summary_messages = [
+        {"role": "system", "content": "You maintain a running summary of a conversation between a user and an AI assistant."},
+        {"role": "user", "content": f"""Current summary:
+{previous}
+
+New messages:
+{_truncate_to_tokens(transcript, count_tokens(transcript), context_token_budget(model, 500))}
+
+Update the summary to include the new messages in at most {CONVERSATION_SUMMARY_MAX_WORDS} words. Keep facts, decisions, open questions and anything the user asked to remember; drop pleasantries."""}
+    ]
+    try:
+        summary = await get_ai_response_with_retries(summary_messages, model)
+    except Exception as e:
+        logger.warning(f"⚠️ Conversation summary update failed for session {session_id}: {str(e)}")
+        return
+    
+    field = f"conversation_summaries.{feature_type}"
+    await db.chat_sessions.update_one(
+        {"id": session_id, f"{field}.summarized_until": summarized_until},
+        {"$set": {field: {
+            "summary": summary.strip(),
+            "summarized_until": to_summarize[-1]["timestamp"],
+            "summarized_messages": (memory.get("summarized_messages") or 0) + len(to_summarize)
+        }}}
+    )
+
+def schedule_conversation_summary(session_id: str, feature_type: str, model: str):
+    task = asyncio.create_task(update_conversation_summary(
+        session_id, feature_type, CONVERSATION_HISTORY_MAX_TOKENS, CONVERSATION_SUMMARY_MODEL or model
+    ))
+    background_ai_tasks.add(task)
+    task.add_done_callback(background_ai_tasks.discard)
+
+# API Routes
+@api_router.post("/sessions", response_model=ChatSession)
+async def create_session(request: CreateSessionRequest):
+    session = ChatSession(
+        title=request.title
+    )
+    await db.chat_sessions.insert_one(session.dict())
+    return session
+
+@api_router.get("/sessions", response_model=List[ChatSession])
+async def get_sessions():
+    sessions = await db.chat_sessions.find({}, SESSION_PROJECTION).sort("updated_at", -1).to_list(100)
+    return [ChatSession(**session) for session in sessions]
+
+@api_router.post("/sessions/{session_id}/upload-pdf")
+async def upload_pdf(session_id: str, file: UploadFile = File(...), async_mode: bool = Query(False, alias="async"),
+                     append: bool = Query(False)):
+    # Verify session exists
+    session = await db.chat_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if append and len(session_documents(session)) >= SESSION_MAX_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"A session can hold at most {SESSION_MAX_DOCUMENTS} documents")
+    
+    # Validate file type
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    
+    # Spool the upload to disk and extract from the file, so memory use doesn't grow with PDF size
+    spool_path, file_size, content_hash = await spool_upload_to_disk(file)
+    queued = False
+    try:
+        known_file = await find_document_by_hash(content_hash)
+        if async_mode and not known_file:
+            # Hand the spooled file to the background workers and answer right away
+            job = await enqueue_ingest_job(session_id, file.filename, spool_path, file_size, content_hash, append=append)
+            queued = True
+            return JSONResponse(status_code=202, content={
+                "message": "PDF queued for processing",
+                "filename": file.filename,
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": f"/api/ingest-jobs/{job.id}"
+            })
+        
+        pdf_doc, deduplicated = await ingest_pdf_document(
+            spool_path, file.filename, file_size, content_hash, session_id=session_id, append=append
+        )
+    finally:
+        if not queued:
+            remove_spooled_upload(spool_path)
+    
+    if deduplicated:
+        logger.info(f"PDF {file.filename} matches stored document {pdf_doc['id']}, skipping extraction")
+    
+    await link_session_to_document(session_id, file.filename, pdf_doc, replace=not append)
+    
+    return {
+        "message": "PDF uploaded successfully",
+        "filename": file.filename,
+        "document_id": pdf_doc["id"],
+        "deduplicated": deduplicated,
+        "content_length": pdf_doc.get("content_length"),
+        "page_count": pdf_doc.get("page_count"),
+        "token_count": pdf_doc.get("token_count"),
+        "bytes_saved": pdf_doc.get("normalization_bytes_saved"),
+        "tokens_saved": pdf_doc.get("normalization_tokens_saved")
+    }
+
+@api_router.post("/batch-upload")
+async def batch_upload_pdfs(files: List[UploadFile] = File(...)):
+    """Upload many PDFs (or zips of PDFs) at once. Each PDF gets its own session; files are processed
+    concurrently and one JSON line per file is streamed back as it finishes."""
+    for file in files:
+        if not file.filename.lower().endswith((".pdf", ".zip")):
+            raise HTTPException(status_code=400, detail=f"{file.filename}: only PDF and zip files are allowed")
+    
+    # Spool everything first - the request body has to be read before the response starts streaming
+    spooled: List[tuple[str, str, int, str]] = []
+    try:
+        for file in files:
+            spool_path, file_size, content_hash = await spool_upload_to_disk(file)
+            if file.filename.lower().endswith(".zip"):
+                try:
+                    spooled.extend(await asyncio.to_thread(
+                        _spool_zip_members, spool_path, BATCH_UPLOAD_MAX_FILES - len(spooled)
+                    ))
+                finally:
+                    remove_spooled_upload(spool_path)
+            else:
+                spooled.append((file.filename, spool_path, file_size, content_hash))
+            if len(spooled) > BATCH_UPLOAD_MAX_FILES:
+                raise HTTPException(status_code=413, detail=f"Batch contains more than {BATCH_UPLOAD_MAX_FILES} PDFs")
+        if not spooled:
+            raise HTTPException(status_code=400, detail="No PDF files found in the upload")
+        
+        # One session per PDF, created in a single round trip
+        sessions = [ChatSession(title=os.path.splitext(filename)[0] or "New Chat") for filename, _, _, _ in spooled]
+        await db.chat_sessions.insert_many([session.dict() for session in sessions])
+        
+        # Known files are linked to their stored document; new ones are bulk-inserted as 'processing'
+        hashes = list({content_hash for _, _, _, content_hash in spooled})
+        documents_by_hash = {}
+        async for doc in db.pdf_documents.find({"content_hash": {"$in": hashes}}, {"content": 0}):
+            if await release_stale_document(doc):
+                documents_by_hash[doc["content_hash"]] = doc
+        new_documents: Dict[str, PDFDocument] = {}
+        for filename, _, file_size, content_hash in spooled:
+            if content_hash not in documents_by_hash and content_hash not in new_documents:
+                new_documents[content_hash] = PDFDocument(
+                    filename=filename, content="", file_size=file_size, content_hash=content_hash,
+                    status="processing", ingested_pages=0
+                )
+        if new_documents:
+            try:
+                await db.pdf_documents.insert_many([doc.dict() for doc in new_documents.values()], ordered=False)
+            except BulkWriteError as e:
+                # Concurrent uploads of the same files won those inserts - link to their documents instead
+                for error in e.details.get("writeErrors", []):
+                    if error.get("code") != 11000:
+                        raise
+                    content_hash = error["op"]["content_hash"]
+                    new_documents.pop(content_hash, None)
+                    documents_by_hash[content_hash] = await db.pdf_documents.find_one({"content_hash": content_hash}, {"content": 0})
+    except BaseException:
+        for _, spool_path, _, _ in spooled:
+            remove_spooled_upload(spool_path)
+        raise
+    
+    extraction_slots = asyncio.Semaphore(max(1, BATCH_UPLOAD_CONCURRENCY))
+    
+    async def ingest_one(session: ChatSession, filename: str, spool_path: str, content_hash: str) -> dict:
+        result = {"filename": filename, "session_id": session.id}
+        try:
+            # Only the first file with a given hash extracts it; the rest link to the same document
+            pdf_doc = new_documents.pop(content_hash, None)
+            if pdf_doc:
+                async with extraction_slots:
+                    stored_doc = await process_pdf_document(pdf_doc, spool_path, session.id, reject_when_full=False)
+                deduplicated = False
+            else:
+                stored_doc = documents_by_hash.get(content_hash) or await db.pdf_documents.find_one({"content_hash": content_hash}, {"content": 0})
+                if not stored_doc:
+                    raise HTTPException(status_code=400, detail="An identical file in this batch could not be processed")
+                deduplicated = True
+            await link_session_to_document(session.id, filename, stored_doc)
+            documents_by_hash[content_hash] = stored_doc
+            result.update({
+                "status": "completed",
+                "document_id": stored_doc["id"],
+                "deduplicated": deduplicated,
+                "page_count": stored_doc.get("page_count"),
+                "token_count": stored_doc.get("token_count"),
+                "bytes_saved": stored_doc.get("normalization_bytes_saved"),
+                "tokens_saved": stored_doc.get("normalization_tokens_saved")
+            })
+        except HTTPException as e:
+            result.update({"status": "failed", "error": e.detail})
+        except Exception as e:
+            logger.error(f"Batch upload of {filename} failed: {str(e)}")
+            result.update({"status": "failed", "error": f"Error processing PDF: {str(e)}"})
+        finally:
+            remove_spooled_upload(spool_path)
+        return result
+    
+    # Duplicates within the batch wait for the file that extracts their document
+    first_tasks: Dict[str, asyncio.Task] = {}
+    tasks = []
+    for session, (filename, spool_path, _, content_hash) in zip(sessions, spooled):
+        if content_hash in first_tasks:
+            async def ingest_after(first=first_tasks[content_hash], args=(session, filename, spool_path, content_hash)):
+                await asyncio.wait([first])
+                return await ingest_one(*args)
+            tasks.append(asyncio.ensure_future(ingest_after()))
+        else:
+            task = asyncio.ensure_future(ingest_one(session, filename, spool_path, content_hash))
+            if content_hash in new_documents:
+                first_tasks[content_hash] = task
+            tasks.append(task)
+    
+    async def stream_results():
+        # Tasks keep running if the client disconnects, so every file still finishes ingesting
+        completed = 0
+        failed = 0
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            completed += result["status"] == "completed"
+            failed += result["status"] == "failed"
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"summary": {"total": len(tasks), "completed": completed, "failed": failed}}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@api_router.get("/sessions/{session_id}/outline")
+async def get_session_outline(session_id: str, document_id: Optional[str] = Query(None)):
+    """Headings detected in one of the session's PDFs (the primary one by default), in document order, for picking a chapter"""
+    session = await db.chat_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    document_id = resolve_session_document(session, document_id)
+    
+    headings = await db.pdf_outline.find(
+        {"document_id": document_id},
+        {"_id": 0, "title": 1, "level": 1, "page_number": 1, "start_offset": 1, "end_offset": 1}
+    ).sort("start_offset", 1).to_list(None)
+    
+    return {
+        "session_id": session_id,
+        "document_id": document_id,
+        "headings": headings
+    }
+
+@api_router.get("/sessions/{session_id}/summary")
+async def get_session_summary(session_id: str, document_id: Optional[str] = Query(None)):
+    """The stored summary of one of the session's PDFs (the primary one by default): an overview plus one summary per section"""
+    session = await db.chat_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    document_id = resolve_session_document(session, document_id)
+    
+    record = await load_document_summary(document_id)
+    if not record:
+        return {"session_id": session_id, "document_id": document_id, "status": "processing" if DOCUMENT_SUMMARY_ENABLED else "disabled"}
+    return {
+        "session_id": session_id,
+        "document_id": document_id,
+        "status": "ready",
+        "summary": record["summary"],
+        "sections": record["sections"]
+    }
+
+@api_router.delete("/sessions/{session_id}/documents/{document_id}")
+async def detach_session_document(session_id: str, document_id: str):
+    """Remove one PDF from a multi-document session. The stored document is kept for deduplication."""
+    session = await db.chat_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    documents = session_documents(session)
+    remaining = [doc for doc in documents if doc["document_id"] != document_id]
+    if len(remaining) == len(documents):
+        raise HTTPException(status_code=404, detail="Document not attached to this session")
+    
+    update = {"$set": {"documents": remaining, "updated_at": datetime.utcnow()}}
+    if session.get("pdf_document_id") == document_id:
+        if remaining:
+            latest = remaining[-1]
+            update["$set"].update({
+                "pdf_filename": latest["filename"],
+                "pdf_document_id": latest["document_id"],
+                "pdf_page_count": latest.get("page_count"),
+                "ingested_pages": latest.get("ingested_pages")
+            })
+        else:
+            update["$unset"] = {"pdf_filename": "", "pdf_document_id": "", "pdf_page_count": "", "ingested_pages": ""}
+    await db.chat_sessions.update_one({"id": session_id}, update)
+    return {"message": "Document removed from session", "documents": remaining}
+
+@api_router.get("/ingest-jobs/{job_id}", response_model=IngestJob)
+async def get_ingest_job(job_id: str):
+    job = await db.ingest_jobs.find_one({"id": job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return IngestJob(**job)
+
+async def prepare_chat_turn(session_id: str, request: SendMessageRequest) -> List[Dict]:
+    """Save the user's message and build the provider messages for this turn"""
+    # Verify session exists
+    session = await db.chat_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    # Save user message
+    user_message = ChatMessage(
+        session_id=session_id,
+        content=request.content,
+        role="user",
+        feature_type=request.feature_type
+    )
+    await store_chat_message(user_message)
+    
+    # Rolling summary of older turns plus the recent ones that fit the history budget
+    conversation_summary, chat_history = await load_conversation_memory(
+        session, request.feature_type, CONVERSATION_HISTORY_MAX_TOKENS
+    )
+    
+    # Prepare messages for AI based on feature type
+    ai_messages = []
+    
+    if request.feature_type == "general_ai":
+        # General AI chat - no PDF context
+        ai_messages.append({
+            "role": "system", 
+            "content": "You are a helpful AI assistant. Answer any questions the user has with accurate and helpful information."
+        })
+    elif request.feature_type == "compare":
+        # Compare mode: relevant excerpts from every attached document, within one budget however many there are
+        documents = session_documents(session)
+        history_tokens = sum(msg["token_count"] for msg in chat_history) + count_tokens(conversation_summary or "")
+        pdf_content = await pack_compare_context(
+            documents, request.content, context_token_budget(request.model, history_tokens)
+        )
+        if pdf_content:
+            system_message = f"""You are an AI assistant specialized in comparing PDF documents.
+
+{pdf_content}
+
+Answer by comparing the documents: point out where they agree, where they differ and what only one of them covers. Refer to each document by its name and cite page numbers when shown."""
+            if len(documents) < 2:
+                system_message += "\n\nNote: only one document is attached to this session. Mention that the user can attach more PDFs to compare."
+            ai_messages.append({"role": "system", "content": system_message})
+        else:
+            ai_messages.append({
+                "role": "system", 
+                "content": "You are a helpful AI assistant. No PDF has been uploaded yet. Please ask the user to upload the PDF documents to compare first."
+            })
+    else:
+        # PDF-based features: pack as much of the document as the model's budget allows next to the history
+        history_tokens = sum(msg["token_count"] for msg in chat_history) + count_tokens(conversation_summary or "")
+        pdf_content = await pack_session_pdf_context(
+            session, context_token_budget(request.model, history_tokens), queries=[request.content]
+        )
+        if pdf_content:
+            if request.feature_type == "chat":
                 system_message = f"""You are an AI assistant specialized in analyzing PDF documents. 
 
 PDF Content:
-{pdf_content[:4000]}...
+{pdf_content}...
 
-Please answer questions based on this PDF content. Be specific and reference the document when possible."""
+Please answer questions based on this PDF content. Be specific and reference the document (and page numbers, when shown) when possible."""
+                
+                # The PDF may still be ingesting - tell the model which part it can see
+                if session.get("pdf_page_count") and (session.get("ingested_pages") or 0) < session["pdf_page_count"]:
+                    system_message += f"\n\nNote: only the first {session.get('ingested_pages') or 0} of {session['pdf_page_count']} pages have been processed so far. If the answer may be in later pages, say so."
             
             ai_messages.append({"role": "system", "content": system_message})
         else:
@@ -1465,17 +3897,21 @@ Please answer questions based on this PDF content. Be specific and reference the
                 "content": "You are a helpful AI assistant. No PDF has been uploaded yet. Please ask the user to upload a PDF document first."
             })
     
-    # Add recent conversation history
-    for msg in chat_history[-10:]:  # Last 10 messages for context
-        if msg["feature_type"] == request.feature_type or request.feature_type == "chat":
-            ai_messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
-    
-    # Get AI response
-    ai_response = await get_ai_response(ai_messages, request.model)
+    if conversation_summary:
+        ai_messages[0]["content"] += f"\n\nSummary of the earlier conversation:\n{conversation_summary}"
     
+    # Add recent conversation history
+    for msg in chat_history:
+        ai_messages.append({
+            "role": msg["role"],
+            "content": msg["content"]
+        })
+    return ai_messages
+
+async def save_chat_response(session_id: str, request: SendMessageRequest, ai_response: str,
+                             progress: Optional[dict] = None) -> ChatMessage:
+    """Store the assistant's answer. progress["saved"] is set as soon as the message is stored, so a caller
+    whose save failed later on (updating the session, scheduling the summary) doesn't store it again."""
     # Save AI message
     ai_message = ChatMessage(
         session_id=session_id,
@@ -1483,16 +3919,59 @@ Please answer questions based on this PDF content. Be specific and reference the
         role="assistant",
         feature_type=request.feature_type
     )
-    await db.chat_messages.insert_one(ai_message.dict())
+    await store_chat_message(ai_message)
+    if progress is not None:
+        progress["saved"] = True
     
     # Update session timestamp
     await db.chat_sessions.update_one(
         {"id": session_id},
         {"$set": {"updated_at": datetime.utcnow()}}
     )
+    schedule_conversation_summary(session_id, request.feature_type, request.model)
+    return ai_message
+
+@api_router.post("/sessions/{session_id}/messages")
+async def send_message(session_id: str, request: SendMessageRequest):
+    ai_messages = await prepare_chat_turn(session_id, request)
+    
+    # Get AI response
+    ai_response = await get_ai_response(ai_messages, request.model)
+    ai_message = await save_chat_response(session_id, request, ai_response)
     
     return {"ai_response": ai_message}
 
+@api_router.post("/sessions/{session_id}/messages/stream")
+async def send_message_stream(session_id: str, request: SendMessageRequest):
+    """Like send_message, but relays the answer as server-sent events while it is generated:
+    `token` events carry text deltas, then a `done` event carries the saved message (or an `error` event)."""
+    ai_messages = await prepare_chat_turn(session_id, request)
+    
+    async def relay_tokens():
+        parts: List[str] = []
+        progress = {"saved": False}
+        try:
+            async for delta in stream_ai_response(ai_messages, request.model):
+                parts.append(delta)
+                yield f"event: token\ndata: {json.dumps({'content': delta})}\n\n"
+            ai_message = await save_chat_response(session_id, request, "".join(parts), progress)
+            yield f"event: done\ndata: {json.dumps(jsonable_encoder({'ai_response': ai_message}))}\n\n"
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.error(f"Streaming chat error: {detail}")
+            yield f"event: error\ndata: {json.dumps({'detail': detail})}\n\n"
+        finally:
+            if parts and not progress["saved"]:
+                # Client went away or the stream broke mid-answer: keep what was generated
+                task = asyncio.create_task(save_chat_response(session_id, request, "".join(parts)))
+                background_ai_tasks.add(task)
+                task.add_done_callback(background_ai_tasks.discard)
+    
+    return StreamingResponse(relay_tokens(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Let tokens through reverse proxies as they arrive
+    })
+
 @api_router.delete("/sessions/{session_id}")
 async def delete_session(session_id: str):
     # Delete session
@@ -1508,7 +3987,7 @@ async def delete_session(session_id: str):
 @api_router.get("/sessions/{session_id}/messages", response_model=List[ChatMessage])
 async def get_messages(session_id: str, feature_type: Optional[str] = Query(None)):
     # Verify session exists
-    session = await db.chat_sessions.find_one({"id": session_id})
+    session = await db.chat_sessions.find_one({"id": session_id}, SESSION_PROJECTION)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -1584,26 +4063,124 @@ async def get_available_models():
 
 # Removed research endpoint - replaced with new features
 
+def split_translation_chunks(content: str, chunk_tokens: int) -> List[str]:
+    """Pack whole paragraphs into chunks of at most chunk_tokens; longer paragraphs are split on line boundaries"""
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in re.split(r'\n\s*\n', content):
+        if not paragraph.strip():
+            continue
+        paragraph_tokens = count_tokens(paragraph)
+        if current and current_tokens + paragraph_tokens > chunk_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        if paragraph_tokens > chunk_tokens:
+            chunks.extend(paragraph[start:end] for start, end, _ in _split_into_chunks(paragraph, chunk_tokens))
+            continue
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+async def translate_document_chunks(session: dict, request: TranslateRequest) -> tuple[List[str], List[asyncio.Task]]:
+    """Start translating every chunk of the session's document concurrently. Returns the source chunks and one task per chunk,
+    in document order; a chunk that still fails after retries resolves to its untranslated text under a visible marker."""
+    content = await load_session_pdf_content(session)
+    if not content:
+        raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
+    chunks = split_translation_chunks(content, TRANSLATION_CHUNK_TOKENS)
+    call_slots = asyncio.Semaphore(ai_call_concurrency(request.model))
+    
+    async def translate_chunk(index: int, chunk: str) -> dict:
+        messages = [
+            {"role": "system", "content": f"You are a professional translator. Translate the given content accurately to {request.target_language} while maintaining the original meaning and context. Reply with the translation only."},
+            {"role": "user", "content": f"Translate this document content to {request.target_language}:\n\n{chunk}"}
+        ]
+        try:
+            async with call_slots:
+                translation = await get_ai_response_with_retries(messages, request.model)
+            return {"index": index, "status": "completed", "translation": translation.strip()}
+        except Exception as e:
+            logger.warning(f"Translation of chunk {index + 1}/{len(chunks)} failed: {str(e)}")
+            marker = f"[Not translated: part {index + 1} of {len(chunks)} failed, original text follows]"
+            return {"index": index, "status": "failed", "translation": f"{marker}\n{chunk}", "error": str(e)}
+    
+    return chunks, [asyncio.create_task(translate_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+
+async def save_document_translation(request: TranslateRequest, tasks: List[asyncio.Task]) -> tuple[str, int]:
+    """Reassemble the chunk translations in order and save them as one message. Returns (translation, failed chunks).
+    Nothing is saved when more than TRANSLATION_MAX_FAILED_RATIO of the chunks failed."""
+    results = await asyncio.gather(*tasks)
+    translation = "\n\n".join(result["translation"] for result in results)
+    failed = sum(result["status"] == "failed" for result in results)
+    if failed > len(results) * TRANSLATION_MAX_FAILED_RATIO:
+        raise HTTPException(status_code=502, detail=f"Translation failed: {failed} of {len(results)} parts could not be translated")
+    translation_message = ChatMessage(
+        session_id=request.session_id,
+        content=f"Translation to {request.target_language} (document):\n{translation}",
+        role="assistant",
+        feature_type="translation"
+    )
+    await store_chat_message(translation_message)
+    return translation, failed
+
 @api_router.post("/translate")
-async def translate_pdf(request: TranslateRequest):
+async def translate_pdf(request: TranslateRequest, stream: bool = Query(False)):
     # Verify session exists and has PDF
-    session = await db.chat_sessions.find_one({"id": request.session_id})
+    session = await db.chat_sessions.find_one({"id": request.session_id}, SESSION_PROJECTION)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    if not session.get("pdf_content"):
-        raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
-    
-    pdf_content = session["pdf_content"]
+    if request.content_type == "document":
+        chunks, tasks = await translate_document_chunks(session, request)
+        # Saving runs as its own task so the translation is stored even if a streaming client disconnects
+        save_task = asyncio.create_task(save_document_translation(request, tasks))
+        background_ai_tasks.add(save_task)
+        save_task.add_done_callback(background_ai_tasks.discard)
+        
+        if stream:
+            async def stream_translation():
+                # Chunks are emitted in document order, each as soon as it and every chunk before it has finished
+                for task in tasks:
+                    result = await asyncio.shield(task)
+                    yield json.dumps({**result, "total": len(tasks)}) + "\n"
+                try:
+                    _, failed = await asyncio.shield(save_task)
+                except HTTPException as e:
+                    failed = sum(task.result()["status"] == "failed" for task in tasks)
+                    yield json.dumps({"summary": {"total": len(tasks), "completed": len(tasks) - failed, "failed": failed, "error": e.detail}}) + "\n"
+                    return
+                yield json.dumps({"summary": {"total": len(tasks), "completed": len(tasks) - failed, "failed": failed}}) + "\n"
+            return StreamingResponse(stream_translation(), media_type="application/x-ndjson")
+        
+        translation_result, failed = await save_task
+        return {
+            "session_id": request.session_id,
+            "target_language": request.target_language,
+            "content_type": request.content_type,
+            "translation": translation_result,
+            "chunks": len(chunks),
+            "failed_chunks": failed
+        }
     
     # Limit content based on type
+    token_budget = context_token_budget(request.model)
     if request.content_type == "summary":
-        content_to_translate = pdf_content[:2000]
+        document_summary = await load_document_summary(session.get("pdf_document_id"))
+        if document_summary:
+            content_to_translate = format_document_summary(document_summary, token_budget // 2)
+        else:
+            content_to_translate = await pack_session_pdf_context(session, token_budget // 2)
         translation_instruction = f"Provide a translated summary of this document in {request.target_language}:"
     else:
-        content_to_translate = pdf_content[:4000]
+        content_to_translate = await pack_session_pdf_context(session, token_budget)
         translation_instruction = f"Translate this document content to {request.target_language}:"
     
+    if not content_to_translate:
+        raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
+    
     ai_messages = [
         {
             "role": "system", 
@@ -1626,7 +4203,7 @@ async def translate_pdf(request: TranslateRequest):
         role="assistant",
         feature_type="translation"
     )
-    await db.chat_messages.insert_one(translation_message.dict())
+    await store_chat_message(translation_message)
     
     return {
         "session_id": request.session_id,
@@ -1635,49 +4212,92 @@ async def translate_pdf(request: TranslateRequest):
         "translation": translation_result
     }
 
-@api_router.post("/generate-questions")
-async def generate_questions(request: GenerateQuestionsRequest):
-    # Verify session exists and has PDF
-    session = await db.chat_sessions.find_one({"id": request.session_id})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    
-    if not session.get("pdf_content"):
+def _distribute_count(total: int, weights: List[int]) -> List[int]:
+    """Split total into one share per weight, proportionally, every share at least 1 (largest remainder)"""
+    spare = total - len(weights)
+    if not any(weights):
+        weights = [1] * len(weights)
+    weight_sum = sum(weights)
+    exact = [spare * weight / weight_sum for weight in weights]
+    shares = [int(value) for value in exact]
+    by_remainder = sorted(range(len(weights)), key=lambda i: exact[i] - shares[i], reverse=True)
+    for i in by_remainder[:spare - sum(shares)]:
+        shares[i] += 1
+    return [share + 1 for share in shares]
+
+COVERAGE_MIN_SECTION_TOKENS = 1000  # Floor for a section's share of the context budget
+
+async def generate_with_coverage(document_id: str, model: str, item_count: int, build_messages) -> tuple[str, int]:
+    """Generate items from sections sampled across the whole document, one concurrent call per section.
+    The sections share one context budget, so a request costs about as much input as a single-prompt one.
+    build_messages(section_content, count, first_item) returns the prompt for one section, first_item being the
+    position of its first item in the whole request. Returns (merged text, sections used)."""
+    max_sections = max(1, min(COVERAGE_MAX_SECTIONS, item_count))
+    budget = context_token_budget(model, reserved_tokens=500)
+    sections = await sample_document_sections(
+        document_id, max_sections, min(budget, max(COVERAGE_MIN_SECTION_TOKENS, budget // max_sections))
+    )
+    if not sections:
         raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
+    if len(sections) == 1:
+        return await get_ai_response(build_messages(sections[0]["content"], item_count, 0), model), 1
     
-    pdf_content = session["pdf_content"]
-    
-    # Handle chapter segmentation if specified
-    if request.chapter_segment:
-        # Simple chapter detection - could be enhanced
-        content_lines = pdf_content.split('\n')
-        chapter_content = []
-        in_chapter = False
-        
-        for line in content_lines:
-            if request.chapter_segment.lower() in line.lower():
-                in_chapter = True
-            elif any(keyword in line.lower() for keyword in ['chapter', 'section']) and in_chapter:
-                break
-            
-            if in_chapter:
-                chapter_content.append(line)
-        
-        pdf_content = '\n'.join(chapter_content)[:4000] if chapter_content else pdf_content[:4000]
-    else:
-        pdf_content = pdf_content[:4000]
-    
-    # Question generation prompts based on type
-    question_prompts = {
-        "faq": "Generate 8-10 frequently asked questions (FAQs) with detailed answers based on this document content.",
-        "mcq": "Generate 10 multiple choice questions (A, B, C, D) with correct answers marked, based on this document content.",
-        "true_false": "Generate 10 true/false questions with explanations for each answer, based on this document content.",
-        "mixed": "Generate a mix of question types: 3 FAQs, 4 multiple choice questions, and 3 true/false questions based on this document content."
-    }
+    counts = _distribute_count(item_count, [section["token_count"] for section in sections])
+    first_items = [sum(counts[:i]) for i in range(len(counts))]
+    call_slots = asyncio.Semaphore(ai_call_concurrency(model))
     
-    prompt = question_prompts.get(request.question_type, question_prompts["mixed"])
-    
-    ai_messages = [
+    async def generate_section(section: dict, count: int, first_item: int) -> Optional[str]:
+        try:
+            async with call_slots:
+                return await get_ai_response_with_retries(build_messages(section["content"], count, first_item), model)
+        except Exception as e:
+            logger.warning(f"Generation for section {section['title']} failed: {str(e)}")
+            return None
+    
+    results = await asyncio.gather(*[
+        generate_section(section, count, first_item) for section, count, first_item in zip(sections, counts, first_items)
+    ])
+    merged = [f"## {section['title']}\n\n{result.strip()}" for section, result in zip(sections, results) if result]
+    if not merged:
+        raise HTTPException(status_code=500, detail="Generation failed for every section of the document")
+    return "\n\n".join(merged), len(merged)
+
+QUESTION_TYPE_PROMPTS = {
+    "faq": "Generate {count} frequently asked questions (FAQs) with detailed answers based on this document content.",
+    "mcq": "Generate {count} multiple choice questions (A, B, C, D) with correct answers marked, based on this document content.",
+    "true_false": "Generate {count} true/false questions with explanations for each answer, based on this document content.",
+    "mixed": "Generate a mix of question types: {mix} based on this document content."
+}
+QUESTION_TYPE_COUNTS = {"faq": 9, "mcq": 10, "true_false": 10, "mixed": 10}
+MIXED_QUESTION_COUNTS = {"faq": 3, "mcq": 4, "true_false": 3}  # Adds up to QUESTION_TYPE_COUNTS["mixed"]
+MIXED_QUESTION_LABELS = {
+    "faq": ("FAQ", "FAQs"),
+    "mcq": ("multiple choice question", "multiple choice questions"),
+    "true_false": ("true/false question", "true/false questions")
+}
+
+def _mixed_question_sequence() -> List[str]:
+    """The mixed question types interleaved evenly, so any run of consecutive items has a spread of types"""
+    slots = [
+        ((i + 0.5) / count, question_type)
+        for question_type, count in MIXED_QUESTION_COUNTS.items() for i in range(count)
+    ]
+    return [question_type for _, question_type in sorted(slots)]
+
+def question_prompt(question_type: str, count: int, first_item: int = 0) -> str:
+    """The generation prompt for count questions; mixed requests get their share of the 3/4/3 mix by position"""
+    if question_type != "mixed":
+        return QUESTION_TYPE_PROMPTS[question_type].format(count=count)
+    sequence = _mixed_question_sequence()
+    share = Counter(sequence[(first_item + i) % len(sequence)] for i in range(count))
+    mix = [
+        f"{share[question_type]} {MIXED_QUESTION_LABELS[question_type][share[question_type] != 1]}"
+        for question_type in MIXED_QUESTION_COUNTS if share[question_type]
+    ]
+    return QUESTION_TYPE_PROMPTS["mixed"].format(mix=", ".join(mix[:-1]) + (" and " if len(mix) > 1 else "") + mix[-1])
+
+def _question_messages(prompt: str, pdf_content: str) -> List[Dict]:
+    return [
         {
             "role": "system", 
             "content": "You are an AI assistant specialized in creating educational questions from document content. Generate clear, relevant questions that test comprehension and knowledge retention."
@@ -1692,8 +4312,81 @@ Document Content:
 Format your response clearly with question numbers, and for MCQs include all options (A, B, C, D) with the correct answer marked."""
         }
     ]
+
+@api_router.post("/generate-questions")
+async def generate_questions(request: GenerateQuestionsRequest):
+    # Verify session exists and has PDF
+    session = await db.chat_sessions.find_one({"id": request.session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
     
-    questions_result = await get_ai_response(ai_messages, request.model)
+    pdf_doc = None
+    has_outline = False
+    if session.get("pdf_document_id"):
+        pdf_doc = await db.pdf_documents.find_one({"id": session["pdf_document_id"]}, {"chunk_count": 1})
+        has_outline = bool(await db.pdf_outline.find_one({"document_id": session["pdf_document_id"]}, {"_id": 1}))
+    has_chunks = bool(pdf_doc and pdf_doc.get("chunk_count"))
+    question_type = request.question_type if request.question_type in QUESTION_TYPE_PROMPTS else "mixed"
+    
+    document_summary = None
+    if not request.chapter_segment and question_type == "faq":
+        document_summary = await load_document_summary(session.get("pdf_document_id"))
+    
+    if document_summary:
+        # FAQs are about the document as a whole, which the stored summary covers in one prompt
+        summary_content = format_document_summary(document_summary, context_token_budget(request.model, reserved_tokens=500))
+        prompt = question_prompt("faq", QUESTION_TYPE_COUNTS["faq"])
+        questions_result = await get_ai_response(_question_messages(prompt, summary_content), request.model)
+        sections_used = len(document_summary["sections"])
+    elif not request.chapter_segment and has_chunks:
+        # Questions are drawn from sections across the whole document, not just its opening
+        questions_result, sections_used = await generate_with_coverage(
+            session["pdf_document_id"], request.model, QUESTION_TYPE_COUNTS[question_type],
+            lambda content, count, first_item: _question_messages(question_prompt(question_type, count, first_item), content)
+        )
+    else:
+        budget = context_token_budget(request.model, reserved_tokens=500)
+        if request.chapter_segment and has_chunks:
+            section = await find_document_section(session["pdf_document_id"], request.chapter_segment) if has_outline else None
+            if section:
+                # The outline index built at ingest maps the chapter to its offsets; only that slice is loaded
+                pdf_content = await get_document_text_within_tokens(
+                    session["pdf_document_id"], section["start_offset"], section["end_offset"], budget
+                )
+            else:
+                # Not a detected heading: the chunks that best match the chapter name stand in for it
+                chapter_chunks = await retrieve_relevant_chunks(session["pdf_document_id"], [request.chapter_segment])
+                if not chapter_chunks:
+                    raise HTTPException(status_code=404, detail=f"Chapter '{request.chapter_segment}' not found in the document")
+                pdf_content = _format_retrieved_chunks(chapter_chunks, budget)
+        elif request.chapter_segment:
+            # Documents stored before page/chunk records existed have no index, so chapter detection scans the text
+            pdf_content = await load_session_pdf_content(session)
+            if pdf_content:
+                content_lines = pdf_content.split('\n')
+                chapter_content = []
+                in_chapter = False
+                
+                for line in content_lines:
+                    if request.chapter_segment.lower() in line.lower():
+                        in_chapter = True
+                    elif any(keyword in line.lower() for keyword in ['chapter', 'section']) and in_chapter:
+                        break
+                    
+                    if in_chapter:
+                        chapter_content.append(line)
+                
+                if chapter_content:
+                    pdf_content = '\n'.join(chapter_content)
+                pdf_content = _truncate_to_tokens(pdf_content, count_tokens(pdf_content), budget)
+        else:
+            pdf_content = await pack_session_pdf_context(session, budget)
+        if not pdf_content:
+            raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
+        
+        prompt = question_prompt(question_type, QUESTION_TYPE_COUNTS[question_type])
+        questions_result = await get_ai_response(_question_messages(prompt, pdf_content), request.model)
+        sections_used = 1
     
     # Save questions as message
     questions_message = ChatMessage(
@@ -1702,27 +4395,23 @@ Format your response clearly with question numbers, and for MCQs include all opt
         role="assistant",
         feature_type="question_generation"
     )
-    await db.chat_messages.insert_one(questions_message.dict())
+    await store_chat_message(questions_message)
     
     return {
         "session_id": request.session_id,
         "question_type": request.question_type,
         "chapter_segment": request.chapter_segment,
-        "questions": questions_result
+        "questions": questions_result,
+        "sections": sections_used
     }
 
 @api_router.post("/generate-quiz")
 async def generate_quiz(request: GenerateQuizRequest):
     # Verify session exists and has PDF
-    session = await db.chat_sessions.find_one({"id": request.session_id})
+    session = await db.chat_sessions.find_one({"id": request.session_id}, SESSION_PROJECTION)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    if not session.get("pdf_content"):
-        raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
-    
-    pdf_content = session["pdf_content"][:4000]  # Limit content length
-    
     # Difficulty level instructions
     difficulty_instructions = {
         "easy": "Create basic comprehension questions that test understanding of main concepts.",
@@ -1732,25 +4421,26 @@ async def generate_quiz(request: GenerateQuizRequest):
     
     difficulty_instruction = difficulty_instructions.get(request.difficulty, difficulty_instructions["medium"])
     
-    # Quiz type specific instructions
-    if request.quiz_type == "daily":
-        quiz_instruction = f"Generate a daily revision quiz with {request.question_count} questions. Focus on key concepts for daily review."
-    else:
-        quiz_instruction = f"Generate a comprehensive quiz with {request.question_count} questions covering the document content."
-    
-    ai_messages = [
-        {
-            "role": "system", 
-            "content": f"You are an AI quiz generator specialized in creating educational quizzes. {difficulty_instruction} Make questions clear and provide correct answers."
-        },
-        {
-            "role": "user", 
-            "content": f"""{quiz_instruction}
+    def quiz_messages(pdf_content: str, question_count: int, first_item: int = 0) -> List[Dict]:
+        # Quiz type specific instructions
+        if request.quiz_type == "daily":
+            quiz_instruction = f"Generate a daily revision quiz with {question_count} questions. Focus on key concepts for daily review."
+        else:
+            quiz_instruction = f"Generate a comprehensive quiz with {question_count} questions covering the document content."
+        
+        return [
+            {
+                "role": "system", 
+                "content": f"You are an AI quiz generator specialized in creating educational quizzes. {difficulty_instruction} Make questions clear and provide correct answers."
+            },
+            {
+                "role": "user", 
+                "content": f"""{quiz_instruction}
 
 Document Content:
 {pdf_content}
 
-Create {request.question_count} questions in mixed format (multiple choice, true/false, short answer). 
+Create {question_count} questions in mixed format (multiple choice, true/false, short answer). 
 For each question, provide:
 1. The question
 2. Answer options (if applicable)
@@ -1758,10 +4448,29 @@ For each question, provide:
 4. Brief explanation
 
 Format the quiz clearly with question numbers."""
-        }
-    ]
+            }
+        ]
     
-    quiz_result = await get_ai_response(ai_messages, request.model)
+    pdf_doc = None
+    if session.get("pdf_document_id"):
+        pdf_doc = await db.pdf_documents.find_one({"id": session["pdf_document_id"]}, {"chunk_count": 1})
+    document_summary = await load_document_summary(session.get("pdf_document_id")) if request.quiz_type == "daily" else None
+    if document_summary:
+        # Daily revision covers key concepts, which the stored summary already condenses for the whole document
+        summary_content = format_document_summary(document_summary, context_token_budget(request.model))
+        quiz_result = await get_ai_response(quiz_messages(summary_content, request.question_count), request.model)
+        sections_used = len(document_summary["sections"])
+    elif pdf_doc and pdf_doc.get("chunk_count"):
+        # Questions are spread over sections sampled across the whole document
+        quiz_result, sections_used = await generate_with_coverage(
+            session["pdf_document_id"], request.model, max(1, request.question_count), quiz_messages
+        )
+    else:
+        pdf_content = await pack_session_pdf_context(session, context_token_budget(request.model))
+        if not pdf_content:
+            raise HTTPException(status_code=400, detail="No PDF uploaded in this session")
+        quiz_result = await get_ai_response(quiz_messages(pdf_content, request.question_count), request.model)
+        sections_used = 1
     
     # Save quiz as message
     quiz_message = ChatMessage(
@@ -1770,14 +4479,15 @@ Format the quiz clearly with question numbers."""
         role="assistant",
         feature_type="quiz_generation"
     )
-    await db.chat_messages.insert_one(quiz_message.dict())
+    await store_chat_message(quiz_message)
     
     return {
         "session_id": request.session_id,
         "quiz_type": request.quiz_type,
         "difficulty": request.difficulty,
         "question_count": request.question_count,
-        "quiz": quiz_result
+        "quiz": quiz_result,
+        "sections": sections_used
     }
 
 @api_router.post("/search")
@@ -1785,14 +4495,46 @@ async def advanced_search(request: SearchRequest):
     results = []
     
     if request.search_type in ["all", "pdfs"]:
-        # Search in PDF documents
-        pdf_query = {"content": {"$regex": request.query, "$options": "i"}}
+        query_lower = request.query.lower()
+        
+        # Search page records so only matching pages are read, not whole documents. Pages split the text only where
+        # it already has a page-break newline, so unlike chunks no single-line match is cut in two
+        page_hits = await db.pdf_pages.aggregate([
+            {"$match": {"content": {"$regex": request.query, "$options": "i"}}},
+            {"$sort": {"document_id": 1, "page_number": 1}},
+            {"$group": {"_id": "$document_id", "first_match": {"$first": "$content"}, "matching_pages": {"$sum": 1}}},
+            {"$sort": {"matching_pages": -1, "_id": 1}},
+            {"$limit": request.limit}
+        ], allowDiskUse=True).to_list(request.limit)
+        
+        hit_docs = await db.pdf_documents.find(
+            {"id": {"$in": [hit["_id"] for hit in page_hits]}},
+            {"id": 1, "filename": 1, "upload_date": 1}
+        ).to_list(len(page_hits))
+        docs_by_id = {doc["id"]: doc for doc in hit_docs}
+        
+        for hit in page_hits:
+            doc = docs_by_id.get(hit["_id"])
+            if not doc:
+                continue
+            page_text = hit["first_match"]
+            match_idx = page_text.lower().find(query_lower)
+            start_idx = max(0, match_idx - 100) if match_idx != -1 else 0
+            results.append({
+                "type": "pdf",
+                "filename": doc["filename"],
+                "snippet": page_text[start_idx:start_idx + 300],
+                "upload_date": doc["upload_date"],
+                "relevance_score": hit["matching_pages"]
+            })
+        
+        # Documents stored before chunk records existed
+        pdf_query = {"content": {"$regex": request.query, "$options": "i"}, "chunk_count": {"$exists": False}}
         pdf_docs = await db.pdf_documents.find(pdf_query).limit(request.limit).to_list(request.limit)
         
         for doc in pdf_docs:
             # Find snippet around the search term
             content = doc["content"]
-            query_lower = request.query.lower()
             content_lower = content.lower()
             
             if query_lower in content_lower:
@@ -1815,7 +4557,7 @@ async def advanced_search(request: SearchRequest):
         
         for msg in messages:
             # Get session info for context
-            session = await db.chat_sessions.find_one({"id": msg["session_id"]})
+            session = await db.chat_sessions.find_one({"id": msg["session_id"]}, {"title": 1})
             session_title = session["title"] if session else "Unknown Session"
             
             results.append({
@@ -1840,7 +4582,7 @@ async def advanced_search(request: SearchRequest):
 @api_router.post("/export")
 async def export_conversation(request: ExportRequest):
     # Verify session exists
-    session = await db.chat_sessions.find_one({"id": request.session_id})
+    session = await db.chat_sessions.find_one({"id": request.session_id}, SESSION_PROJECTION)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
@@ -1938,39 +4680,388 @@ async def export_conversation(request: ExportRequest):
     else:
         raise HTTPException(status_code=400, detail="Unsupported export format")
 
-@api_router.post("/research")
-async def research_content(request: ResearchRequest):
-    """Generate research content from PDF"""
-    session = await db.chat_sessions.find_one({"id": request.session_id})
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+RESEARCH_QUERIES = {
+    "summary": [
+        "main topic purpose and scope of the document",
+        "key points arguments and conclusions"
+    ],
+    "detailed_research": [
+        "research question objectives and motivation",
+        "methodology approach data and experiments",
+        "results findings and evidence",
+        "limitations discussion and future work",
+        "conclusions and implications"
+    ]
+}
+
+RESEARCH_MAP_PROMPTS = {
+    "summary": "Summarize the main points of this section in at most 150 words.",
+    "detailed_research": "Extract the research-relevant content of this section in at most 200 words: claims, methods, data, results, limitations and notable quotes. Skip anything irrelevant."
+}
+
+async def update_research_job(job_id: Optional[str], **fields):
+    if job_id:
+        fields["updated_at"] = datetime.utcnow()
+        await db.research_jobs.update_one({"id": job_id}, {"$set": fields})
+
+async def fail_interrupted_research_jobs():
+    """Research jobs run as in-process tasks, so one left unfinished by a crashed worker never completes. Jobs of live
+    sibling workers move updated_at forward as segments finish, so only jobs idle past RESEARCH_JOB_STALE_SECONDS are failed."""
+    stale_before = datetime.utcnow() - timedelta(seconds=RESEARCH_JOB_STALE_SECONDS)
+    result = await db.research_jobs.update_many(
+        {"status": {"$in": ["queued", "mapping", "reducing"]}, "updated_at": {"$lt": stale_before}},
+        {"$set": {"status": "failed", "error": "Research was interrupted by a restart, please retry", "updated_at": datetime.utcnow()}}
+    )
+    if result.modified_count:
+        logger.warning(f"⚠️ Marked {result.modified_count} interrupted research jobs as failed")
+
+async def build_research_segments(document_id: str, model: str) -> List[dict]:
+    """Group consecutive chunks into map segments sized so the whole document fits in RESEARCH_MAX_MAP_SEGMENTS calls"""
+    chunks = await db.pdf_chunks.find(
+        {"document_id": document_id},
+        {"_id": 0, "content": 1, "token_count": 1, "page_start": 1, "page_end": 1}
+    ).sort("chunk_index", 1).to_list(None)
+    total_tokens = sum(chunk["token_count"] for chunk in chunks)
+    window_limit = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_MODEL_CONTEXT_TOKENS) - AI_RESPONSE_MAX_TOKENS - 500
+    segment_tokens = min(window_limit, max(RESEARCH_MAP_SEGMENT_TOKENS, math.ceil(total_tokens / max(1, RESEARCH_MAX_MAP_SEGMENTS))))
+    
+    segments = []
+    for chunk in chunks:
+        if not segments or segments[-1]["token_count"] + chunk["token_count"] > segment_tokens:
+            segments.append({"content": "", "token_count": 0, "page_start": chunk["page_start"], "page_end": chunk["page_end"]})
+        segment = segments[-1]
+        segment["content"] += chunk["content"]
+        segment["token_count"] += chunk["token_count"]
+        segment["page_end"] = chunk["page_end"]
+    return segments
+
+async def map_document_segments(segments: List[dict], map_prompt: str, model: str, call_slots: asyncio.Semaphore,
+                                on_segment_done=None) -> List[Optional[str]]:
+    """Run map_prompt over every segment concurrently. Returns one note per segment, in order; None where it failed."""
+    async def analyse_segment(segment: dict) -> Optional[str]:
+        label = _page_label(segment["page_start"], segment["page_end"])
+        messages = [
+            {"role": "system", "content": "You are a research assistant taking notes on one section of a longer document."},
+            {"role": "user", "content": f"{map_prompt}\n\nSection ({label}):\n{segment['content']}"}
+        ]
+        try:
+            async with call_slots:
+                notes = await get_ai_response_with_retries(messages, model)
+            return notes.strip()
+        except Exception as e:
+            logger.warning(f"Map step failed for {label}: {str(e)}")
+            return None
+        finally:
+            if on_segment_done:
+                await on_segment_done()
+    
+    # gather keeps segment order, so notes stay in document order
+    return await asyncio.gather(*[analyse_segment(segment) for segment in segments])
+
+async def condense_notes(notes: List[str], model: str, call_slots: asyncio.Semaphore) -> List[str]:
+    """Merge notes in rounds, concurrently, until they fit in one prompt for this model"""
+    reduce_budget = context_token_budget(model) * 2
+    while len(notes) > 1 and sum(count_tokens(note) for note in notes) > reduce_budget:
+        groups, group, group_tokens = [], [], 0
+        for note in notes:
+            note_tokens = count_tokens(note)
+            if group and group_tokens + note_tokens > reduce_budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(note)
+            group_tokens += note_tokens
+        groups.append(group)
+        if len(groups) == len(notes):
+            break  # Every note is already at the budget on its own
+        
+        async def merge_notes(group: List[str]) -> List[str]:
+            messages = [
+                {"role": "system", "content": "You are a research assistant consolidating section notes."},
+                {"role": "user", "content": "Merge these section notes into one set of notes, keeping page references:\n\n" + "\n\n".join(group)}
+            ]
+            try:
+                async with call_slots:
+                    return [await get_ai_response_with_retries(messages, model)]
+            except Exception as e:
+                # Keep the group unmerged rather than failing the whole report
+                logger.warning(f"Merging {len(group)} notes failed: {str(e)}")
+                return group
+        
+        merge_groups = [index for index, group in enumerate(groups) if len(group) > 1]
+        merged = await asyncio.gather(*[merge_notes(groups[index]) for index in merge_groups])
+        for index, result in zip(merge_groups, merged):
+            groups[index] = result
+        condensed = [note for group in groups for note in group]
+        if len(condensed) == len(notes):
+            break  # No merge succeeded this round; reduce with what there is
+        notes = condensed
+    return notes
+
+DOCUMENT_SUMMARY_VERSION = 1  # Bump when the summary prompts change so stored summaries are regenerated
+
+def document_summary_model() -> str:
+    return DOCUMENT_SUMMARY_MODEL or ("claude-3-haiku-20240307" if OPENROUTER_API_KEYS else "gemini-1.5-flash")
+
+def _document_summary_key(pdf_doc: dict) -> str:
+    """Summaries are stored by file hash, so re-uploads of the same file reuse them"""
+    return pdf_doc.get("content_hash") or f"document:{pdf_doc['id']}"
+
+def _summary_claimable_filter(now: datetime) -> dict:
+    """Summary records another generation may take over: abandoned placeholders and failures past their backoff"""
+    return {"$or": [
+        {"status": "processing", "updated_at": {"$lt": now - timedelta(seconds=DOCUMENT_SUMMARY_STALE_SECONDS)}},
+        {"status": "processing", "updated_at": {"$exists": False}},
+        {"status": "failed", "retry_after": {"$lte": now}}
+    ]}
+
+async def claim_document_summary(summary_key: str, document_id: str) -> Optional[dict]:
+    """Take the generation lock for a summary: a new placeholder, or a stale or retryable record.
+    Returns the claimed record, or None when the summary is ready or another generation holds it."""
+    now = datetime.utcnow()
+    placeholder = {
+        "summary_key": summary_key,
+        "version": DOCUMENT_SUMMARY_VERSION,
+        "document_id": document_id,
+        "status": "processing",
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+    try:
+        await db.pdf_summaries.insert_one(placeholder)
+        return placeholder
+    except DuplicateKeyError:
+        pass
+    return await db.pdf_summaries.find_one_and_update(
+        {"summary_key": summary_key, "version": DOCUMENT_SUMMARY_VERSION, **_summary_claimable_filter(now)},
+        {"$set": {"status": "processing", "document_id": document_id, "updated_at": now}}
+    )
+
+async def generate_document_summary(document_id: str):
+    """Summarize every segment of a document concurrently, then condense the section summaries into an overview.
+    Only one generation runs per file: the summary record is the lock, kept alive by updated_at as segments finish."""
+    pdf_doc = await db.pdf_documents.find_one({"id": document_id}, {"id": 1, "content_hash": 1, "status": 1, "chunk_count": 1})
+    if not pdf_doc or pdf_doc.get("status") != "ready" or not pdf_doc.get("chunk_count"):
+        return
+    summary_key = _document_summary_key(pdf_doc)
+    claimed = await claim_document_summary(summary_key, document_id)
+    if not claimed:
+        return  # Already stored, being generated, or waiting out a failure backoff
+    record_filter = {"summary_key": summary_key, "version": DOCUMENT_SUMMARY_VERSION}
+    
+    async def heartbeat():
+        await db.pdf_summaries.update_one(record_filter, {"$set": {"updated_at": datetime.utcnow()}})
     
-    if not session.get("pdf_content"):
+    try:
+        model = document_summary_model()
+        segments = await build_research_segments(document_id, model)
+        call_slots = asyncio.Semaphore(ai_call_concurrency(model))
+        segment_summaries = await map_document_segments(segments, RESEARCH_MAP_PROMPTS["summary"], model, call_slots, heartbeat)
+        sections = [
+            {"page_start": segment["page_start"], "page_end": segment["page_end"], "summary": summary}
+            for segment, summary in zip(segments, segment_summaries) if summary
+        ]
+        if not sections:
+            raise RuntimeError("no section could be summarized")
+        
+        notes = await condense_notes(
+            [f"[{_page_label(section['page_start'], section['page_end'])}]\n{section['summary']}" for section in sections],
+            model, call_slots
+        )
+        overview = await get_ai_response_with_retries([
+            {"role": "system", "content": "You are a research assistant writing document summaries."},
+            {"role": "user", "content": "Section summaries covering the whole document:\n\n" + "\n\n".join(notes) + f"\n\nWrite an overview of the whole document in at most {DOCUMENT_SUMMARY_MAX_WORDS} words: its purpose, main points and conclusions, in the order the document presents them."}
+        ], model)
+        
+        await db.pdf_summaries.update_one(record_filter, {
+            "$set": {
+                "status": "ready",
+                "summary": overview.strip(),
+                "sections": sections,
+                "token_count": count_tokens(overview) + sum(count_tokens(section["summary"]) for section in sections),
+                "model": model,
+                "updated_at": datetime.utcnow()
+            },
+            "$unset": {"error": "", "retry_after": ""}
+        })
+        logger.info(f"📝 Document summary ready for {document_id} ({len(sections)} sections)")
+    except BaseException as e:
+        # Cancellation (shutdown) releases the lock right away; failures back off so every feature call
+        # doesn't re-map the whole document
+        cancelled = not isinstance(e, Exception)
+        attempts = claimed.get("attempts", 0) + (0 if cancelled else 1)
+        retry_delay = 0 if cancelled else min(DOCUMENT_SUMMARY_MAX_RETRY_SECONDS, DOCUMENT_SUMMARY_RETRY_SECONDS * 2 ** (attempts - 1))
+        now = datetime.utcnow()
+        try:
+            await db.pdf_summaries.update_one(record_filter, {"$set": {
+                "status": "failed",
+                "error": str(e) or type(e).__name__,
+                "attempts": attempts,
+                "retry_after": now + timedelta(seconds=retry_delay),
+                "updated_at": now
+            }})
+        except Exception as record_error:
+            # The placeholder goes stale and is taken over later
+            logger.warning(f"⚠️ Could not record summary failure for {document_id}: {str(record_error)}")
+        if cancelled:
+            raise
+        logger.warning(f"⚠️ Document summary failed for {document_id} (attempt {attempts}, retry in {retry_delay:.0f}s): {str(e)}")
+
+def schedule_document_summary(document_id: str):
+    if not DOCUMENT_SUMMARY_ENABLED:
+        return
+    task = asyncio.create_task(generate_document_summary(document_id))
+    background_ai_tasks.add(task)
+    task.add_done_callback(background_ai_tasks.discard)
+
+async def load_document_summary(document_id: Optional[str]) -> Optional[dict]:
+    """The stored summary of a document if it is ready. Documents without one (ingested before summaries
+    existed, abandoned mid-generation or past a failure backoff) get one scheduled."""
+    if not document_id or not DOCUMENT_SUMMARY_ENABLED:
+        return None
+    pdf_doc = await db.pdf_documents.find_one({"id": document_id}, {"id": 1, "content_hash": 1, "status": 1})
+    if not pdf_doc:
+        return None
+    record_filter = {"summary_key": _document_summary_key(pdf_doc), "version": DOCUMENT_SUMMARY_VERSION}
+    record = await db.pdf_summaries.find_one(record_filter, {"_id": 0})
+    if pdf_doc.get("status") == "ready" and (
+        not record or record["status"] != "ready" and await db.pdf_summaries.count_documents({**record_filter, **_summary_claimable_filter(datetime.utcnow())}, limit=1)
+    ):
+        schedule_document_summary(document_id)
+    return record if record and record["status"] == "ready" else None
+
+def format_document_summary(record: dict, max_tokens: int) -> str:
+    """Overview followed by the per-section summaries with their page ranges, cut to max_tokens"""
+    sections = "\n\n".join(
+        f"[{_page_label(section['page_start'], section['page_end'])}] {section['summary']}" for section in record["sections"]
+    )
+    text = f"Document overview:\n{record['summary']}\n\nSection summaries:\n{sections}"
+    return _truncate_to_tokens(text, record.get("token_count") or count_tokens(text), max_tokens)
+
+async def run_map_reduce_research(document_id: str, research_type: str, model: str, job_id: Optional[str] = None) -> str:
+    """Analyse every segment of the document concurrently, then reduce the notes into one report"""
+    segments = await build_research_segments(document_id, model)
+    if not segments:
         raise HTTPException(status_code=400, detail="No PDF content available")
     
-    try:
-        # Prepare messages for AI
+    call_slots = asyncio.Semaphore(ai_call_concurrency(model))
+    map_prompt = RESEARCH_MAP_PROMPTS.get(research_type, RESEARCH_MAP_PROMPTS["detailed_research"])
+    progress = {"done": 0}
+    await update_research_job(job_id, status="mapping", segments_total=len(segments), segments_done=0)
+    
+    async def segment_done():
+        progress["done"] += 1
+        await update_research_job(job_id, segments_done=progress["done"])
+    
+    segment_notes = await map_document_segments(segments, map_prompt, model, call_slots, segment_done)
+    notes = [
+        f"[{_page_label(segment['page_start'], segment['page_end'])}]\n{note}"
+        for segment, note in zip(segments, segment_notes) if note
+    ]
+    if not notes:
+        raise HTTPException(status_code=500, detail="Research failed: no section could be analysed")
+    
+    await update_research_job(job_id, status="reducing")
+    # Notes for very long documents are merged in rounds until they fit in one reduce prompt
+    notes = await condense_notes(notes, model, call_slots)
+    
+    messages = [
+        {"role": "system", "content": "You are a research assistant. Analyze the provided PDF content and generate comprehensive research insights."},
+        {"role": "user", "content": "Notes covering the whole document, section by section:\n\n" + "\n\n".join(notes) + f"\n\nResearch Type: {research_type}\n\nProvide a detailed analysis of the whole document based on the research type requested, citing pages where useful."}
+    ]
+    return await get_ai_response(messages, model)
+
+async def run_research(session: dict, request: ResearchRequest, job_id: Optional[str] = None) -> tuple[str, str]:
+    """Run research in the requested mode and save the result as a message. Returns (content, mode used)."""
+    mode = request.mode
+    document_id = session.get("pdf_document_id")
+    if mode == "auto":
+        mode = "single"
+        if request.research_type == "detailed_research" and document_id:
+            pdf_doc = await db.pdf_documents.find_one({"id": document_id}, {"token_count": 1, "chunk_count": 1})
+            if pdf_doc and pdf_doc.get("chunk_count") and (pdf_doc.get("token_count") or 0) > context_token_budget(request.model):
+                mode = "map_reduce"
+    
+    if mode == "map_reduce":
+        if not document_id:
+            raise HTTPException(status_code=400, detail="No PDF content available")
+        ai_response = await run_map_reduce_research(document_id, request.research_type, request.model, job_id)
+    else:
+        # Summaries are written from the stored document summary when there is one; otherwise retrieve the passages
+        # each part of the analysis needs, rather than only the opening of the document
+        document_summary = await load_document_summary(document_id) if request.research_type == "summary" else None
+        if document_summary:
+            pdf_content = format_document_summary(document_summary, context_token_budget(request.model))
+        else:
+            research_queries = RESEARCH_QUERIES.get(request.research_type, RESEARCH_QUERIES["summary"])
+            pdf_content = await pack_session_pdf_context(session, context_token_budget(request.model), queries=research_queries)
+        if not pdf_content:
+            raise HTTPException(status_code=400, detail="No PDF content available")
+        await update_research_job(job_id, status="mapping", segments_total=1)
+        
         messages = [
             {"role": "system", "content": "You are a research assistant. Analyze the provided PDF content and generate comprehensive research insights."},
-            {"role": "user", "content": f"PDF Content: {session['pdf_content'][:4000]}...\n\nResearch Type: {request.research_type}\n\nProvide a detailed analysis based on the research type requested."}
+            {"role": "user", "content": f"PDF Content: {pdf_content}...\n\nResearch Type: {request.research_type}\n\nProvide a detailed analysis based on the research type requested."}
         ]
-        
-        # Get AI response
         ai_response = await get_ai_response(messages, request.model)
-        
-        # Save as message
-        message = ChatMessage(
-            session_id=request.session_id,
-            content=ai_response,
-            role="assistant",
-            feature_type="research"
-        )
-        await db.chat_messages.insert_one(message.dict())
-        
-        return {"research_content": ai_response}
+        await update_research_job(job_id, segments_done=1)
+    
+    # Save as message
+    message = ChatMessage(
+        session_id=request.session_id,
+        content=ai_response,
+        role="assistant",
+        feature_type="research"
+    )
+    await store_chat_message(message)
+    return ai_response, mode
+
+async def run_research_job(job: ResearchJob, session: dict, request: ResearchRequest):
+    try:
+        result, mode = await run_research(session, request, job.id)
+        await update_research_job(job.id, status="completed", mode=mode, result=result)
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.error(f"Research job {job.id} failed: {detail}")
+        await update_research_job(job.id, status="failed", error=detail)
+
+@api_router.post("/research")
+async def research_content(request: ResearchRequest, async_mode: bool = Query(False, alias="async")):
+    """Generate research content from PDF"""
+    session = await db.chat_sessions.find_one({"id": request.session_id}, SESSION_PROJECTION)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if async_mode:
+        # Long map-reduce runs are polled through GET /api/research-jobs/{id}
+        job = ResearchJob(session_id=request.session_id, research_type=request.research_type, mode=request.mode)
+        await db.research_jobs.insert_one(job.dict())
+        task = asyncio.create_task(run_research_job(job, session, request))
+        background_ai_tasks.add(task)
+        task.add_done_callback(background_ai_tasks.discard)
+        return JSONResponse(status_code=202, content={
+            "message": "Research started",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/research-jobs/{job.id}"
+        })
+    
+    try:
+        ai_response, mode = await run_research(session, request)
+        return {"research_content": ai_response, "mode": mode}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Research error: {e}")
         raise HTTPException(status_code=500, detail=f"Research failed: {str(e)}")
+
+@api_router.get("/research-jobs/{job_id}", response_model=ResearchJob)
+async def get_research_job(job_id: str):
+    job = await db.research_jobs.find_one({"id": job_id})
+    if not job:
+        raise HTTPException(status_code=404, detail="Research job not found")
+    return ResearchJob(**job)
+
 async def get_insights():
     # Get total sessions
     total_sessions = await db.chat_sessions.count_documents({})
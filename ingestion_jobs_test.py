@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+PDF Ingestion Tests for ChatPDF Backend
+Tests background ingestion jobs (upload with ?async=true, GET /api/ingest-jobs/{id}), upload deduplication, batch uploads
+and multi-document sessions (upload with ?append=true)
+"""
+import requests
+import json
+import os
+import time
+import zipfile
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv('/app/frontend/.env.development')
+
+# Backend URL configuration
+API_URL = "http://localhost:8001/api"
+
+print(f"Testing ChatPDF PDF ingestion at: {API_URL}")
+
+def create_test_pdf(path, page_count, label):
+    """Create a multi-page PDF with unique text so it isn't deduplicated against other runs"""
+    from reportlab.pdfgen import canvas
+    c = canvas.Canvas(path)
+    for page in range(page_count):
+        c.drawString(100, 750, f"{label} - page {page + 1}")
+        c.drawString(100, 700, f"Ingestion test content generated at {time.time()}")
+        c.showPage()
+    c.save()
+
+class IngestionTest:
+    def __init__(self):
+        self.test_sessions = []
+        self.test_results = {
+            "async_upload": False,
+            "job_polling": False,
+            "deduplication": False,
+            "batch_upload": False,
+            "multi_document_session": False
+        }
+        self.job_id = None
+        self.document_id = None
+
+    def create_session(self, title):
+        response = requests.post(f"{API_URL}/sessions", json={"title": title})
+        assert response.status_code == 200, f"Session creation failed: {response.status_code}"
+        session_id = response.json()["id"]
+        self.test_sessions.append(session_id)
+        return session_id
+
+    def cleanup_test_sessions(self):
+        """Clean up any test sessions created during testing"""
+        for session_id in self.test_sessions:
+            try:
+                requests.delete(f"{API_URL}/sessions/{session_id}")
+            except:
+                pass
+        self.test_sessions.clear()
+
+    def test_async_upload(self):
+        """Test that ?async=true returns 202 with a job id"""
+        print("\n=== Testing Async PDF Upload ===")
+
+        try:
+            session_id = self.create_session("Async Ingestion Test")
+            pdf_path = "/tmp/test_async_ingestion.pdf"
+            create_test_pdf(pdf_path, 60, "Async ingestion test")
+
+            start_time = time.time()
+            with open(pdf_path, "rb") as pdf_file:
+                files = {"file": ("test_async_ingestion.pdf", pdf_file, "application/pdf")}
+                response = requests.post(f"{API_URL}/sessions/{session_id}/upload-pdf?async=true", files=files)
+            elapsed = (time.time() - start_time) * 1000
+            os.remove(pdf_path)
+
+            print(f"Async upload status: {response.status_code} ({elapsed:.0f} ms)")
+            print(f"Response: {json.dumps(response.json(), indent=2)}")
+
+            assert response.status_code == 202
+            data = response.json()
+            assert "job_id" in data
+            assert data["status_url"] == f"/api/ingest-jobs/{data['job_id']}"
+
+            self.job_id = data["job_id"]
+            self.async_session_id = session_id
+            print("✅ Async upload returned 202 with a job id")
+            self.test_results["async_upload"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Async upload test failed: {str(e)}")
+            return False
+
+    def test_job_polling(self):
+        """Test polling the ingestion job until it completes"""
+        print("\n=== Testing Ingestion Job Polling ===")
+
+        if not self.job_id:
+            print("❌ No ingestion job available for polling test")
+            return False
+
+        try:
+            job = None
+            for _ in range(60):
+                response = requests.get(f"{API_URL}/ingest-jobs/{self.job_id}")
+                assert response.status_code == 200
+                job = response.json()
+                print(f"Job status: {job['status']} ({job['pages_done']}/{job['pages_total']} pages)")
+                if job["status"] in ["completed", "failed"]:
+                    break
+                time.sleep(1)
+
+            assert job["status"] == "completed", f"Job ended with status {job['status']}: {job.get('error')}"
+            assert job["pages_total"] == 60
+            assert job["pages_done"] == 60
+            assert job["document_id"]
+            self.document_id = job["document_id"]
+
+            # The session should now reference the stored document
+            sessions = requests.get(f"{API_URL}/sessions").json()
+            session = next(s for s in sessions if s["id"] == self.async_session_id)
+            assert session["pdf_document_id"] == job["document_id"]
+            assert session["pdf_filename"] == "test_async_ingestion.pdf"
+            assert session["pdf_page_count"] == 60
+            assert session["ingested_pages"] == 60
+
+            # Unknown jobs are a 404
+            missing = requests.get(f"{API_URL}/ingest-jobs/does-not-exist")
+            assert missing.status_code == 404
+
+            print("✅ Ingestion job completed and linked the session")
+            self.test_results["job_polling"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Job polling test failed: {str(e)}")
+            return False
+
+    def test_deduplication(self):
+        """Test that uploading the same file twice reuses the stored document"""
+        print("\n=== Testing Upload Deduplication ===")
+
+        try:
+            pdf_path = "/tmp/test_dedup_ingestion.pdf"
+            create_test_pdf(pdf_path, 2, "Deduplication test")
+
+            responses = []
+            for title in ["Dedup Test 1", "Dedup Test 2"]:
+                session_id = self.create_session(title)
+                with open(pdf_path, "rb") as pdf_file:
+                    files = {"file": ("test_dedup_ingestion.pdf", pdf_file, "application/pdf")}
+                    responses.append(requests.post(f"{API_URL}/sessions/{session_id}/upload-pdf", files=files))
+            os.remove(pdf_path)
+
+            first, second = [r.json() for r in responses]
+            print(f"First upload: {json.dumps(first, indent=2)}")
+            print(f"Second upload: {json.dumps(second, indent=2)}")
+
+            assert responses[0].status_code == 200 and responses[1].status_code == 200
+            assert first["deduplicated"] is False
+            assert second["deduplicated"] is True
+            assert first["document_id"] == second["document_id"]
+
+            print("✅ Second upload linked to the existing document")
+            self.test_results["deduplication"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Deduplication test failed: {str(e)}")
+            return False
+
+    def test_batch_upload(self):
+        """Test uploading several PDFs plus a zip in one request with streamed per-file results"""
+        print("\n=== Testing Batch Upload ===")
+
+        try:
+            paths = [f"/tmp/test_batch_{i}.pdf" for i in range(3)]
+            for i, path in enumerate(paths):
+                create_test_pdf(path, 3, f"Batch upload test file {i}")
+            zip_path = "/tmp/test_batch.zip"
+            with zipfile.ZipFile(zip_path, "w") as archive:
+                archive.write(paths[1], "nested/test_batch_1.pdf")  # Same file as a direct upload
+                archive.write(paths[2], "test_batch_2.pdf")
+
+            handles = [open(path, "rb") for path in paths[:2]] + [open(zip_path, "rb")]
+            try:
+                files = [
+                    ("files", ("test_batch_0.pdf", handles[0], "application/pdf")),
+                    ("files", ("test_batch_1.pdf", handles[1], "application/pdf")),
+                    ("files", ("test_batch.zip", handles[2], "application/zip")),
+                ]
+                response = requests.post(f"{API_URL}/batch-upload", files=files, stream=True)
+                assert response.status_code == 200, f"Batch upload failed: {response.status_code}"
+                lines = [json.loads(line) for line in response.iter_lines() if line]
+            finally:
+                for handle in handles:
+                    handle.close()
+                for path in paths + [zip_path]:
+                    os.remove(path)
+
+            for line in lines:
+                print(f"Result: {json.dumps(line)}")
+            results, summary = lines[:-1], lines[-1]["summary"]
+            self.test_sessions.extend(r["session_id"] for r in results)
+
+            assert summary == {"total": 4, "completed": 4, "failed": 0}
+            assert all(r["status"] == "completed" and r["page_count"] == 3 for r in results)
+            by_name = {}
+            for r in results:
+                by_name.setdefault(r["filename"], []).append(r)
+            # The duplicate inside the zip reuses the document of the direct upload
+            assert len({r["document_id"] for r in by_name["test_batch_1.pdf"]}) == 1
+            assert sum(r["deduplicated"] for r in by_name["test_batch_1.pdf"]) == 1
+
+            print("✅ Batch upload processed every file and streamed per-file results")
+            self.test_results["batch_upload"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Batch upload test failed: {str(e)}")
+            return False
+
+    def test_multi_document_session(self):
+        """Test attaching several PDFs to one session, replacing them and detaching one"""
+        print("\n=== Testing Multi-Document Sessions ===")
+
+        try:
+            session_id = self.create_session("Multi-Document Test")
+            uploads = []
+            for i in range(3):
+                pdf_path = f"/tmp/test_multi_document_{i}.pdf"
+                create_test_pdf(pdf_path, 2, f"Multi-document test file {i}")
+                with open(pdf_path, "rb") as pdf_file:
+                    files = {"file": (f"test_multi_document_{i}.pdf", pdf_file, "application/pdf")}
+                    # The first upload starts the session; the next ones are attached next to it
+                    query = "?append=true" if i in (1, 2) else ""
+                    response = requests.post(f"{API_URL}/sessions/{session_id}/upload-pdf{query}", files=files)
+                os.remove(pdf_path)
+                assert response.status_code == 200, f"Upload {i} failed: {response.status_code}"
+                uploads.append(response.json())
+
+            sessions = requests.get(f"{API_URL}/sessions").json()
+            session = next(s for s in sessions if s["id"] == session_id)
+            print(f"Session documents: {json.dumps(session['documents'], indent=2)}")
+            assert [d["document_id"] for d in session["documents"]] == [u["document_id"] for u in uploads]
+            assert session["pdf_document_id"] == uploads[2]["document_id"]
+            assert session["pdf_filename"] == "test_multi_document_2.pdf"
+
+            # Detaching the latest document makes the previous one current
+            response = requests.delete(f"{API_URL}/sessions/{session_id}/documents/{uploads[2]['document_id']}")
+            assert response.status_code == 200
+            assert len(response.json()["documents"]) == 2
+            sessions = requests.get(f"{API_URL}/sessions").json()
+            session = next(s for s in sessions if s["id"] == session_id)
+            assert session["pdf_document_id"] == uploads[1]["document_id"]
+
+            missing = requests.delete(f"{API_URL}/sessions/{session_id}/documents/does-not-exist")
+            assert missing.status_code == 404
+
+            # A plain upload still replaces every attached document
+            pdf_path = "/tmp/test_multi_document_replace.pdf"
+            create_test_pdf(pdf_path, 1, "Multi-document replacement")
+            with open(pdf_path, "rb") as pdf_file:
+                files = {"file": ("test_multi_document_replace.pdf", pdf_file, "application/pdf")}
+                response = requests.post(f"{API_URL}/sessions/{session_id}/upload-pdf", files=files)
+            os.remove(pdf_path)
+            assert response.status_code == 200
+            sessions = requests.get(f"{API_URL}/sessions").json()
+            session = next(s for s in sessions if s["id"] == session_id)
+            assert [d["filename"] for d in session["documents"]] == ["test_multi_document_replace.pdf"]
+
+            print("✅ Session attached, detached and replaced documents")
+            self.test_results["multi_document_session"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Multi-document session test failed: {str(e)}")
+            return False
+
+    def run_all_tests(self):
+        """Run all ingestion tests"""
+        print("=" * 80)
+        print("CHATPDF PDF INGESTION TEST SUITE")
+        print("=" * 80)
+
+        tests = [
+            ("Async Upload", self.test_async_upload),
+            ("Job Polling", self.test_job_polling),
+            ("Deduplication", self.test_deduplication),
+            ("Batch Upload", self.test_batch_upload),
+            ("Multi-Document Session", self.test_multi_document_session),
+        ]
+
+        results = {}
+
+        for test_name, test_func in tests:
+            print(f"\n{'='*20} {test_name} {'='*20}")
+            try:
+                results[test_name] = test_func()
+            except Exception as e:
+                print(f"❌ {test_name} failed with exception: {str(e)}")
+                results[test_name] = False
+
+        self.cleanup_test_sessions()
+
+        # Print summary
+        print("\n" + "=" * 80)
+        print("PDF INGESTION TEST SUMMARY")
+        print("=" * 80)
+
+        passed = 0
+        total = len(results)
+
+        for test_name, result in results.items():
+            status = "✅ PASSED" if result else "❌ FAILED"
+            print(f"{test_name}: {status}")
+            if result:
+                passed += 1
+
+        print(f"\nOverall Result: {passed}/{total} tests passed")
+
+        if passed == total:
+            print("🎉 ALL PDF INGESTION TESTS PASSED!")
+            return True
+        else:
+            print("⚠️  SOME PDF INGESTION TESTS FAILED")
+            return False
+
+if __name__ == "__main__":
+    tester = IngestionTest()
+    success = tester.run_all_tests()
+    exit(0 if success else 1)
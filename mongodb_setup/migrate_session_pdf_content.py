@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+ChatPDF Session Migration Script
+Moves inline PDF text out of chat_sessions documents. Each session is linked
+to a pdf_documents record through pdf_document_id and its pdf_content field is removed.
+"""
+
+import argparse
+import os
+import sys
+import uuid
+from datetime import datetime
+
+import pymongo
+import pymongo.errors
+
+
+def find_or_create_document(db, session, dry_run):
+    """Return the id of a pdf_documents record holding this session's text"""
+    # Reuse an existing record when the session already points at one that still exists
+    if session.get("pdf_document_id"):
+        if db.pdf_documents.find_one({"id": session["pdf_document_id"]}, {"_id": 1}):
+            return session["pdf_document_id"], False
+
+    # Uploads always wrote the same text to both collections, so most sessions have an exact match
+    existing = db.pdf_documents.find_one(
+        {"filename": session.get("pdf_filename"), "content": session["pdf_content"]},
+        {"id": 1}
+    )
+    if existing:
+        return existing["id"], False
+
+    document = {
+        "id": str(uuid.uuid4()),
+        "filename": session.get("pdf_filename") or "unknown.pdf",
+        "content": session["pdf_content"],
+        "upload_date": session.get("updated_at") or session.get("created_at") or datetime.utcnow(),
+        "file_size": len(session["pdf_content"].encode("utf-8"))
+        # No content_hash: the original file isn't available, and the unique sparse index still indexes nulls
+    }
+    if not dry_run:
+        db.pdf_documents.insert_one(document)
+    return document["id"], True
+
+
+def migrate_sessions(dry_run=False):
+    """Rewrite every session that still stores its PDF text inline"""
+    MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+    DB_NAME = os.environ.get("DB_NAME", "chatpdf_database")
+
+    print(f"🚀 Migrating chat_sessions in {DB_NAME}{' (dry run)' if dry_run else ''}...")
+
+    try:
+        client = pymongo.MongoClient(MONGO_URL)
+        client.admin.command('ping')
+        print("✅ MongoDB connection successful")
+    except Exception as e:
+        print(f"❌ MongoDB connection failed: {e}")
+        return False
+
+    db = client[DB_NAME]
+
+    stats = {"linked": 0, "created_documents": 0, "cleared_empty": 0, "bytes_removed": 0, "failed": 0}
+
+    cursor = db.chat_sessions.find(
+        {"pdf_content": {"$exists": True}},
+        {"id": 1, "pdf_filename": 1, "pdf_content": 1, "pdf_document_id": 1, "created_at": 1, "updated_at": 1}
+    )
+    for session in cursor:
+        update = {"$unset": {"pdf_content": ""}}
+
+        # One bad row is reported and skipped; the rest of the sessions are still migrated
+        try:
+            if session.get("pdf_content"):
+                document_id, created = find_or_create_document(db, session, dry_run)
+                update["$set"] = {"pdf_document_id": document_id}
+            if not dry_run:
+                db.chat_sessions.update_one({"_id": session["_id"]}, update)
+        except pymongo.errors.PyMongoError as e:
+            stats["failed"] += 1
+            print(f"⚠️  Session {session.get('id')} not migrated: {e}")
+            continue
+
+        if session.get("pdf_content"):
+            stats["linked"] += 1
+            stats["created_documents"] += int(created)
+            stats["bytes_removed"] += len(session["pdf_content"].encode("utf-8"))
+        else:
+            stats["cleared_empty"] += 1
+
+    print("📊 Migration Statistics:")
+    print(f"  Sessions linked to pdf_documents: {stats['linked']}")
+    print(f"  pdf_documents records created: {stats['created_documents']}")
+    print(f"  Empty pdf_content fields removed: {stats['cleared_empty']}")
+    print(f"  Inline text removed from sessions: {stats['bytes_removed'] / 1024:.1f} KB")
+    if stats["failed"]:
+        print(f"  Sessions that failed to migrate: {stats['failed']} (re-run the script to retry them)")
+        return False
+    print("\n🎉 Migration completed successfully!")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move inline PDF text from chat_sessions to pdf_documents references")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    success = migrate_sessions(dry_run=args.dry_run)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+PDF Backend Benchmark for ChatPDF Backend
+Compares the extraction backends (PyPDF2, pypdf, pdfminer.six, pdftotext) on the bundled sample PDFs
+and a synthetic corpus, reporting pages/sec and memory use so PDF_EXTRACTION_BACKENDS can be chosen per deployment
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+# The server module refuses to import without an AI key; extraction never calls the AI providers
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark-placeholder-key")
+
+import psutil  # noqa: E402
+import server  # noqa: E402
+from pdf_extraction_benchmark import create_synthetic_pdf  # noqa: E402
+
+
+def run_backend(backend, pdf_path, repeats):
+    """Extract a whole PDF with a single backend. Runs in a fresh process so RSS is per backend."""
+    baseline_rss = psutil.Process().memory_info().rss
+    page_count = server._count_pdf_pages(pdf_path, backends=[backend])
+
+    timings = []
+    chars = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        pages = server._extract_pdf_page_range(pdf_path, 0, page_count, backends=[backend])
+        timings.append(time.perf_counter() - start)
+        chars = sum(len(page) for page in pages)
+
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    best = min(timings)
+    return {
+        "pages": page_count,
+        "seconds": best,
+        "pages_per_sec": page_count / best if best > 0 else float("inf"),
+        "peak_rss_mb": peak_rss / (1024 * 1024),
+        "rss_delta_mb": max(0, peak_rss - baseline_rss) / (1024 * 1024),
+        "chars": chars
+    }
+
+
+def benchmark_document(label, pdf_path, backends, repeats):
+    results = []
+    spawn = multiprocessing.get_context("spawn")
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            try:
+                result = pool.submit(run_backend, backend, pdf_path, repeats).result()
+                result.update({"document": label, "backend": backend})
+            except Exception as e:
+                result = {"document": label, "backend": backend, "error": str(e)}
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction backends")
+    parser.add_argument("--backends", default=",".join(server.PDF_EXTRACTION_BACKEND_REGISTRY),
+                        help="Comma separated backends to compare (default: all)")
+    parser.add_argument("--synthetic-pages", default="20,200", help="Comma separated page counts for the synthetic corpus")
+    parser.add_argument("--pdf", action="append", default=[], help="Extra PDF to include (repeatable)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    requested = [b.strip().lower() for b in args.backends.split(",") if b.strip()]
+    backends = server.available_pdf_extraction_backends(requested)
+    skipped = [b for b in requested if b not in backends]
+    if skipped:
+        print(f"Skipping unavailable backends: {', '.join(skipped)}")
+    if not backends:
+        print("❌ No extraction backends available")
+        sys.exit(1)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = [(name, str(ROOT_DIR / name)) for name in ["sample.pdf", "sample2.pdf"] if (ROOT_DIR / name).exists()]
+        corpus += [(os.path.basename(path), path) for path in args.pdf]
+        for pages in [int(p) for p in args.synthetic_pages.split(",") if p.strip()]:
+            path = os.path.join(tmp_dir, f"synthetic-{pages}.pdf")
+            create_synthetic_pdf(path, pages)
+            corpus.append((f"synthetic ({pages} pages)", path))
+
+        for label, path in corpus:
+            print(f"Benchmarking {label} with {', '.join(backends)}...")
+            results.extend(benchmark_document(label, path, backends, args.repeats))
+
+    print("\n" + "=" * 100)
+    print(f"{'Document':<26} {'Backend':<10} {'Pages':>6} {'Pages/sec':>10} {'Peak RSS MB':>12} {'RSS +MB':>9} {'Chars':>10}")
+    print("-" * 100)
+    for r in results:
+        if "error" in r:
+            print(f"{r['document']:<26} {r['backend']:<10} failed: {r['error']}")
+            continue
+        print(f"{r['document']:<26} {r['backend']:<10} {r['pages']:>6} {r['pages_per_sec']:>10.1f} "
+              f"{r['peak_rss_mb']:>12.1f} {r['rss_delta_mb']:>9.1f} {r['chars']:>10}")
+    print("=" * 100)
+
+
+if __name__ == "__main__":
+    main()
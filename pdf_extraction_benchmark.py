@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+PDF Extraction Benchmark for ChatPDF Backend
+Measures pages/sec of the page-parallel extraction pipeline across worker counts
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+# The server module refuses to import without an AI key; extraction never calls the AI providers
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark-placeholder-key")
+
+import server  # noqa: E402
+
+
+def create_synthetic_pdf(path, page_count, lines_per_page=45):
+    """Write a text-heavy PDF with the given number of pages"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=letter)
+    for page in range(page_count):
+        c.setFont("Helvetica", 10)
+        y = 750
+        for line in range(lines_per_page):
+            c.drawString(50, y, f"Page {page + 1} line {line + 1}: the quick brown fox jumps over the lazy dog {page * line}")
+            y -= 15
+        c.showPage()
+    c.save()
+
+
+async def benchmark_workers(pdf_path, page_count, worker_counts, repeats):
+    """Run the real extraction pipeline once per worker count and collect timings"""
+    results = []
+    for workers in worker_counts:
+        server.PDF_EXTRACTION_WORKERS = workers
+        server.start_pdf_extraction_pool()
+        # Warm up the pool so process start-up isn't counted
+        await server.extract_pages_from_pdf(pdf_path)
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            pages = await server.extract_pages_from_pdf(pdf_path)
+            timings.append(time.perf_counter() - start)
+            assert len(pages) == page_count, f"expected {page_count} pages, got {len(pages)}"
+
+        best = min(timings)
+        results.append({"workers": workers, "seconds": best, "pages_per_sec": page_count / best})
+    server.pdf_extraction_pool.shutdown(wait=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark page-parallel PDF extraction")
+    parser.add_argument("--pages", type=int, default=500, help="Pages in the synthetic PDF")
+    parser.add_argument("--pdf", help="Benchmark an existing PDF instead of a synthetic one")
+    parser.add_argument("--workers", default=None, help="Comma separated worker counts (default: 1,2,4,... up to CPU count)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    cpu_count = os.cpu_count() or 1
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(",")]
+    else:
+        worker_counts = []
+        w = 1
+        while w < cpu_count:
+            worker_counts.append(w)
+            w *= 2
+        worker_counts.append(cpu_count)
+
+    # Force the parallel path so every worker count is exercised
+    server.PDF_PARALLEL_PAGE_THRESHOLD = 1
+    server.PDF_EXTRACTION_TIMEOUT = 3600
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.pdf:
+            pdf_path = args.pdf
+            page_count = server._count_pdf_pages(pdf_path)
+        else:
+            pdf_path = os.path.join(tmp_dir, "synthetic.pdf")
+            print(f"Generating synthetic {args.pages}-page PDF...")
+            create_synthetic_pdf(pdf_path, args.pages)
+            page_count = args.pages
+
+        print(f"Benchmarking {page_count} pages on {cpu_count} CPUs, worker counts: {worker_counts}")
+        results = asyncio.run(benchmark_workers(pdf_path, page_count, worker_counts, args.repeats))
+
+    baseline = results[0]["pages_per_sec"]
+    print("\n" + "=" * 60)
+    print(f"{'Workers':>8} {'Seconds':>10} {'Pages/sec':>12} {'Speedup':>10}")
+    print("-" * 60)
+    for r in results:
+        print(f"{r['workers']:>8} {r['seconds']:>10.2f} {r['pages_per_sec']:>12.1f} {r['pages_per_sec'] / baseline:>9.2f}x")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Retrieval Tests for ChatPDF Backend
+Uploads PDFs through the API, then runs the backend's retrieval functions against the same database to check that a
+query finds the page it appears on - through BM25, vector search, their reciprocal rank fusion and the session-wide
+ranking across several documents
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+import requests
+
+# Load environment variables
+load_dotenv('/app/frontend/.env.development')
+
+# Backend URL configuration
+API_URL = "http://localhost:8001/api"
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+import server  # noqa: E402
+
+print(f"Testing ChatPDF retrieval at: {API_URL}")
+
+PAGE_COUNT = 12
+TARGET_PAGE = 7
+TARGET_SENTENCE = "The quokka colony nests beside the abandoned lighthouse on the northern cape."
+QUERY = "where does the quokka colony nest"
+
+FILLER_WORDS = [
+    "ledger", "invoice", "turbine", "harvest", "granite", "voltage", "orchard", "mortgage", "satellite", "pipeline",
+    "enzyme", "tariff", "glacier", "circuit", "mineral", "freight", "antenna", "lumber", "reservoir", "compiler"
+]
+
+def create_test_pdf(path, label, target_page=None, seed=0):
+    """Create a PDF whose pages each fill about one retrieval chunk, with TARGET_SENTENCE on target_page only"""
+    from reportlab.pdfgen import canvas
+    rng = random.Random(seed)
+    c = canvas.Canvas(path)
+    for page in range(1, PAGE_COUNT + 1):
+        y = 780
+        lines = [f"{label} page {page} generated at {time.time()}"]
+        # Distinct filler per line, so normalization doesn't strip it as a repeated header
+        lines += [f"Item {page}.{n}: " + " ".join(rng.choice(FILLER_WORDS) for _ in range(10)) for n in range(45)]
+        if page == target_page:
+            lines.insert(20, TARGET_SENTENCE)
+        for line in lines:
+            c.drawString(40, y, line)
+            y -= 16
+        c.showPage()
+    c.save()
+
+def covers_target(chunk):
+    return chunk["page_start"] <= TARGET_PAGE <= chunk["page_end"]
+
+class RetrievalTest:
+    def __init__(self):
+        self.test_sessions = []
+        self.test_results = {
+            "bm25": False,
+            "vector_search": False,
+            "fusion": False,
+            "session_ranking": False
+        }
+        self.document_id = None
+        self.other_document_id = None
+
+    def upload(self, title, filename, target_page, seed, session_id=None, append=False):
+        if not session_id:
+            response = requests.post(f"{API_URL}/sessions", json={"title": title})
+            assert response.status_code == 200, f"Session creation failed: {response.status_code}"
+            session_id = response.json()["id"]
+            self.test_sessions.append(session_id)
+        pdf_path = f"/tmp/{filename}"
+        create_test_pdf(pdf_path, title, target_page, seed)
+        with open(pdf_path, "rb") as pdf_file:
+            files = {"file": (filename, pdf_file, "application/pdf")}
+            query = "?append=true" if append else ""
+            response = requests.post(f"{API_URL}/sessions/{session_id}/upload-pdf{query}", files=files)
+        os.remove(pdf_path)
+        assert response.status_code == 200, f"Upload failed: {response.status_code}"
+        return session_id, response.json()["document_id"]
+
+    def cleanup_test_sessions(self):
+        """Clean up any test sessions created during testing"""
+        for session_id in self.test_sessions:
+            try:
+                requests.delete(f"{API_URL}/sessions/{session_id}")
+            except:
+                pass
+        self.test_sessions.clear()
+
+    async def fetch_chunk(self, document_id, chunk_index):
+        return await server.db.pdf_chunks.find_one(
+            {"document_id": document_id, "chunk_index": chunk_index},
+            {"_id": 0, "chunk_index": 1, "page_start": 1, "page_end": 1}
+        )
+
+    async def test_bm25(self):
+        """Test that the best BM25 chunk covers the page with the query terms"""
+        print("\n=== Testing BM25 Retrieval ===")
+
+        try:
+            scores = await server._bm25_scores(self.document_id, QUERY)
+            assert scores, "BM25 returned no scores"
+            best_index = max(scores, key=scores.get)
+            chunk = await self.fetch_chunk(self.document_id, best_index)
+            print(f"Best BM25 chunk: {chunk} (score {scores[best_index]:.2f})")
+            assert covers_target(chunk), f"Expected page {TARGET_PAGE}"
+
+            print("✅ BM25 found the right page")
+            self.test_results["bm25"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ BM25 test failed: {str(e)}")
+            return False
+
+    async def test_vector_search(self):
+        """Test that the nearest chunk by cosine similarity covers the page with the query"""
+        print("\n=== Testing Vector Search ===")
+
+        try:
+            if not server._module_available("numpy"):
+                print("⚠️  numpy not installed on the backend, vector search disabled")
+                self.test_results["vector_search"] = True
+                return True
+            [hits] = await server.search_document_vectors(self.document_id, [QUERY], 3)
+            assert hits, "Vector search returned no hits"
+            chunk = await self.fetch_chunk(self.document_id, hits[0][0])
+            print(f"Nearest chunk: {chunk} (cosine {hits[0][1]:.3f})")
+            assert covers_target(chunk), f"Expected page {TARGET_PAGE}"
+
+            print("✅ Vector search found the right page")
+            self.test_results["vector_search"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Vector search test failed: {str(e)}")
+            return False
+
+    async def test_fusion(self):
+        """Test that reciprocal rank fusion ranks the page with the query first"""
+        print("\n=== Testing Rank Fusion ===")
+
+        try:
+            chunks = await server.retrieve_relevant_chunks(self.document_id, [QUERY], top_k=3)
+            for chunk in chunks:
+                print(f"Chunk {chunk['chunk_index']}: pages {chunk['page_start']}-{chunk['page_end']} (score {chunk['score']:.4f})")
+            assert chunks, "Fusion returned no chunks"
+            assert covers_target(chunks[0]), f"Expected page {TARGET_PAGE} first"
+            assert TARGET_SENTENCE.split()[1] in chunks[0]["content"]
+
+            print("✅ Fused ranking put the right page first")
+            self.test_results["fusion"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Fusion test failed: {str(e)}")
+            return False
+
+    async def test_session_ranking(self):
+        """Test that a session-wide ranking prefers the document that mentions the query over an unrelated one"""
+        print("\n=== Testing Session-Wide Ranking ===")
+
+        try:
+            documents = [
+                {"document_id": self.other_document_id, "filename": "retrieval_unrelated.pdf"},
+                {"document_id": self.document_id, "filename": "retrieval_target.pdf"}
+            ]
+            chunks = await server.retrieve_session_chunks(documents, [QUERY], top_k=3)
+            for chunk in chunks:
+                print(f"{chunk['filename']} pages {chunk['page_start']}-{chunk['page_end']} (score {chunk['score']:.4f})")
+            assert chunks, "Session ranking returned no chunks"
+            assert chunks[0]["filename"] == "retrieval_target.pdf"
+            assert covers_target(chunks[0]), f"Expected page {TARGET_PAGE} first"
+
+            print("✅ Session ranking put the right document and page first")
+            self.test_results["session_ranking"] = True
+            return True
+
+        except Exception as e:
+            print(f"❌ Session ranking test failed: {str(e)}")
+            return False
+
+    async def run_retrieval_tests(self):
+        tests = [
+            ("BM25", self.test_bm25),
+            ("Vector Search", self.test_vector_search),
+            ("Rank Fusion", self.test_fusion),
+            ("Session Ranking", self.test_session_ranking),
+        ]
+        results = {}
+        for test_name, test_func in tests:
+            print(f"\n{'='*20} {test_name} {'='*20}")
+            try:
+                results[test_name] = await test_func()
+            except Exception as e:
+                print(f"❌ {test_name} failed with exception: {str(e)}")
+                results[test_name] = False
+        return results
+
+    def run_all_tests(self):
+        """Run all retrieval tests"""
+        print("=" * 80)
+        print("CHATPDF RETRIEVAL TEST SUITE")
+        print("=" * 80)
+
+        try:
+            session_id, self.document_id = self.upload("Retrieval Test", "retrieval_target.pdf", TARGET_PAGE, seed=1)
+            _, self.other_document_id = self.upload("Retrieval Test", "retrieval_unrelated.pdf", None, seed=2,
+                                                    session_id=session_id, append=True)
+            results = asyncio.run(self.run_retrieval_tests())
+        except Exception as e:
+            print(f"❌ Test setup failed: {str(e)}")
+            results = {"Setup": False}
+
+        self.cleanup_test_sessions()
+
+        # Print summary
+        print("\n" + "=" * 80)
+        print("RETRIEVAL TEST SUMMARY")
+        print("=" * 80)
+
+        passed = 0
+        total = len(results)
+
+        for test_name, result in results.items():
+            status = "✅ PASSED" if result else "❌ FAILED"
+            print(f"{test_name}: {status}")
+            if result:
+                passed += 1
+
+        print(f"\nOverall Result: {passed}/{total} tests passed")
+
+        if passed == total:
+            print("🎉 ALL RETRIEVAL TESTS PASSED!")
+            return True
+        else:
+            print("⚠️  SOME RETRIEVAL TESTS FAILED")
+            return False
+
+if __name__ == "__main__":
+    tester = RetrievalTest()
+    success = tester.run_all_tests()
+    exit(0 if success else 1)
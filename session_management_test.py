@@ -193,7 +193,7 @@ class SessionManagementTest:
                     
                     if updated_session:
                         assert updated_session["pdf_filename"] == "test_session_update.pdf"
-                        assert updated_session["pdf_content"] is not None
+                        assert updated_session["pdf_document_id"] is not None
                         print("✅ Session updated correctly after PDF upload")
                         self.test_results["session_update"] = True
                         return True